@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import zlib
+import logging
+import threading
+from typing import *
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+
+BLOCK_SIZE = 2 ** 20
+
+
+@dataclass
+class ArchiveEntry:
+    name: str
+    user: str
+    entry_creation_time: float
+    size: int
+    stored: int
+    blocks: List[List[int]]
+
+
+class LogArchive(object):
+    def __init__(self, path: str, max_bytes: int, max_age: float, cache_bytes: int = 2 ** 26) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.cache_bytes = cache_bytes
+        self.lock = threading.Lock()
+        self.entries: Dict[str, ArchiveEntry] = dict()
+        self.cache: 'OrderedDict[Tuple[str, int], bytes]' = OrderedDict()
+        self.cached = 0
+        os.makedirs(path, exist_ok=True)
+        index = os.path.join(path, 'index.json')
+        if os.path.exists(index):
+            with open(index) as fi:
+                for k, v in json.load(fi).items():
+                    if os.path.exists(self.file_of(k)):
+                        self.entries[k] = ArchiveEntry(**v)
+
+    def file_of(self, short_id: str):
+        return os.path.join(self.path, short_id + '.log.z')
+
+    def save(self):
+        index = os.path.join(self.path, 'index.json')
+        with open(index + '.tmp', 'w') as fo:
+            json.dump({k: asdict(v) for k, v in self.entries.items()}, fo)
+        os.replace(index + '.tmp', index)
+
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+    def __contains__(self, short_id: str):
+        return short_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def total_stored(self):
+        return sum(v.stored for v in self.entries.values())
+
+    def put(self, short_id: str, name: str, user: str, chunks: Iterable[bytes]):
+        fn = self.file_of(short_id)
+        blocks = []
+        size = 0
+        offset = 0
+        buf = bytearray()
+        with open(fn + '.tmp', 'wb') as fo:
+
+            def flush(data: bytes):
+                nonlocal offset
+                z = zlib.compress(data, 6)
+                fo.write(z)
+                blocks.append([offset, len(z), len(data), data.count(b'\n')])
+                offset += len(z)
+
+            for b in chunks:
+                buf += b
+                size += len(b)
+                while len(buf) >= BLOCK_SIZE:
+                    flush(bytes(buf[:BLOCK_SIZE]))
+                    del buf[:BLOCK_SIZE]
+            if len(buf):
+                flush(bytes(buf))
+        os.replace(fn + '.tmp', fn)
+        with self.lock:
+            self.drop_cached(short_id)
+            self.entries[short_id] = ArchiveEntry(name, user, time.time(), size, offset, blocks)
+            self.save()
+        self.expire()
+
+    def pop(self, short_id: str):
+        with self.lock:
+            entry = self.entries.pop(short_id)
+            self.drop_cached(short_id)
+            self.save()
+        try:
+            os.remove(self.file_of(short_id))
+        except FileNotFoundError:
+            pass
+        return entry
+
+    def expire(self, now: Optional[float] = None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            by_age = sorted(self.entries.items(), key=lambda kv: kv[1].entry_creation_time)
+            total = self.total_stored()
+        expired = []
+        for k, v in by_age:
+            if now > v.entry_creation_time + self.max_age or total > self.max_bytes:
+                expired.append(k)
+                total -= v.stored
+        for k in expired:
+            if k in self.entries:
+                self.pop(k)
+        if len(expired):
+            logging.info("expired %d archived logs, %d bytes kept", len(expired), total)
+        return expired
+
+    def drop_cached(self, short_id: str):
+        for key in [key for key in self.cache if key[0] == short_id]:
+            self.cached -= len(self.cache.pop(key))
+
+    def block(self, short_id: str, i: int):
+        with self.lock:
+            data = self.cache.get((short_id, i))
+            if data is not None:
+                self.cache.move_to_end((short_id, i))
+                return data
+            offset, stored = self.entries[short_id].blocks[i][:2]
+        with open(self.file_of(short_id), 'rb') as fi:
+            fi.seek(offset)
+            data = zlib.decompress(fi.read(stored))
+        with self.lock:
+            if (short_id, i) not in self.cache and len(data) <= self.cache_bytes:
+                self.cache[(short_id, i)] = data
+                self.cached += len(data)
+                while self.cached > self.cache_bytes:
+                    self.cached -= len(self.cache.popitem(last=False)[1])
+        return data
+
+    def iter_blocks(self, short_id: str, first: int = 0):
+        for i in range(first, len(self.entries[short_id].blocks)):
+            yield self.block(short_id, i)
+
+    def read(self, short_id: str):
+        return b''.join(self.iter_blocks(short_id))
+
+    def read_tail(self, short_id: str, limit: int):
+        blocks = self.entries[short_id].blocks
+        first = len(blocks)
+        kept = 0
+        while first > 0 and kept < limit:
+            first -= 1
+            kept += blocks[first][2]
+        return b''.join(self.iter_blocks(short_id, first))[-limit:]
+
+    def size(self, short_id: str):
+        return self.entries[short_id].size
+
+    def span(self, short_id: str, start: int, end: int):
+        pos = 0
+        for i, blk in enumerate(self.entries[short_id].blocks):
+            nxt = pos + blk[2]
+            if nxt > start and pos < end:
+                data = self.block(short_id, i)
+                yield data[max(start - pos, 0): end - pos]
+            pos = nxt
+            if pos >= end:
+                return
+
+    def tail_offset(self, short_id: str, lines: int):
+        blocks = self.entries[short_id].blocks
+        if lines <= 0 or not len(blocks):
+            return self.size(short_id) if lines <= 0 else 0
+        need = lines + (1 if self.block(short_id, len(blocks) - 1).endswith(b'\n') else 0)
+        pos = self.size(short_id)
+        for i in reversed(range(len(blocks))):
+            pos -= blocks[i][2]
+            count = blocks[i][3]
+            if count < need:
+                need -= count
+                continue
+            data = self.block(short_id, i)
+            cut = len(data)
+            for _ in range(need):
+                cut = data.rindex(b'\n', 0, cut)
+            return pos + cut + 1
+        return 0
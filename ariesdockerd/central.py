@@ -1,34 +1,53 @@
+import os
+import time
 import uuid
 import json
 import random
 import logging
 import asyncio
+import functools
 import websockets
 from typing import *
+from dataclasses import dataclass
 from collections import Counter
 from .auth import run_auth
 from .error import AriesError
 from .config import get_config
-from .protocol import command_handler, NoResponse, AsyncClient
-from .scheduling import schedule
+from .protocol import command_handler, common_task_callback, NoResponse, AsyncClient
+from .protocol import decode, send, relay, negotiate, set_codec, make_limits, command_stats
+from .scheduling import schedule, fragmentation
+from .cluster import ClusterView, job_of
+from .fanout import fanout
+from .jobqueue import JobQueue, PendingJob, eligible, fits
+from .reservations import ReservationTable
+from .stats import Phases, PhaseStats
 
 
 class CentralState:
     auth_kind: Optional[str] = None
     auth_name: Optional[str] = None
     callback: Optional[Callable[[str], None]] = None
+    cleanup: Optional[Callable[[], None]] = None
 
 
 state_store: Dict[websockets.WebSocketServerProtocol, CentralState] = dict()
 daemons: Set[AsyncClient] = set()
+daemon_nodes: Dict[str, AsyncClient] = dict()
+# follower id -> (node, last time a client used it)
+followers: Dict[str, Tuple[str, float]] = dict()
+cluster = ClusterView()
+command_limits = None
+resyncing: Set[str] = set()
 
 
 async def auth_handler(ws: websockets.WebSocketServerProtocol, payload):
-    decode = run_auth(payload['token'])
+    decoded = run_auth(payload['token'])
     cs = state_store[ws]
-    cs.auth_kind = decode['kind']
-    cs.auth_name = decode['user']
-    return dict(user=cs.auth_name)
+    cs.auth_kind = decoded['kind']
+    cs.auth_name = decoded['user']
+    codec = negotiate(payload.get('codecs'))
+    set_codec(ws, codec)
+    return dict(user=cs.auth_name, codec=codec)
 
 
 def check_auth(ws: websockets.WebSocketServerProtocol, expected_kind: str = 'user'):
@@ -48,28 +67,62 @@ def bypass_daemon(ws: websockets.WebSocketServerProtocol, message):
 
 
 async def daemon_handler(ws: websockets.WebSocketServerProtocol, payload):
-    check_auth(ws, 'daemon')
+    node = check_auth(ws, 'daemon')
     ac = AsyncClient(ws)
     daemons.add(ac)
+    daemon_nodes[node] = ac
 
     def daemon_callback(x):
-        payload: dict = json.loads(x)
+        payload: dict = decode(x)
         if payload.get('cmd') == 'tcprecv':
-            asyncio.create_task(tcprecv_handler(payload))
+            asyncio.create_task(tcprecv_handler(payload, x))
+        elif payload.get('cmd') == 'stream_chunk':
+            route = streams.get(payload['stream'])
+            if route is not None:
+                route.chunks.put_nowait((payload, x))
+            else:
+                asyncio.create_task(send(ws, dict(ticket=0, cmd='stream_cancel', stream=payload['stream'])))
+        elif payload.get('cmd') == 'node_state':
+            if cluster.apply(node, payload):
+                resyncing.discard(node)
+                if 'free_gpu_ids' in payload:
+                    kick_queue()
+            elif node not in resyncing:
+                resync_node(ac, node)
         else:
             ac.result(payload)
 
-    state_store[ws].callback = daemon_callback
-    try:
-        await ws.wait_closed()
-    except Exception:
-        import traceback
-        traceback.print_exc()
-    finally:
+    def daemon_cleanup():
         daemons.remove(ac)
+        ac.abort(AriesError(10, 'daemon `%s` disconnected' % node))
+        if daemon_nodes.get(node) is not ac:
+            # a newer connection for this node already took over its state
+            return
+        daemon_nodes.pop(node)
+        for follower, (snode, _) in list(followers.items()):
+            if snode == node:
+                followers.pop(follower)
+        cluster.drop(node)
+        resyncing.discard(node)
+
+    state_store[ws].callback = daemon_callback
+    state_store[ws].cleanup = daemon_cleanup
+    resync_node(ac, node)
     raise NoResponse
 
 
+def resync_node(daemon: AsyncClient, node: str):
+
+    async def _resync():
+        res = await daemon.issue('node_resync', dict())
+        if res['code'] != 0:
+            resyncing.discard(node)
+            logging.warning("node state resync failed for %s: %s", node, res.get('msg'))
+
+    resyncing.add(node)
+    asyncio.create_task(_resync()).add_done_callback(common_task_callback('node-resync'))
+
+
 def tyck(obj, ty, name):
     if not isinstance(obj, ty):
         raise AriesError(8, 'bad request: %s should be %s, got %s' % (name, ty.__name__, type(obj)))
@@ -104,20 +157,222 @@ def cat_aggregate(results: List[dict]):
     return x
 
 
-async def daemon_broadcast(cmd: str, args: dict, aggregator: Callable):
-    tasks = [
-        asyncio.create_task(daemon.issue(cmd, args))
-        for daemon in daemons
+async def daemon_fanout(nodes: Iterable[str], cmd: str, args: dict, read: bool = False):
+    cfg = get_config()
+    calls = {
+        node: functools.partial(daemon_nodes[node].issue, cmd, args)
+        for node in nodes if node in daemon_nodes
+    }
+    if read:
+        res = await fanout(calls, cfg.fanout_deadline, cfg.fanout_hedge)
+    else:
+        res = await fanout(calls)
+    for node, exc in res.errors.items():
+        res.results[node] = dict(ticket=None, code=-1, msg=repr(exc))
+    if len(res.missed):
+        logging.warning("daemons missed deadline for `%s`: %s", cmd, res.missed)
+    return res
+
+
+async def daemon_broadcast(cmd: str, args: dict, aggregator: Callable, read: bool = False):
+    res = await daemon_fanout(list(daemon_nodes), cmd, args, read)
+    if not len(res.results):
+        raise AriesError(22, 'no daemon answered `%s`, missed: %s' % (cmd, res.missed))
+    result = aggregator(list(res.results.values()))
+    if len(res.missed):
+        result['missed'] = res.missed
+    return result
+
+
+async def daemon_route(node: Optional[str], cmd: str, args: dict, aggregator: Callable, read: bool = False):
+    if node not in daemon_nodes:
+        return await daemon_broadcast(cmd, args, aggregator, read)
+    res = await daemon_fanout([node], cmd, args, read)
+    if not len(res.results):
+        raise AriesError(22, 'daemon `%s` missed the deadline for `%s`' % (node, cmd))
+    return aggregator(list(res.results.values()))
+
+
+@dataclass
+class StreamRoute:
+    client: websockets.WebSocketServerProtocol
+    daemon: AsyncClient
+    chunks: asyncio.Queue
+    forwarder: Optional[asyncio.Task] = None
+
+
+streams: Dict[str, StreamRoute] = dict()
+
+
+async def forward_stream(route: StreamRoute):
+    while True:
+        chunk = await route.chunks.get()
+        if chunk is None:
+            return
+        try:
+            await relay(route.client, *chunk)
+        except websockets.ConnectionClosed:
+            return
+
+
+async def relay_stream(ws: websockets.WebSocketServerProtocol, node: str, cmd: str, args: dict):
+    cfg = get_config()
+    daemon = daemon_nodes[node]
+    sid = uuid.uuid4().hex
+    route = streams[sid] = StreamRoute(ws, daemon, asyncio.Queue())
+    route.forwarder = asyncio.create_task(forward_stream(route))
+    try:
+        res = await daemon.issue(cmd, dict(args, stream=sid, window=cfg.log_stream_window, chunk=cfg.log_chunk_size))
+    finally:
+        streams.pop(sid, None)
+        route.chunks.put_nowait(None)
+        await route.forwarder
+    res.pop('ticket')
+    return dict(res, stream=sid)
+
+
+def drop_streams(ws: websockets.WebSocketServerProtocol):
+    for sid, route in list(streams.items()):
+        if route.client is ws:
+            asyncio.create_task(send(route.daemon.ws, dict(ticket=0, cmd='stream_cancel', stream=sid)))
+
+
+async def stream_control_handler(ws: websockets.WebSocketServerProtocol, payload):
+    check_auth(ws)
+    sid = payload['stream']
+    tyck(sid, str, 'stream')
+    route = streams.get(sid)
+    if route is not None and route.client is ws:
+        await send(route.daemon.ws, dict(ticket=0, cmd=payload['cmd'], stream=sid, seq=payload.get('seq')))
+    raise NoResponse
+
+
+def log_args(payload):
+    args = dict()
+    for key in ['tail', 'offset', 'length']:
+        if payload.get(key) is not None:
+            tyck(payload[key], int, key)
+            args[key] = payload[key]
+    return args
+
+
+async def broadcast_locate(container: str):
+    res = await daemon_fanout(list(daemon_nodes), 'node_info', dict(include_finalized=True), True)
+    found = [
+        node for node, result in res.results.items()
+        if result['code'] == 0 and (container in result['names'] or any(x.startswith(container) for x in result['ids']))
     ]
-    await asyncio.wait(tasks)
-    return aggregator([task.result() for task in tasks])
+    if len(found) > 1:
+        raise AriesError(15, 'container ambiguous across nodes: %s' % sorted(found))
+    if not len(found):
+        raise AriesError(17, "container `%s` not found" % container)
+    return found[0]
 
 
 async def logs_handler(ws: websockets.WebSocketServerProtocol, payload):
     check_auth(ws)
     container = payload['container']
     tyck(container, str, 'container')
-    return await daemon_broadcast('get_logs', dict(container=container), any_aggregate)
+    args = dict(container=container, **log_args(payload))
+    stream = payload.get('stream', False)
+    tyck(stream, bool, 'stream')
+    follow = payload.get('follow', False)
+    tyck(follow, bool, 'follow')
+    node = cluster.locate(container)
+    if follow and node not in daemon_nodes:
+        node = await broadcast_locate(container)
+    if not stream and not follow or node not in daemon_nodes:
+        return await daemon_route(node, 'get_logs', args, any_aggregate, True)
+    return await relay_stream(ws, node, 'get_logs', dict(args, follow=follow))
+
+
+def search_nodes(filt: str):
+    nodes = []
+    for node in daemon_nodes:
+        state = cluster.nodes.get(node)
+        if state is None or any(
+            key.startswith(filt) for field in ['names', 'ids', 'finalized_names', 'finalized_ids']
+            for key in getattr(state, field)
+        ):
+            nodes.append(node)
+    return nodes
+
+
+async def logsearch_handler(ws: websockets.WebSocketServerProtocol, payload):
+    check_auth(ws)
+    cfg = get_config()
+    pattern = payload['pattern']
+    tyck(pattern, str, 'pattern')
+    filt = payload.get('filt') or ''
+    tyck(filt, str, 'filt')
+    context = payload.get('context', 0)
+    tyck(context, int, 'context')
+    limit = payload.get('limit', cfg.logsearch_max_matches)
+    tyck(limit, int, 'limit')
+    ignore_case = payload.get('ignore_case', False)
+    tyck(ignore_case, bool, 'ignore_case')
+    limit = max(0, min(limit, cfg.logsearch_max_matches))
+    args = dict(
+        log_args(payload), pattern=pattern, filt=filt,
+        context=max(0, min(context, 20)), limit=limit, ignore_case=ignore_case,
+        # daemons stop a little early so partial results still make it back in time
+        timeout=cfg.logsearch_deadline * 0.9
+    )
+    for key in ['since', 'until']:
+        if payload.get(key) is not None:
+            tyck(payload[key], int, key)
+            args[key] = payload[key]
+    calls = {
+        node: functools.partial(daemon_nodes[node].issue, 'search_logs', args)
+        for node in search_nodes(filt)
+    }
+    res = await fanout(calls, cfg.logsearch_deadline)
+    matches = []
+    truncated = False
+    errors = dict()
+    for node, exc in res.errors.items():
+        errors[node] = repr(exc)
+    for node, result in res.results.items():
+        if result['code'] != 0:
+            errors[node] = '%d %s' % (result['code'], result['msg'])
+            continue
+        matches.extend(result['matches'])
+        truncated = truncated or result['truncated']
+        for container, msg in result['errors'].items():
+            errors['%s/%s' % (node, container)] = msg
+    matches.sort(key=lambda m: (m['container'], m['offset'] or 0))
+    if len(matches) > limit:
+        matches, truncated = matches[:limit], True
+    return dict(matches=matches, truncated=truncated, errors=errors, missed=res.missed)
+
+
+async def prepull_handler(ws: websockets.WebSocketServerProtocol, payload):
+    check_auth(ws)
+    images = payload['images']
+    tyck(images, list, 'images')
+    for image in images:
+        tyck(image, str, 'image')
+    targets = eligible(dict(
+        node_exclude=list(filter(None, payload.get('node_exclude', '').split(','))),
+        node_include=list(filter(None, payload.get('node_include', '').split(','))),
+    ), {node: [] for node in daemon_nodes})
+    if not len(targets):
+        raise AriesError(19, "all nodes excluded")
+    calls = {
+        node: functools.partial(daemon_nodes[node].issue, 'prepull', dict(images=images))
+        for node in targets
+    }
+    res = await fanout(calls, get_config().prepull_deadline)
+    nodes = dict()
+    errors = {node: repr(exc) for node, exc in res.errors.items()}
+    for node, result in res.results.items():
+        if result['code'] != 0:
+            errors[node] = '%d %s' % (result['code'], result['msg'])
+            continue
+        nodes[node] = dict(pulled=result['pulled'], cached=result['cached'])
+        for image, msg in result['errors'].items():
+            errors['%s/%s' % (node, image)] = msg
+    return dict(nodes=nodes, errors=errors, missed=res.missed)
 
 
 async def ps_handler(ws: websockets.WebSocketServerProtocol, payload):
@@ -125,43 +380,43 @@ async def ps_handler(ws: websockets.WebSocketServerProtocol, payload):
     filt = payload.get('filt')
     if filt is not None:
         tyck(filt, str, 'filt')
-    res = await daemon_broadcast('list_containers', dict(), cat_aggregate)
+    res = await daemon_broadcast('list_containers', dict(), cat_aggregate, True)
     return dict(containers={
         k: v
-        for k, v in res['containers'].items()
+        for k, v in res.get('containers', {}).items()
         if filt is None or filt in k or filt in v['name'] or filt in v['user']
-    })
+    }, missed=res.get('missed', []))
 
 
 async def stop_handler(ws: websockets.WebSocketServerProtocol, payload):
     check_auth(ws)
     container = payload['container']
     tyck(container, str, 'container')
-    return await daemon_broadcast('stop_container', dict(container=container), any_aggregate)
+    return await daemon_route(cluster.locate(container), 'stop_container', dict(container=container), any_aggregate)
 
 
 async def kill_handler(ws: websockets.WebSocketServerProtocol, payload):
     check_auth(ws)
     container = payload['container']
     tyck(container, str, 'container')
-    return await daemon_broadcast('kill_container', dict(container=container), any_aggregate)
+    return await daemon_route(cluster.locate(container), 'kill_container', dict(container=container), any_aggregate)
 
 
 async def jstop_handler(ws: websockets.WebSocketServerProtocol, payload):
     check_auth(ws)
     job = payload['job']
     tyck(job, str, 'job')
-    nodes = await collect_nodes(False)
+    nodes, _ = await cluster_nodes(False, is_fresh(payload), cluster.job_nodes(job))
     tasks = []
-    for daemon in daemons:
-        node = state_store[daemon.ws].auth_name
-        for snode, info in nodes.items():
-            if snode == node:
-                for name in info['names']:
-                    if name.startswith(job + '-') and str.isnumeric(name[len(job) + 1:]):
-                        tasks.append(asyncio.create_task(
-                            daemon.issue('stop_container', dict(container=name)))
-                        )
+    for node, info in nodes.items():
+        daemon = daemon_nodes.get(node)
+        if daemon is None:
+            continue
+        for name in info['names']:
+            if job_of(name) == job:
+                tasks.append(asyncio.create_task(
+                    daemon.issue('stop_container', dict(container=name)))
+                )
     if len(tasks) == 0:
         raise AriesError(16, 'no such job to act on')
     await asyncio.wait(tasks)
@@ -172,17 +427,17 @@ async def jremove_handler(ws: websockets.WebSocketServerProtocol, payload):
     check_auth(ws)
     job = payload['job']
     tyck(job, str, 'job')
-    nodes = await collect_nodes(True)
+    nodes, _ = await cluster_nodes(True, is_fresh(payload), cluster.job_nodes(job))
     tasks = []
-    for daemon in daemons:
-        node = state_store[daemon.ws].auth_name
-        for snode, info in nodes.items():
-            if snode == node:
-                for name in info['names']:
-                    if name.startswith(job + '-') and str.isnumeric(name[len(job) + 1:]):
-                        tasks.append(asyncio.create_task(
-                            daemon.issue('remove_container', dict(container=name)))
-                        )
+    for node, info in nodes.items():
+        daemon = daemon_nodes.get(node)
+        if daemon is None:
+            continue
+        for name in info['names']:
+            if job_of(name) == job:
+                tasks.append(asyncio.create_task(
+                    daemon.issue('remove_container', dict(container=name)))
+                )
     if len(tasks) == 0:
         raise AriesError(16, 'no such job to act on')
     await asyncio.wait(tasks)
@@ -193,118 +448,425 @@ async def remove_handler(ws: websockets.WebSocketServerProtocol, payload):
     check_auth(ws)
     container = payload['container']
     tyck(container, str, 'container')
-    return await daemon_broadcast('remove_container', dict(container=container), any_aggregate)
-
-
-async def collect_nodes(include_finalized):
-    tasks = dict()
-    logging.debug("# daemon: %d", len(daemons))
-    for daemon in daemons:
-        name = state_store[daemon.ws].auth_name
-        tasks[name] = asyncio.create_task(daemon.issue('node_info', dict(include_finalized=include_finalized)))
-    for name, task in list(tasks.items()):
-        tasks[name] = await task
-    return tasks
+    return await daemon_route(cluster.locate(container), 'remove_container', dict(container=container), any_aggregate)
+
+
+async def collect_nodes(include_finalized, names: Optional[Iterable[str]] = None):
+    logging.debug("# daemon: %d", len(daemon_nodes))
+    if names is None:
+        names = list(daemon_nodes)
+    res = await daemon_fanout(names, 'node_info', dict(include_finalized=include_finalized), True)
+    nodes = dict()
+    missed = list(res.missed)
+    for name, info in res.results.items():
+        if info['code'] != 0:
+            logging.warning("node_info failed on %s: %s", name, info.get('msg'))
+            missed.append(name)
+            continue
+        info.pop('code')
+        info.pop('ticket')
+        nodes[name] = info
+    return nodes, sorted(missed)
+
+
+async def cluster_nodes(include_finalized, fresh=False, only: Optional[Set[str]] = None):
+    if fresh:
+        return await collect_nodes(include_finalized)
+    nodes = dict()
+    unknown = []
+    for name in daemon_nodes:
+        state = cluster.nodes.get(name)
+        if state is None:
+            unknown.append(name)
+        elif only is None or name in only:
+            nodes[name] = state.info(include_finalized)
+    if not len(unknown):
+        return nodes, []
+    collected, missed = await collect_nodes(include_finalized, unknown)
+    nodes.update(collected)
+    return nodes, missed
+
+
+def is_fresh(payload):
+    fresh = payload.get('fresh', False)
+    tyck(fresh, bool, 'fresh')
+    return fresh
 
 
 async def nodes_handler(ws: websockets.WebSocketServerProtocol, payload):
     check_auth(ws)
-    nodes = await collect_nodes(False)
-    return dict(nodes=nodes)
+    nodes, missed = await cluster_nodes(False, is_fresh(payload))
+    return dict(nodes=nodes, missed=missed, version=cluster.version)
+
+
+leases = ReservationTable(900.0)
+job_queue = JobQueue()
+launch_stats = PhaseStats()
+queue_kick: Optional[asyncio.Event] = None
+protect_kick: Optional[asyncio.Event] = None
+
+
+def parse_run(payload: dict):
+    spec = dict(
+        n_jobs=payload.get('n_jobs'),
+        n_gpus=payload['n_gpus'],
+        name=payload['name'],
+        image=payload['image'],
+        exec=payload['exec'],
+        env=payload.get('env') or [],
+        timeout=int(payload.get('timeout', 0)),
+        node_exclude=list(filter(None, payload.get('node_exclude', '').split(','))),
+        node_include=list(filter(None, payload.get('node_include', '').split(','))),
+        placement=payload.get('placement') or get_config().placement_policy,
+        rollback=bool(payload.get('rollback', False)),
+    )
+    if spec['placement'] not in ['greedy', 'batch']:
+        raise AriesError(24, 'unknown placement policy: %s' % spec['placement'])
+    if spec['n_gpus'] not in [0, 1, 2, 4, 8, 16]:
+        raise AriesError(11, "NGPUs should be in [0, 1, 2, 4, 8, 16]")
+    if spec['n_jobs'] is None:
+        policy = get_config()
+        if spec['n_gpus'] > 0 and spec['timeout'] <= 0 or spec['timeout'] > policy.policy_pod_time_limit:
+            raise AriesError(20, 'timeout policy: non-batch workload should have time limit <= %d' % policy.policy_pod_time_limit)
+        if spec['n_gpus'] > policy.policy_pod_gpu_limit:
+            raise AriesError(21, 'gpu policy: non-batch workload should have gpu <= %d' % policy.policy_pod_gpu_limit)
+    return spec
+
 
+def free_gpus(nodes: Dict[str, dict]):
+    return leases.apply({node: info['free_gpu_ids'] for node, info in nodes.items()})
 
-sched_lock = list()
+
+def reserve(user: str, spec: dict, sched: List[Tuple[str, List[int]]]):
+    held: Dict[str, List[str]] = dict()
+    for node, gpus in sched:
+        held.setdefault(node, []).append(leases.reserve(node, gpus, user, spec['name']).lease_id)
+    return held
 
 
 async def run_handler(ws: websockets.WebSocketServerProtocol, payload: dict):
     user = check_auth(ws)
-    n_jobs = payload.get('n_jobs')
-    n_gpus = payload['n_gpus']
-    name = payload['name']
-    image = payload['image']
-    cmd = payload['exec']
-    env = payload.get('env', [])
-    timeout = int(payload.get('timeout', 0))
-    exc = payload.get('node_exclude', '').split(',')
-    inc = payload.get('node_include', '').split(',')
-    exc = list(filter(None, exc))
-    inc = list(filter(None, inc))
-    if n_jobs is None:
-        policy = get_config()
-        if n_gpus > 0 and timeout <= 0 or timeout > policy.policy_pod_time_limit:
-            raise AriesError(20, 'timeout policy: non-batch workload should have time limit <= %d' % policy.policy_pod_time_limit)
-        if n_gpus > policy.policy_pod_gpu_limit:
-            raise AriesError(21, 'gpu policy: non-batch workload should have gpu <= %d' % policy.policy_pod_gpu_limit)
-    nodes = await collect_nodes(True)
-    available = {}
-    for node, info in nodes.items():
-        if n_jobs is None:
-            if name in info['names']:
-                raise AriesError(14, 'container of same name already exists!')
-        else:
-            for i in range(n_jobs):
-                if ('%s-%d' % (name, i)) in info['names']:
-                    raise AriesError(14, 'container of same name already exists!')
-        if node in exc:
+    spec = parse_run(payload)
+    # None queues the job only when it cannot be placed now, True always queues, False never does
+    queued = payload.get('queue')
+    if queued is not None:
+        tyck(queued, bool, 'queue')
+    job = PendingJob('', user, spec, 0)
+    phases = Phases()
+    nodes, _ = await cluster_nodes(True, is_fresh(payload))
+    phases.mark('collect')
+    for failed in job_queue.failed_of(user):
+        # resubmitting under the name of one's own failed entry retries it
+        if set(failed.names) & set(job.names):
+            job_queue.remove(failed)
+    taken = job_queue.names()
+    for info in nodes.values():
+        taken.update(info['names'])
+    if any(name in taken for name in job.names):
+        raise AriesError(14, 'container of same name already exists!')
+    if not len(eligible(spec, nodes)):
+        raise AriesError(19, "all nodes excluded")
+    phases.mark('check')
+    known = cluster.capacity()
+    capacity = {node: known.get(node) for node in nodes}
+    if not fits(spec, capacity):
+        raise AriesError(12, 'no eligible node has %d gpus, job can never be scheduled' % spec['n_gpus'])
+    if queued:
+        return enqueue(user, spec)
+    topology = cluster.topology()
+    available = eligible(spec, job_queue.headroom(free_gpus(nodes), topology, capacity))
+    try:
+        sched = schedule(
+            available, spec['n_jobs'], spec['n_gpus'], topology, spec['placement'], cluster.image_nodes(spec['image'])
+        )
+    except AriesError as exc:
+        if exc.args[0] != 12 or queued is False:
+            raise
+        return enqueue(user, spec)
+    phases.mark('schedule')
+    held = reserve(user, spec, sched)
+    phases.mark('reserve')
+    res = await launch(user, spec, sched, held, phases)
+    res['fragmentation'] = fragmentation(available)
+    res['failed'] = failed_jobs(user)
+    return res
+
+
+def enqueue(user: str, spec: dict):
+    job = job_queue.submit(user, spec)
+    kick_queue()
+    return dict(queued=job.job_id, position=len(job_queue.jobs), failed=failed_jobs(user))
+
+
+def failed_jobs(user: str):
+    return [dict(job_id=job.job_id, name=job.spec['name'], error=job.error) for job in job_queue.failed_of(user)]
+
+
+async def launch(user: str, spec: dict, sched: List[Tuple[str, List[int]]], held: Dict[str, List[str]], phases: Optional[Phases] = None):
+    if phases is None:
+        phases = Phases()
+    wants_rollback = spec.get('rollback', False)
+    batches: Dict[str, List[dict]] = dict()
+    for i, (snode, gpus) in enumerate(sched):
+        batches.setdefault(snode, []).append(dict(
+            name='%s-%d' % (spec['name'], i) if spec['n_jobs'] is not None else spec['name'],
+            gpu_ids=gpus,
+            image=spec['image'],
+            exec=spec['exec'],
+            user=user,
+            env=spec['env'],
+            timeout=spec['timeout']
+        ))
+    res = await fanout({
+        node: functools.partial(launch_batch, node, specs, held.get(node, []))
+        for node, specs in batches.items()
+    })
+    phases.mark('dispatch')
+    containers = dict()
+    timings = dict()
+    errors = dict()
+    launched: Dict[str, List[str]] = dict()
+    for node, specs in batches.items():
+        if node in res.errors:
+            for spec in specs:
+                errors[spec['name']] = 'error from daemon: %d %s' % (-1, repr(res.errors[node]))
+            # the daemon may have started some of them before the call failed
+            launched.setdefault(node, []).extend(spec['name'] for spec in specs)
             continue
-        if len(inc) and node not in inc:
+        for spec in specs:
+            result = res.results[node][spec['name']]
+            timings[spec['name']] = result.get('timings', dict())
+            if result['code'] != 0:
+                errors[spec['name']] = 'error from daemon: %d %s' % (result['code'], result['msg'])
+                launch_stats.record(timings[spec['name']], 'failed.node.')
+                continue
+            containers[spec['name']] = result['short_id']
+            launched.setdefault(node, []).append(spec['name'])
+            launch_stats.record(timings[spec['name']], 'node.')
+    # failed launches are recorded apart so slow failures neither vanish nor skew the success latencies
+    launch_stats.record(phases.timings, '' if not len(errors) else 'failed.')
+    res = dict(containers=containers, timings=dict(central=phases.timings, containers=timings))
+    if not len(errors):
+        return res
+    msg = '%d of %d containers failed to launch, first: %s' % (len(errors), len(sched), next(iter(errors.values())))
+    if wants_rollback and len(launched):
+        await rollback(launched)
+        containers.clear()
+        msg += ', launched containers were rolled back'
+    return dict(res, code=10, msg=msg, errors=errors)
+
+
+async def rollback(launched: Dict[str, List[str]]):
+    # only on request (run --rollback): all-or-nothing gang jobs are useless half started
+
+    async def kill_all(node: str, names: List[str]):
+        daemon = daemon_nodes.get(node)
+        if daemon is None:
+            raise AriesError(17, 'node `%s` disconnected before rollback' % node)
+        return await asyncio.gather(*[daemon.issue('kill_container', dict(container=name)) for name in names])
+
+    res = await fanout({node: functools.partial(kill_all, node, names) for node, names in launched.items()})
+    for node, exc in res.errors.items():
+        logging.warning("cannot roll back %s on %s: %r", launched[node], node, exc)
+
+
+def kick_queue():
+    if protect_kick is not None:
+        protect_kick.set()
+    if queue_kick is not None and len(job_queue.jobs):
+        queue_kick.set()
+
+
+async def drain_queue():
+    nodes, _ = await cluster_nodes(True)
+    known = cluster.capacity()
+    capacity = {node: known.get(node) for node in nodes}
+    placements, _ = job_queue.plan(free_gpus(nodes), cluster.topology(), cluster.image_nodes, capacity)
+    for job, sched in placements:
+        job_queue.remove(job)
+        held = reserve(job.user, job.spec, sched)
+        logging.info("launching pending job %s (%s) for %s", job.job_id, job.spec['name'], job.user)
+        task = asyncio.create_task(launch_pending(job, sched, held))
+        task.add_done_callback(common_task_callback('pending-job-%s' % job.job_id))
+
+
+async def launch_pending(job: PendingJob, sched: List[Tuple[str, List[int]]], held: Dict[str, List[str]]):
+    try:
+        res = await launch(job.user, job.spec, sched, held)
+        if res.get('code', 0) != 0:
+            raise AriesError(res['code'], res['msg'])
+    except Exception as exc:
+        error = exc.args[1] if isinstance(exc, AriesError) else repr(exc)
+        logging.warning("pending job %s (%s) failed to launch: %s", job.job_id, job.spec['name'], error)
+        job_queue.fail(job, error)
+
+
+async def push_protected(pushed: Dict[str, Tuple[Any, List[str]]]):
+    images = sorted({job.spec['image'] for job in job_queue.jobs})
+    stale = [node for node, daemon in daemon_nodes.items() if pushed.get(node) != (daemon, images)]
+    if not len(stale):
+        return
+    res = await daemon_fanout(stale, 'protect_images', dict(images=images), True)
+    for node, result in res.results.items():
+        if result['code'] == 0:
+            pushed[node] = daemon_nodes.get(node), images
+
+
+async def protect_pusher():
+    # a slow daemon must not hold up scheduling, so protected images go out on their own loop
+    pushed: Dict[str, Tuple[Any, List[str]]] = dict()
+    while not stop_signal.done():
+        try:
+            await asyncio.wait_for(protect_kick.wait(), 30)
+        except asyncio.TimeoutError:
+            pass
+        protect_kick.clear()
+        try:
+            await push_protected(pushed)
+        except Exception:
+            logging.exception("cannot push protected images")
+
+
+async def queue_scheduler():
+    while not stop_signal.done():
+        try:
+            await asyncio.wait_for(queue_kick.wait(), 30)
+        except asyncio.TimeoutError:
+            pass
+        queue_kick.clear()
+        for job in job_queue.expire_failed(get_config().queue_failed_ttl):
+            logging.info("failed pending job %s (%s) expired", job.job_id, job.spec['name'])
+        if not len(job_queue.jobs):
             continue
-        available[node] = info['free_gpu_ids']
-    if len(available) == 0:
-        raise AriesError(19, "all nodes excluded")
-    for node, gpus in sched_lock:
-        for gpu in gpus:
-            try:
-                available[node].remove(gpu)
-            except (KeyError, ValueError):
-                pass
-    sched = schedule(available, n_jobs, n_gpus)
-    sched_lock.extend(sched)
-    i = 0
-    tasks = []
-    for daemon in daemons:
-        node = state_store[daemon.ws].auth_name
-        for snode, gpus in sched:
-            if node == snode:
-                container_name = '%s-%d' % (name, i) if n_jobs is not None else name
-                i += 1
-                tasks.append(asyncio.create_task(daemon.issue('run_container', dict(
-                    name=container_name,
-                    gpu_ids=gpus,
-                    image=image,
-                    exec=cmd,
-                    user=user,
-                    env=env,
-                    timeout=timeout
-                ))))
-    await asyncio.wait(tasks)
-    for p in sched:
         try:
-            sched_lock.remove(p)
-        except ValueError:
-            logging.exception("sched lock internal error")
-    return cat_aggregate([task.result() for task in tasks])
+            await drain_queue()
+        except Exception:
+            logging.exception("pending queue scheduling error")
+
+
+async def stats_handler(ws: websockets.WebSocketServerProtocol, payload):
+    check_auth(ws)
+    node = payload.get('node')
+    if node is not None:
+        tyck(node, str, 'node')
+        if node not in daemon_nodes:
+            raise AriesError(17, "node `%s` not found" % node)
+    res = await daemon_fanout([node] if node is not None else list(daemon_nodes), 'daemon_stats', dict(), True)
+    nodes = dict()
+    missed = list(res.missed)
+    for name, result in res.results.items():
+        if result['code'] != 0:
+            missed.append(name)
+            continue
+        result.pop('code')
+        result.pop('ticket')
+        nodes[name] = result
+    return dict(commands=command_stats.summary(), launches=launch_stats.summary(), nodes=nodes, missed=sorted(missed))
+
+
+async def leases_handler(ws: websockets.WebSocketServerProtocol, payload):
+    check_auth(ws)
+    leases.expire()
+    now = time.time()
+    return dict(leases=[
+        dict(
+            lease_id=lease.lease_id, node=lease.node, gpu_ids=lease.gpus, owner=lease.owner,
+            job=lease.job, age=now - lease.created, expires_in=lease.expires - now
+        )
+        for lease in leases.leases.values()
+    ])
+
+
+async def queue_handler(ws: websockets.WebSocketServerProtocol, payload):
+    check_auth(ws)
+    ttl = get_config().queue_failed_ttl
+    job_queue.expire_failed(ttl)
+    now = time.time()
+    return dict(jobs=[
+        dict(
+            job_id=job.job_id, user=job.user, name=job.spec['name'], image=job.spec['image'],
+            n_jobs=job.spec['n_jobs'], n_gpus=job.spec['n_gpus'], waited=now - job.submitted, error=job.error,
+            expires_in=None if job.error is None else ttl - (now - (job.failed or job.submitted))
+        )
+        for job in job_queue.jobs
+    ])
+
+
+async def qcancel_handler(ws: websockets.WebSocketServerProtocol, payload):
+    user = check_auth(ws)
+    job = payload['job']
+    tyck(job, str, 'job')
+    pending = job_queue.find(job)
+    if pending.user != user:
+        raise AriesError(7, 'no permission for command')
+    job_queue.remove(pending)
+    kick_queue()
+    return dict(job_id=pending.job_id)
+
+
+async def launch_batch(node: str, specs: List[dict], lease_ids: List[str]):
+    try:
+        daemon = daemon_nodes.get(node)
+        if daemon is None:
+            raise AriesError(17, 'node `%s` disconnected before launch' % node)
+        res = await daemon.issue('run_containers', dict(containers=specs))
+        if res['code'] == 1:
+            singles = await asyncio.gather(*[daemon.issue('run_container', spec) for spec in specs])
+            return {spec['name']: result for spec, result in zip(specs, singles)}
+        if res['code'] != 0:
+            return {spec['name']: dict(code=res['code'], msg=res['msg']) for spec in specs}
+        return res['results']
+    finally:
+        for lease_id in lease_ids:
+            leases.release(lease_id)
 
 
 async def follow_logs_handler(ws: websockets.WebSocketServerProtocol, payload):
     check_auth(ws)
     container = payload['container']
     tyck(container, str, 'container')
+    node = cluster.locate(container)
+    if node is not None and node in daemon_nodes:
+        expire_followers()
+        res = any_aggregate([await daemon_nodes[node].issue('follow_logs', dict(container=container))])
+        followers[res['follower']] = node, time.monotonic()
+        return res
     return await daemon_broadcast('follow_logs', dict(container=container), any_aggregate)
 
 
+def expire_followers(now: Optional[float] = None):
+    # daemons evict followers idle for log_follow_idle, so the route is useless past that
+    if now is None:
+        now = time.monotonic()
+    idle = get_config().log_follow_idle
+    for follower, (_, seen) in list(followers.items()):
+        if now - seen > idle:
+            followers.pop(follower)
+
+
 async def poll_logs_handler(ws: websockets.WebSocketServerProtocol, payload):
     check_auth(ws)
     follower = payload['follower']
     tyck(follower, str, 'follower')
-    return await daemon_broadcast('poll_logs', dict(follower=follower), any_aggregate)
+    route = followers.get(follower)
+    node = None
+    if route is not None:
+        node = route[0]
+        followers[follower] = node, time.monotonic()
+
+    def aggregate(results: List[dict]):
+        if not any(result['code'] == 0 for result in results) and any(result['code'] == 25 for result in results):
+            followers.pop(follower, None)
+        return any_aggregate(results)
+
+    return await daemon_route(node, 'poll_logs', dict(follower=follower), aggregate)
 
 
 tcp_routes: Dict[str, list] = dict()
 CLIENT, DAEMON, MSG_ID, WAITING = 0, 1, 2, 3
 
 
-async def tcprecv_handler(payload):
+async def tcprecv_handler(payload, message: Union[str, bytes]):
     client = payload['client']
     tcp = tcp_routes.get(client)
     if tcp is None:
@@ -317,7 +879,7 @@ async def tcprecv_handler(payload):
     
     while tcp[MSG_ID] != p:
         await asyncio.sleep(0)
-    await tcp[CLIENT].send(json.dumps(payload))
+    await relay(tcp[CLIENT], payload, message)
     tcp[MSG_ID] += 1
 
     tcp[WAITING] -= 1
@@ -331,7 +893,7 @@ tcp_routes2: Dict[str, Tuple[AsyncClient, int, List[asyncio.Future]]] = dict()
 async def tcpconn_handler(ws: websockets.WebSocketServerProtocol, payload):
     check_auth(ws)
     ticket = payload['ticket']
-    nodes = await collect_nodes(False)
+    nodes, _ = await cluster_nodes(False, is_fresh(payload))
     container = payload['container']
     tyck(container, str, 'container')
     port = payload['port']
@@ -363,13 +925,13 @@ async def tcpsend_handler(ws: websockets.WebSocketServerProtocol, payload):
     else:
         if client not in tcp_routes:
             raise AriesError(18, "tcp connection `%s` not found or connection timeout" % client)
-    await tcp_routes[client][DAEMON].ws.send(json.dumps(payload))
+    await send(tcp_routes[client][DAEMON].ws, payload)
     raise NoResponse
 
 
 async def tcpfwd2_handler(ws: websockets.WebSocketServerProtocol, payload):
     check_auth(ws)
-    nodes = await collect_nodes(False)
+    nodes, _ = await cluster_nodes(False, is_fresh(payload))
     container = payload['container']
     tyck(container, str, 'container')
     port = payload['port']
@@ -444,6 +1006,8 @@ dispatch = dict(
     auth=auth_handler,
     daemon=daemon_handler,
     logs=logs_handler,
+    logsearch=logsearch_handler,
+    prepull=prepull_handler,
     stop=stop_handler,
     kill=kill_handler,
     jstop=jstop_handler,
@@ -452,8 +1016,14 @@ dispatch = dict(
     ps=ps_handler,
     nodes=nodes_handler,
     run=run_handler,
+    queue=queue_handler,
+    leases=leases_handler,
+    stats=stats_handler,
+    qcancel=qcancel_handler,
     follow_logs=follow_logs_handler,
     poll_logs=poll_logs_handler,
+    stream_ack=stream_control_handler,
+    stream_cancel=stream_control_handler,
     # tcpconn=tcpconn_handler,
     # tcpsend=tcpsend_handler,
     # tcpstop=tcpstop_handler,
@@ -461,6 +1031,15 @@ dispatch = dict(
 )
 
 
+INLINE_COMMANDS = {'stream_ack', 'stream_cancel'}
+
+
+def inline_command(payload: dict):
+    if payload.get('cmd') == 'logs' and payload.get('follow') and payload.get('stream'):
+        return True
+    return payload.get('cmd') in INLINE_COMMANDS
+
+
 async def handler(ws: websockets.WebSocketServerProtocol):
     if '/tcp2/c/' in ws.path:
         return await tcpfwd2_inbound(ws)
@@ -468,10 +1047,13 @@ async def handler(ws: websockets.WebSocketServerProtocol):
         return await tcpfwd2_daemon(ws)
     state_store[ws] = CentralState()
     try:
-        await command_handler(ws, dispatch, bypass_daemon)
+        await command_handler(ws, dispatch, bypass_daemon, command_limits)
     except Exception:
         logging.exception("Unexpected Error in Outer Loop")
-    state_store.pop(ws)
+    cs = state_store.pop(ws)
+    drop_streams(ws)
+    if cs.cleanup is not None:
+        cs.cleanup()
 
 
 async def main():
@@ -480,6 +1062,15 @@ async def main():
     global stop_signal
     logging.basicConfig(level=logging.INFO)
     stop_signal = asyncio.Future()
+    global job_queue, queue_kick, protect_kick
+    job_queue = JobQueue(os.path.expanduser(get_config().queue_path))
+    queue_kick = asyncio.Event()
+    protect_kick = asyncio.Event()
+    leases.ttl = get_config().lease_ttl
+    global command_limits
+    command_limits = make_limits(inline_command)
+    asyncio.create_task(queue_scheduler()).add_done_callback(common_task_callback('central-queue'))
+    asyncio.create_task(protect_pusher()).add_done_callback(common_task_callback('central-protect'))
     async with websockets.serve(handler, '127.0.0.1', 23549, max_size=2**25, compression=None):
         await stop_signal
 
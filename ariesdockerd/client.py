@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 import uuid
 import json
 import shlex
@@ -14,7 +15,7 @@ from typing import Optional, List, Dict
 from prompt_toolkit import PromptSession
 from prompt_toolkit.history import FileHistory
 from prompt_toolkit.patch_stdout import patch_stdout
-from .protocol import client_serial
+from .protocol import client_serial, client_stream, set_codec, CODECS
 
 
 interrupt_callbacks = []
@@ -36,6 +37,11 @@ async def first_time_config():
     print("Config Saved to", os.path.expanduser("~/.aries/config.json"))
 
 
+def warn_missed(result):
+    if result.get('missed'):
+        print("[warn] nodes missed the deadline, results are partial:", ', '.join(result['missed']))
+
+
 def resp(result):
     if result['code'] == 0:
         print("[done]")
@@ -43,8 +49,8 @@ def resp(result):
         print("[error]", result.get('code', '-2'), result.get('msg', 'unknown'))
 
 
-async def nodes(show_jobs=False):
-    r = await client_serial(ws, 'nodes', dict())
+async def nodes(show_jobs=False, fresh=False):
+    r = await client_serial(ws, 'nodes', dict(fresh=fresh))
     if r['code'] == 0:
         header = ['Node', 'Free GPUs']
         if show_jobs:
@@ -57,6 +63,7 @@ async def nodes(show_jobs=False):
             table.append(row)
         table = sorted(table, key=lambda x: x[0])
         print(tabulate.tabulate(table, headers=header))
+        warn_missed(r)
     return r
 
 
@@ -69,28 +76,80 @@ async def ps(filt: Optional[str] = None):
             table.append([k, v['name'], v['status'], v['user'], v['node'], ','.join(map(str, v['gpu_ids']))])
         table = sorted(table, key=lambda x: x[1])
         print(tabulate.tabulate(table, headers=header))
+        warn_missed(r)
     return r
 
 
-async def logs(container: str, output: str = None, follow: bool = False):
-    if follow:
-        r = await client_serial(ws, 'follow_logs', dict(container=container))
-        while True:
-            try:
-                res = await client_serial(ws, 'poll_logs', dict(follower=r['follower']))
-            except Exception:
-                import traceback
-                traceback.print_exc()
-                break
-            print(res['log'], end='')
-        return r
-    r = await client_serial(ws, 'logs', dict(container=container))
+async def logsearch(pattern: str, filt: str = '', context: int = 0, limit: Optional[int] = None, ignore_case: bool = False, tail: Optional[int] = None, since: Optional[int] = None):
+    args = dict(pattern=pattern, filt=filt, context=context, ignore_case=ignore_case, tail=tail)
+    if limit is not None:
+        args['limit'] = limit
+    if since is not None:
+        args['since'] = int(time.time()) - since
+    r = await client_serial(ws, 'logsearch', args)
     if r['code'] == 0:
-        if output is None:
-            print(r['logs'])
-        else:
-            with open(output, "w", errors='ignore') as fo:
-                print(r['logs'], file=fo)
+        for m in r['matches']:
+            where = '%s@%s' % (m['container'], m['node'])
+            for line in m['before']:
+                print('%s-  %s' % (where, line))
+            print('%s:%s: %s' % (where, '' if m['offset'] is None else m['offset'], m['line']))
+            for line in m['after']:
+                print('%s-  %s' % (where, line))
+            if context:
+                print('--')
+        for where, msg in r['errors'].items():
+            print('[warn] search failed on', where, msg)
+        if r['truncated']:
+            print('[warn] results truncated at %d matches' % len(r['matches']))
+        warn_missed(r)
+    return r
+
+
+async def prepull(images: List[str], node_exclude: str = '', node_include: str = ''):
+    r = await client_serial(ws, 'prepull', dict(images=images, node_exclude=node_exclude, node_include=node_include))
+    if r['code'] == 0:
+        header = ['Node', 'Pulled', 'Cached']
+        table = [[node, ' '.join(v['pulled']), ' '.join(v['cached'])] for node, v in sorted(r['nodes'].items())]
+        print(tabulate.tabulate(table, headers=header))
+        for where, msg in r['errors'].items():
+            print('[warn] pull failed on', where, msg)
+        warn_missed(r)
+    return r
+
+
+async def poll_logs(container: str):
+    r = await client_serial(ws, 'follow_logs', dict(container=container))
+    while True:
+        try:
+            res = await client_serial(ws, 'poll_logs', dict(follower=r['follower']))
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            break
+        print(res['log'], end='')
+    return r
+
+
+async def logs(container: str, output: str = None, follow: bool = False, tail: Optional[int] = None, offset: Optional[int] = None, length: Optional[int] = None):
+    fo = sys.stdout if output is None else open(output, "w", errors='ignore')
+
+    def write(data: str):
+        fo.write(data)
+        if follow:
+            fo.flush()
+
+    try:
+        args = dict(container=container, follow=follow, tail=tail, offset=offset, length=length)
+        r = await client_stream(ws, 'logs', args, write)
+        if r['code'] == 0 and 'logs' in r:
+            if follow:
+                return await poll_logs(container)
+            print(r['logs'], file=fo)
+        if r['code'] == 0 and r.get('end') is not None and (offset is not None or length is not None):
+            print('[info] bytes %d-%d, continue with --offset %d' % (r['offset'], r['end'], r['end']), file=sys.stderr)
+    finally:
+        if output is not None:
+            fo.close()
     return r
 
 
@@ -114,8 +173,83 @@ async def jdelete(job: str):
     return await client_serial(ws, 'jdelete', dict(job=job))
 
 
-async def run(name: str, image: str, cmd: List[str], n_gpus: int, n_jobs: Optional[int] = None, env: Optional[list] = None, node_exclude: str = '', node_include: str = '', timeout: int = 0):
-    return await client_serial(ws, 'run', dict(name=name, image=image, exec=cmd, n_gpus=n_gpus, n_jobs=n_jobs, env=env, node_exclude=node_exclude, node_include=node_include, timeout=timeout))
+async def run(name: str, image: str, cmd: List[str], n_gpus: int, n_jobs: Optional[int] = None, env: Optional[list] = None, node_exclude: str = '', node_include: str = '', timeout: int = 0, fresh: bool = False, queue: Optional[bool] = None, placement: Optional[str] = None, rollback: bool = False):
+    r = await client_serial(ws, 'run', dict(name=name, image=image, exec=cmd, n_gpus=n_gpus, n_jobs=n_jobs, env=env, node_exclude=node_exclude, node_include=node_include, timeout=timeout, fresh=fresh, queue=queue, placement=placement, rollback=rollback))
+    for cname, error in r.get('errors', dict()).items():
+        print("[error] %s: %s" % (cname, error))
+    if r['code'] != 0 and len(r.get('containers') or dict()):
+        print("[warn] launched and still running:", ' '.join(sorted(r['containers'])))
+    if r['code'] == 0 and 'queued' in r:
+        print("[info] queued as", r['queued'], "at position", r['position'])
+    elif r['code'] == 0 and 'fragmentation' in r:
+        print("[info] fragmentation after placement: %.3f" % r['fragmentation'])
+    if r['code'] == 0:
+        for job in r.get('failed', []):
+            print("[warn] queued job %s (%s) failed to launch: %s" % (job['job_id'], job['name'], job['error']))
+    if r['code'] == 0 and 'timings' in r:
+        slowest = max(r['timings']['containers'].values(), key=lambda t: sum(t.values()), default=dict())
+        print("[info] launch phases:", ' '.join(
+            '%s=%.2fs' % kv for kv in list(r['timings']['central'].items()) + [('node.' + k, v) for k, v in slowest.items()]
+        ))
+    return r
+
+
+async def queue():
+    r = await client_serial(ws, 'queue', dict())
+    if r['code'] == 0:
+        header = ['Job', 'Name', 'User', 'Image', 'Tasks', 'GPUs', 'Waited (s)', 'Status']
+        table = []
+        for job in r['jobs']:
+            if job.get('error') is None:
+                status = 'pending'
+            else:
+                status = 'failed, expires in %ds: %s' % (max(0, job['expires_in']), job['error'])
+            table.append([job['job_id'], job['name'], job['user'], job['image'], job['n_jobs'] or 1, job['n_gpus'], int(job['waited']), status])
+        print(tabulate.tabulate(table, headers=header))
+    return r
+
+
+async def leases():
+    r = await client_serial(ws, 'leases', dict())
+    if r['code'] == 0:
+        header = ['Lease', 'Node', 'GPUs', 'Owner', 'Job', 'Age (s)', 'Expires (s)']
+        table = []
+        for lease in r['leases']:
+            table.append([
+                lease['lease_id'], lease['node'], ','.join(map(str, lease['gpu_ids'])), lease['owner'],
+                lease['job'], int(lease['age']), int(lease['expires_in'])
+            ])
+        table = sorted(table, key=lambda x: (x[1], x[2]))
+        print(tabulate.tabulate(table, headers=header))
+    return r
+
+
+def print_summaries(sections: Dict[str, dict]):
+    table = []
+    for section, summary in sorted(sections.items()):
+        for k, v in summary.items():
+            if isinstance(v, dict):
+                v = ' '.join('%s=%.4g' % kv for kv in v.items())
+            table.append([section, k, v])
+    print(tabulate.tabulate(table, headers=['Section', 'Metric', 'Value']))
+
+
+async def stats(node: Optional[str] = None):
+    r = await client_serial(ws, 'stats', dict(node=node))
+    if r['code'] == 0:
+        sections = dict(central=r['commands'])
+        if len(r.get('launches', {})):
+            sections['central launch'] = r['launches']
+        for name, info in r.get('nodes', {}).items():
+            for section, summary in info.items():
+                sections['%s %s' % (name, section)] = summary
+        print_summaries(sections)
+        warn_missed(r)
+    return r
+
+
+async def qcancel(job: str):
+    return await client_serial(ws, 'qcancel', dict(job=job))
 
 
 async def ws_to_tcp(ws: websockets.WebSocketCommonProtocol, tcp: asyncio.StreamWriter):
@@ -184,7 +318,8 @@ async def reconnect():
     except Exception as exc:
         print('[warn] error closing old connection', repr(exc))
     ws = await websockets.connect(cfg['addr'], max_size=2**26)
-    auth = await client_serial(ws, 'auth', dict(token=cfg['token']))
+    auth = await client_serial(ws, 'auth', dict(token=cfg['token'], codecs=CODECS))
+    set_codec(ws, auth.get('codec', 'json'))
     return auth
 
 
@@ -205,6 +340,7 @@ async def run_command(argv):
 
     pnodes = subs.add_parser('nodes')
     pnodes.add_argument('-j', '--show_jobs', action='store_true')
+    pnodes.add_argument('-F', '--fresh', action='store_true')
 
     pps = subs.add_parser('ps')
     pps.add_argument('filt', nargs='?', default=None, type=str)
@@ -215,6 +351,23 @@ async def run_command(argv):
     plogs.add_argument('container')
     plogs.add_argument('-o', '--output', default=None, type=str)
     plogs.add_argument('-f', '--follow', action='store_true')
+    plogs.add_argument('-n', '--tail', default=None, type=int)
+    plogs.add_argument('--offset', default=None, type=int)
+    plogs.add_argument('--length', default=None, type=int)
+
+    psearch = subs.add_parser('logsearch')
+    psearch.add_argument('pattern')
+    psearch.add_argument('filt', nargs='?', default='', type=str)
+    psearch.add_argument('-C', '--context', default=0, type=int)
+    psearch.add_argument('-m', '--limit', default=None, type=int)
+    psearch.add_argument('-i', '--ignore_case', action='store_true')
+    psearch.add_argument('-n', '--tail', default=None, type=int)
+    psearch.add_argument('-s', '--since', default=None, type=int, help='seconds ago')
+
+    pprepull = subs.add_parser('prepull')
+    pprepull.add_argument('-x', '--node_exclude', default='', type=str)
+    pprepull.add_argument('-n', '--node_include', default='', type=str)
+    pprepull.add_argument('images', nargs='+')
 
     pstop = subs.add_parser('stop')
     pstop.add_argument('container')
@@ -235,6 +388,14 @@ async def run_command(argv):
     pfwd.add_argument('container')
     pfwd.add_argument('port')
 
+    subs.add_parser('queue')
+    subs.add_parser('leases')
+    pstats = subs.add_parser('stats')
+    pstats.add_argument('node', nargs='?', default=None, type=str)
+
+    pqcancel = subs.add_parser('qcancel')
+    pqcancel.add_argument('job')
+
     psource = subs.add_parser('source')
     psource.add_argument('file')
 
@@ -245,6 +406,11 @@ async def run_command(argv):
     prun.add_argument('-g', '--n_gpus', default=1, type=int)
     prun.add_argument('-t', '--timeout', default=0, type=int)
     prun.add_argument('-e', '--env', metavar="KEY=VALUE", nargs='*', default=[])
+    prun.add_argument('-F', '--fresh', action='store_true')
+    prun.add_argument('-q', '--queue', action='store_const', const=True, default=None)
+    prun.add_argument('--no-queue', dest='queue', action='store_const', const=False)
+    prun.add_argument('--rollback', action='store_true')
+    prun.add_argument('-p', '--placement', default=None, choices=['greedy', 'batch'])
     prun.add_argument('name')
     prun.add_argument('image')
     prun.add_argument('cmd', nargs='+')
@@ -264,11 +430,11 @@ class AriesShell(aiocmd.PromptToolkitCmd):
     @property
     def command_list(self):
         return [
-            'nodes', 'ps', 'logs',
+            'nodes', 'ps', 'logs', 'logsearch',
             'stop', 'kill', 'jstop',
             'delete', 'jdelete',
             'portfwd', 'reconnect',
-            'run', 'source',
+            'run', 'prepull', 'queue', 'qcancel', 'leases', 'stats', 'source',
             'q',
             '?', 'help'
         ]
@@ -312,7 +478,8 @@ async def main():
         cfg = json.load(fi)
     ws = await websockets.connect(cfg['addr'], max_size=2**26)
     try:
-        auth = await client_serial(ws, 'auth', dict(token=cfg['token']))
+        auth = await client_serial(ws, 'auth', dict(token=cfg['token'], codecs=CODECS))
+        set_codec(ws, auth.get('codec', 'json'))
         if auth['code'] != 0:
             print('[error] login failed:', auth['msg'])
         else:
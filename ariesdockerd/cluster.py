@@ -0,0 +1,152 @@
+import time
+from typing import *
+from dataclasses import dataclass, field
+
+
+INDEXED_FIELDS = ('names', 'ids', 'finalized_names', 'finalized_ids')
+SET_FIELDS = INDEXED_FIELDS + ('images',)
+
+
+@dataclass
+class NodeState:
+    seq: int = -1
+    version: int = 0
+    updated: float = 0.0
+    free_gpu_ids: List[int] = field(default_factory=list)
+    names: Set[str] = field(default_factory=set)
+    ids: Set[str] = field(default_factory=set)
+    finalized_names: Set[str] = field(default_factory=set)
+    finalized_ids: Set[str] = field(default_factory=set)
+    images: Set[str] = field(default_factory=set)
+    topology: Optional[List[List[int]]] = None
+    gpu_count: Optional[int] = None
+
+    def info(self, include_finalized: bool):
+        names, ids = self.names, self.ids
+        if include_finalized:
+            names = names | self.finalized_names
+            ids = ids | self.finalized_ids
+        return dict(free_gpu_ids=sorted(self.free_gpu_ids), names=sorted(names), ids=sorted(ids))
+
+
+def job_of(name: str):
+    job, sep, idx = name.rpartition('-')
+    if sep and str.isnumeric(idx):
+        return job
+    return None
+
+
+def image_ref(image: str):
+    if '@' in image or ':' in image.rpartition('/')[2]:
+        return image
+    return image + ':latest'
+
+
+def make_update(prev: Optional[dict], cur: dict, seq: int):
+    if prev is None:
+        return dict(full=True, seq=seq, **cur)
+    update = dict()
+    for k in SET_FIELDS:
+        old, new = set(prev.get(k, ())), set(cur.get(k, ()))
+        if old != new:
+            update[k] = dict(add=sorted(new - old), remove=sorted(old - new))
+    if sorted(prev['free_gpu_ids']) != sorted(cur['free_gpu_ids']):
+        update['free_gpu_ids'] = cur['free_gpu_ids']
+    if not len(update):
+        return None
+    return dict(seq=seq, **update)
+
+
+class ClusterView(object):
+    def __init__(self) -> None:
+        self.version = 0
+        self.nodes: Dict[str, NodeState] = dict()
+        self.locations: Dict[str, Dict[str, int]] = dict()
+        self.jobs: Dict[str, Dict[str, int]] = dict()
+
+    def _ref(self, index: Dict[str, Dict[str, int]], key: str, node: str, delta: int):
+        refs = index.setdefault(key, dict())
+        refs[node] = refs.get(node, 0) + delta
+        if refs[node] <= 0:
+            refs.pop(node)
+        if not len(refs):
+            index.pop(key)
+
+    def _index(self, node: str, kind: str, keys: Iterable[str], delta: int):
+        if kind not in INDEXED_FIELDS:
+            return
+        for key in keys:
+            self._ref(self.locations, key, node, delta)
+            if kind.endswith('names'):
+                job = job_of(key)
+                if job is not None:
+                    self._ref(self.jobs, job, node, delta)
+
+    def apply(self, node: str, update: dict):
+        seq = update['seq']
+        if update.get('full'):
+            old = self.nodes.get(node)
+            state = NodeState(
+                free_gpu_ids=list(update['free_gpu_ids']), topology=update.get('topology'), gpu_count=update.get('gpu_count')
+            )
+            for k in SET_FIELDS:
+                setattr(state, k, set(update.get(k, ())))
+                if old is not None:
+                    self._index(node, k, getattr(old, k), -1)
+                self._index(node, k, getattr(state, k), 1)
+        else:
+            state = self.nodes.get(node)
+            if state is None or seq != state.seq + 1:
+                return False
+            for k in SET_FIELDS:
+                if k in update:
+                    current: Set[str] = getattr(state, k)
+                    removed = current.intersection(update[k]['remove'])
+                    added = set(update[k]['add']).difference(current)
+                    current.difference_update(removed)
+                    current.update(added)
+                    self._index(node, k, removed, -1)
+                    self._index(node, k, added, 1)
+            if 'free_gpu_ids' in update:
+                state.free_gpu_ids = list(update['free_gpu_ids'])
+        self.version += 1
+        state.seq = seq
+        state.version = self.version
+        state.updated = time.time()
+        self.nodes[node] = state
+        return True
+
+    def drop(self, node: str):
+        state = self.nodes.pop(node, None)
+        if state is not None:
+            for k in SET_FIELDS:
+                self._index(node, k, getattr(state, k), -1)
+            self.version += 1
+
+    def locate(self, container: str):
+        refs = self.locations.get(container)
+        if refs is None:
+            refs = dict()
+            for node, state in self.nodes.items():
+                for short_id in state.ids | state.finalized_ids:
+                    if short_id.startswith(container) or container.startswith(short_id):
+                        refs[node] = 1
+        if len(refs) == 1:
+            return next(iter(refs))
+        return None
+
+    def job_nodes(self, job: str):
+        return set(self.jobs.get(job, ()))
+
+    def image_nodes(self, image: str):
+        ref = image_ref(image)
+        return {node for node, state in self.nodes.items() if ref in state.images}
+
+    def capacity(self):
+        return {node: state.gpu_count for node, state in self.nodes.items()}
+
+    def topology(self):
+        return {node: state.topology for node, state in self.nodes.items() if state.topology is not None}
+
+    def snapshot(self, include_finalized: bool):
+        return {node: state.info(include_finalized) for node, state in self.nodes.items()}
@@ -15,6 +15,47 @@ class Config:
     grafana_key: str
     policy_pod_time_limit: int
     policy_pod_gpu_limit: int
+    fanout_deadline: float = 15.0
+    fanout_hedge: float = 5.0
+    launch_workers: int = 8
+    pull_workers: int = 2
+    queue_path: str = '~/.ariesdockerd/queue.json'
+    queue_failed_ttl: float = 86400.0
+    gpu_topology: Optional[List[List[int]]] = None
+    placement_policy: str = 'greedy'
+    lease_ttl: float = 900.0
+    command_inflight_per_connection: int = 32
+    command_inflight_global: int = 512
+    command_queue_depth: int = 128
+    log_chunk_size: int = 2 ** 16
+    log_stream_window: int = 8
+    log_follow_buffer: int = 2 ** 20
+    log_follow_idle: float = 120.0
+    log_follow_tail: int = 1000
+    log_follow_workers: int = 256
+    log_archive_path: str = '~/.ariesdockerd/logs'
+    log_archive_max_bytes: int = 2 ** 34
+    log_archive_max_age: float = 86400.0 * 7
+    logsearch_max_matches: int = 1000
+    logsearch_workers: int = 4
+    logsearch_deadline: float = 60.0
+    prepull_deadline: float = 1800.0
+    inventory_reconcile: float = 300.0
+    read_workers: int = 16
+    write_workers: int = 8
+    stream_workers: int = 64
+    docker_engine: bool = False
+    docker_socket: str = '/var/run/docker.sock'
+    dv0_linger: float = 300.0
+    dv0_ready_timeout: float = 20.0
+    image_gc_path: str = '~/.ariesdockerd/images.json'
+    image_gc_high: float = 0.85
+    image_gc_low: float = 0.75
+    image_gc_min_age: float = 3600.0
+    image_gc_batch: int = 2
+    image_gc_interval: float = 60.0
+    deadline_warning: float = 300.0
+    deadline_grace: float = 30.0
 
 
 @functools.lru_cache(maxsize=None)
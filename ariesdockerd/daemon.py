@@ -1,22 +1,31 @@
+import re
 import time
 import json
 import uuid
-import queue
+import signal
 import socket
-import base64
 import logging
 import asyncio
 import datetime
 import functools
-import threading
 import subprocess
 import websockets
+from typing import *
 from .auth import issue
 from .error import AriesError
 from .config import get_config
-from .protocol import command_handler, client_serial, common_task_callback, NoResponse
+from .protocol import command_handler, client_serial, common_task_callback, NoResponse, command_stats
+from .protocol import CODECS, encode, send, set_codec, codec_for, upstream_limits, as_bytes
 from .executor import Executor
 from .async_util import wait_any
+from .cluster import make_update
+from .topology import parse_topo_matrix, p2p_capable
+from .streaming import CreditStream, slices, window, awindow, last_bytes
+from .tailer import LogTailers
+from .logsearch import compile_pattern, search_lines
+from .pools import WorkerPool
+from .stats import Phases
+from .engine import DockerEngine
 
 
 core = Executor()
@@ -27,8 +36,19 @@ def total_gpus():
     return len(subprocess.check_output(['nvidia-smi', '--query-gpu=name', '--format=csv,noheader']).splitlines())
 
 
-def node_info_task(ws: websockets.WebSocketServerProtocol, payload):
-    include_finalized = payload['include_finalized']
+@functools.lru_cache(maxsize=None)
+def gpu_topology():
+    static = get_config().gpu_topology
+    if static is not None:
+        return static
+    try:
+        return parse_topo_matrix(subprocess.check_output(['nvidia-smi', 'topo', '-m']).decode(errors='replace'))
+    except Exception:
+        logging.warning("cannot read gpu topology", exc_info=True)
+        return None
+
+
+def node_snapshot():
     gpus = set(range(total_gpus()))
     names = set()
     ids = set()
@@ -39,50 +59,287 @@ def node_info_task(ws: websockets.WebSocketServerProtocol, payload):
             for gpu in info['gpu_ids']:
                 if gpu in gpus:
                     gpus.remove(gpu)
+    finalized_names = set()
+    finalized_ids = set()
+    for k, v in core.exit_store.items():
+        finalized_names.add(v.name)
+        finalized_ids.add(k)
+    return dict(
+        free_gpu_ids=sorted(gpus), names=sorted(names), ids=sorted(ids),
+        finalized_names=sorted(finalized_names), finalized_ids=sorted(finalized_ids),
+        topology=gpu_topology(), gpu_count=total_gpus(), images=sorted(core.images)
+    )
+
+
+def node_info_task(ws: websockets.WebSocketServerProtocol, payload):
+    include_finalized = payload['include_finalized']
+    snap = node_snapshot()
+    names, ids = set(snap['names']), set(snap['ids'])
     if include_finalized:
-        for k, v in core.exit_store.items():
-            names.add(v.name)
-            ids.add(k)
-    return dict(free_gpu_ids=sorted(gpus), names=sorted(names), ids=sorted(ids))
+        names.update(snap['finalized_names'])
+        ids.update(snap['finalized_ids'])
+    return dict(free_gpu_ids=snap['free_gpu_ids'], names=sorted(names), ids=sorted(ids))
 
 
 def tyck(obj, ty, name):
     assert isinstance(obj, ty), '%s should be %s, got %s' % (name, ty.__name__, type(obj))
 
 
-def run_container_task(ws: websockets.WebSocketServerProtocol, payload):
-    info = node_info_task(ws, dict(include_finalized=True))
-    gpus, names = info['free_gpu_ids'], info['names']
+def check_launch(payload, gpus, names):
     gpu_ids = payload['gpu_ids']
     name = payload['name']
-    image = payload['image']
-    cmd = payload['exec']
-    user = payload['user']
-    env = payload['env']
-    timeout = payload['timeout']
     tyck(name, str, 'name')
-    tyck(image, str, 'image')
-    tyck(cmd, list, 'exec')
-    tyck(user, str, 'user')
+    tyck(payload['image'], str, 'image')
+    tyck(payload['exec'], list, 'exec')
+    tyck(payload['user'], str, 'user')
     tyck(gpu_ids, list, 'gpu_ids')
-    tyck(env, list, 'env')
-    tyck(timeout, int, 'timeout')
+    tyck(payload['env'], list, 'env')
+    tyck(payload['timeout'], int, 'timeout')
     assert name not in names, 'container already exists: %s' % name
     for gpu_id in gpu_ids:
         assert gpu_id in gpus, 'gpu not found or already in use: %s' % gpu_id
-    cid = core.run(name, image, cmd, gpu_ids, user, env, timeout)
-    return dict(short_id=cid)
+
+
+def launch(payload, phases: Phases):
+    phases.mark('queue')
+    p2p = p2p_capable(gpu_topology(), payload['gpu_ids'])
+    phases.mark('validate')
+    short_id = core.run(
+        payload['name'], payload['image'], payload['exec'], payload['gpu_ids'],
+        payload['user'], payload['env'], payload['timeout'], p2p, phases
+    )
+    return dict(short_id=short_id, timings=phases.timings)
+
+
+def run_container_task(ws: websockets.WebSocketServerProtocol, payload):
+    phases = Phases()
+    info = node_info_task(ws, dict(include_finalized=True))
+    check_launch(payload, info['free_gpu_ids'], info['names'])
+    phases.mark('precheck')
+    return launch(payload, phases)
+
+
+def error_result(exc: BaseException):
+    if isinstance(exc, AriesError):
+        return dict(code=exc.args[0], msg=exc.args[1])
+    return dict(code=-1, msg=repr(exc))
+
+
+tailers = LogTailers(
+    core.resolve, core.logs_follow, core.logs_tail,
+    get_config().log_follow_buffer, get_config().log_follow_idle, get_config().log_follow_tail
+)
+engine = DockerEngine(get_config().docker_socket) if get_config().docker_engine else None
+deadline_kick: Optional[asyncio.Event] = None
+launch_pool = WorkerPool('launch', get_config().launch_workers)
+pull_pool = WorkerPool('pull', get_config().pull_workers)
+
+
+def run_containers_task(ws: websockets.WebSocketServerProtocol, payload):
+    specs = payload['containers']
+    tyck(specs, list, 'containers')
+    precheck = Phases()
+    info = node_info_task(ws, dict(include_finalized=True))
+    gpus, names = set(info['free_gpu_ids']), set(info['names'])
+    precheck.mark('precheck')
+    results = dict()
+    futures = dict()
+    for spec in specs:
+        try:
+            check_launch(spec, gpus, names)
+        except Exception as exc:
+            results[str(spec.get('name'))] = error_result(exc)
+            continue
+        names.add(spec['name'])
+        gpus.difference_update(spec['gpu_ids'])
+        phases = Phases()
+        phases.timings.update(precheck.timings)
+        futures[spec['name']] = launch_pool.submit(launch, spec, phases), phases
+    for name, (future, phases) in futures.items():
+        try:
+            results[name] = dict(code=0, **future.result())
+        except Exception as exc:
+            results[name] = dict(error_result(exc), timings=phases.timings)
+    return dict(results=results)
+
+
+async def prepull_handler(ws: websockets.WebSocketServerProtocol, payload):
+    images = payload['images']
+    tyck(images, list, 'images')
+    for image in images:
+        tyck(image, str, 'image')
+    futures = {image: pull_pool.submit(core.ensure_image, image) for image in images}
+    pulled, cached, errors = [], [], dict()
+    for image, future in futures.items():
+        try:
+            (pulled if await asyncio.wrap_future(future) else cached).append(image)
+        except Exception as exc:
+            errors[image] = repr(exc)
+    return dict(pulled=pulled, cached=cached, errors=errors)
+
+
+def protect_images_task(ws: websockets.WebSocketServerProtocol, payload):
+    images = payload['images']
+    tyck(images, list, 'images')
+    core.image_gc.protect(images)
+    return dict(protected=len(images))
+
+
+log_streams: Dict[str, CreditStream] = dict()
+
+
+def open_stream(ws: websockets.WebSocketServerProtocol, payload):
+    sid = payload['stream']
+    tyck(sid, str, 'stream')
+    loop = main_loop
+
+    def emit(chunk: dict):
+        asyncio.run_coroutine_threadsafe(send(ws, chunk), loop).result()
+
+    stream = log_streams[sid] = CreditStream(sid, payload.get('window', get_config().log_stream_window), emit)
+    return stream
+
+
+def log_range(payload):
+    tail, offset, length = payload.get('tail'), payload.get('offset'), payload.get('length')
+    for key, value in [('tail', tail), ('offset', offset), ('length', length)]:
+        if value is not None:
+            tyck(value, int, key)
+            assert value >= 0, '%s should be non-negative' % key
+    if tail is not None and (offset is not None or length is not None):
+        raise AriesError(8, 'bad request: tail cannot be combined with offset or length')
+    return tail, offset, length
+
+
+def log_source(payload, filt, limit: Optional[int] = None, closing: Callable = lambda source: source):
+    tail, offset, length = log_range(payload)
+    if len(filt) == 1:
+        size = core.exit_store.size(filt[0])
+        if tail is not None:
+            start = core.exit_store.tail_offset(filt[0], tail)
+        else:
+            start = min(offset or 0, size)
+        end = size if length is None else min(size, start + length)
+        if limit is not None:
+            if offset is None:
+                start = max(start, end - limit)
+            end = min(end, start + limit)
+        return core.exit_store.span(filt[0], start, end), start
+    since, until = payload.get('since'), payload.get('until')
+    if tail is not None or since is not None:
+        return closing(core.logs_stream(payload['container'], 'all' if tail is None else tail, since, until)), None
+    if limit is not None and offset is not None:
+        length = limit if length is None else min(length, limit)
+    return window(closing(core.logs_stream(payload['container'], until=until)), offset or 0, length), offset or 0
+
+
+def stream_logs(ws: websockets.WebSocketServerProtocol, payload, filt):
+    chunk = payload.get('chunk', get_config().log_chunk_size)
+    stream = open_stream(ws, payload)
+    try:
+        if payload.get('follow') and not len(filt):
+            follower = tailers.follow(payload['container'])
+            try:
+                return stream.pump(stream.closing(follower), chunk, eager=True)
+            finally:
+                follower.close()
+        source, start = log_source(payload, filt, closing=stream.closing)
+        res = stream.pump((piece for b in source for piece in slices(b, chunk)), chunk)
+        if start is not None:
+            res.update(offset=start, end=start + res['bytes'])
+        return res
+    finally:
+        log_streams.pop(stream.sid, None)
 
 
 def get_logs_task(ws: websockets.WebSocketServerProtocol, payload):
     container = payload['container']
     tyck(container, str, 'container')
-    filt = [v for k, v in core.exit_store.items() if k.startswith(container) or v.name == container]
-    if len(filt) == 1:
-        return dict(logs=filt[0].logs.decode(errors='replace')[-2**23:])
-    elif len(filt) > 1:
-        raise AriesError(15, 'container ambiguous: ' + str([v.name for v in filt]))
-    return dict(logs=core.logs(container).decode(errors='replace')[-2**23:])
+    matched = {k: v for k, v in core.exit_store.items() if k.startswith(container) or v.name == container}
+    if len(matched) > 1:
+        raise AriesError(15, 'container ambiguous: ' + str([v.name for v in matched.values()]))
+    filt = list(matched)
+    if payload.get('stream') is not None:
+        return stream_logs(ws, payload, filt)
+    source, start = log_source(payload, filt, 2**23)
+    return buffered_logs(payload, source, start)
+
+
+def buffered_logs(payload, source: Iterable[bytes], start: Optional[int]):
+    data = b''.join(source)
+    if len(data) > 2**23:
+        if payload.get('offset') is None:
+            if start is not None:
+                start += len(data) - 2**23
+            data = data[-2**23:]
+        else:
+            data = data[:2**23]
+    res = dict(logs=data.decode(errors='replace'))
+    if start is not None:
+        res.update(offset=start, end=start + len(data))
+    return res
+
+
+search_pool = WorkerPool('search', get_config().logsearch_workers)
+
+
+def search_targets(filt: str, since: Optional[int]):
+    targets = []
+    for container, info in core.scan():
+        if container.name.startswith(filt) or container.short_id.startswith(filt):
+            targets.append((container.short_id, container.name, []))
+    for k, v in core.exit_store.items():
+        if since is not None and v.entry_creation_time < since:
+            continue
+        if k.startswith(filt) or v.name.startswith(filt):
+            targets.append((k, v.name, [k]))
+    return targets
+
+
+def search_one(payload, pattern, short_id: str, name: str, filt: List[str], deadline: Optional[float]):
+    if deadline is not None and time.monotonic() > deadline:
+        return [], True
+    source, start = log_source(dict(payload, container=short_id), filt)
+    matches, truncated = search_lines(source, pattern, payload['context'], payload['limit'], start or 0, deadline)
+    for m in matches:
+        m.update(container=name, short_id=short_id, node=hostname)
+        if start is None:
+            m['offset'] = None
+    return matches, truncated
+
+
+def search_logs_task(ws: websockets.WebSocketServerProtocol, payload):
+    tyck(payload['pattern'], str, 'pattern')
+    tyck(payload['filt'], str, 'filt')
+    tyck(payload['context'], int, 'context')
+    tyck(payload['limit'], int, 'limit')
+    log_range(payload)
+    for key in ['since', 'until']:
+        if payload.get(key) is not None:
+            tyck(payload[key], int, key)
+    try:
+        pattern = compile_pattern(payload['pattern'], payload.get('ignore_case', False))
+    except re.error as exc:
+        raise AriesError(8, 'bad request: invalid pattern: %s' % exc)
+    deadline = time.monotonic() + float(payload.get('timeout', get_config().logsearch_deadline))
+    futures = {
+        name: search_pool.submit(search_one, payload, pattern, short_id, name, filt, deadline)
+        for short_id, name, filt in search_targets(payload['filt'], payload.get('since'))
+    }
+    matches = []
+    truncated = False
+    errors = dict()
+    for name, future in futures.items():
+        try:
+            found, cut = future.result()
+        except Exception as exc:
+            errors[name] = repr(exc)
+            continue
+        matches.extend(found)
+        truncated = truncated or cut
+    if len(matches) > payload['limit']:
+        matches, truncated = matches[:payload['limit']], True
+    return dict(matches=matches, truncated=truncated, errors=errors)
 
 
 def list_containers_task(ws: websockets.WebSocketServerProtocol, payload):
@@ -129,42 +386,34 @@ def remove_container_task(ws: websockets.WebSocketServerProtocol, payload):
     return dict()
 
 
-log_followers = dict()
-
-
-def log_follower_thread(gen, q: queue.Queue):
-    for b in gen:
-        b: bytes
-        q.put(b.decode(errors='replace'))
-
-
 def follow_logs_task(ws: websockets.WebSocketServerProtocol, payload):
     container = payload['container']
     tyck(container, str, 'container')
-    gen = core.logs_follow(container)
-    follower = str(uuid.uuid4())
-    log_followers[follower] = queue.Queue(maxsize=8)
-    threading.Thread(target=log_follower_thread, args=(gen, log_followers[follower]), daemon=True).start()
-    return dict(follower=follower)
+    return dict(follower=tailers.follow(container).follower_id)
 
 
 def poll_logs_task(ws: websockets.WebSocketServerProtocol, payload):
     follower = payload['follower']
     tyck(follower, str, 'follower')
-    q: queue.Queue = log_followers[follower]
-    x = []
-    L = 0
-    t = time.time()
-    while time.time() < t + 1:
-        try:
-            item = q.get(timeout=0.5)
-            x.append(item)
-            L += len(item)
-            if L >= 2 ** 20:
-                break
-        except queue.Empty:
-            break
-    return dict(log=''.join(x))
+    try:
+        follower = tailers.get(follower)
+    except KeyError:
+        raise AriesError(25, 'log follower `%s` not found or evicted' % follower)
+    return dict(log=follower.poll(2 ** 20, 1.0))
+
+
+async def stream_ack_handler(ws: websockets.WebSocketServerProtocol, payload):
+    stream = log_streams.get(payload['stream'])
+    if stream is not None:
+        stream.ack(payload['seq'])
+    raise NoResponse
+
+
+async def stream_cancel_handler(ws: websockets.WebSocketServerProtocol, payload):
+    stream = log_streams.get(payload['stream'])
+    if stream is not None:
+        stream.cancel()
+    raise NoResponse
 
 
 tcp_connections = dict()
@@ -197,8 +446,7 @@ async def tcprecv_handler(ws: websockets.WebSocketServerProtocol, client: str, r
         if not len(nxt):
             asyncio.create_task(tcpalive(client))
             break
-        enc = base64.b64encode(nxt).decode('ascii')
-        packet = json.dumps(dict(cmd='tcprecv', client=client, d=enc, p=p))
+        packet = encode(dict(cmd='tcprecv', client=client, d=nxt, p=p), codec_for(ws))
         p += 1
         if last_write is not None:
             await last_write
@@ -221,7 +469,7 @@ async def tcpsend_handler(ws: websockets.WebSocketServerProtocol, payload):
     while tcp[MSG_ID] != payload['p']:
         await asyncio.sleep(0)
     writer: asyncio.StreamWriter = tcp[WRITER]
-    writer.write(base64.b64decode(payload['d']))
+    writer.write(as_bytes(payload['d']))
     tcp[MSG_ID] += 1
     raise NoResponse
 
@@ -294,36 +542,124 @@ async def tcp2inbound_handler(ws: websockets.WebSocketServerProtocol, payload):
     return dict()
 
 
-def threaded_handler(func):
+class StatePublisher(object):
+    def __init__(self) -> None:
+        self.ws: Optional[websockets.WebSocketCommonProtocol] = None
+        self.last: Optional[dict] = None
+        self.seq = 0
+        self.lock = asyncio.Lock()
 
-    async def _cmd(*args, **kwargs):
-        loop = asyncio.get_running_loop()
+    def attach(self, ws: Optional[websockets.WebSocketCommonProtocol]):
+        self.ws = ws
+        self.last = None
 
-        def wrapping_func(*args, **kwargs):
+    async def publish(self, full: bool = False):
+        async with self.lock:
+            ws = self.ws
+            if ws is None:
+                return
             try:
-                r = func(*args, **kwargs)
-                loop.call_soon_threadsafe(future.set_result, r)
-            except BaseException as exc:
-                loop.call_soon_threadsafe(future.set_exception, exc)
-    
-        future = asyncio.Future()
-        thread = threading.Thread(target=wrapping_func, args=args, kwargs=kwargs)
-        thread.start()
-        return await future
+                snap = await read_pool.run(node_snapshot)
+                update = make_update(None if full else self.last, snap, self.seq + 1)
+                if update is None:
+                    return
+                await send(ws, dict(cmd='node_state', **update))
+                self.seq += 1
+                self.last = snap
+            except Exception:
+                logging.exception("node state publish failed")
+
+
+publisher = StatePublisher()
+
+
+def publishing(handler):
+
+    async def _cmd(*args, **kwargs):
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            await publisher.publish()
 
     return _cmd
 
 
+async def node_resync_handler(ws: websockets.WebSocketServerProtocol, payload):
+    await publisher.publish(full=True)
+    return dict()
+
+
+read_pool = WorkerPool('read', get_config().read_workers)
+write_pool = WorkerPool('write', get_config().write_workers)
+stream_pool = WorkerPool('stream', get_config().stream_workers)
+follow_pool = WorkerPool('follow', get_config().log_follow_workers)
+pools = [read_pool, write_pool, stream_pool, follow_pool, launch_pool, pull_pool, search_pool]
+
+
+async def engine_logs(payload, container_id: str, tty: Optional[bool] = None):
+    tail, offset, length = log_range(payload)
+    since, until = payload.get('since'), payload.get('until')
+    source = engine.logs(container_id, tail='all' if tail is None else tail, since=since, until=until, tty=tty)
+    try:
+        if tail is not None or since is not None:
+            pieces, _ = await last_bytes(source, 2**23)
+            return await read_pool.run(buffered_logs, payload, pieces, None)
+        if offset is not None:
+            length = 2**23 if length is None else min(length, 2**23)
+            pieces = [b async for b in awindow(source, offset, length)]
+            return await read_pool.run(buffered_logs, payload, pieces, offset)
+        pieces, dropped = await last_bytes(awindow(source, 0, length), 2**23)
+        return await read_pool.run(buffered_logs, payload, pieces, dropped)
+    finally:
+        await source.aclose()
+
+
+async def get_logs_handler(ws: websockets.WebSocketServerProtocol, payload):
+    if payload.get('stream') is not None:
+        pool = follow_pool if payload.get('follow') else stream_pool
+        return await pool.run(get_logs_task, ws, payload)
+    container = payload['container']
+    if engine is not None and isinstance(container, str) and not any(
+        k.startswith(container) or v.name == container for k, v in core.exit_store.items()
+    ):
+        found = core.inventory.find(container)
+        if found is not None:
+            # the inventory already knows tty, so old engines skip the extra inspect
+            return await engine_logs(payload, found.id, bool((found.attrs.get('Config') or {}).get('Tty')))
+    return await read_pool.run(get_logs_task, ws, payload)
+
+
+def daemon_stats_task(ws: websockets.WebSocketServerProtocol, payload):
+    return dict(
+        commands=command_stats.summary(),
+        inventory=core.inventory.stats(),
+        dv0=core.dv0.stats(),
+        image_gc=core.image_gc.stats(),
+        deadlines=core.deadlines.stats(),
+        tailers=tailers.stats(),
+        archive=dict(entries=len(core.exit_store), stored_bytes=core.exit_store.total_stored()),
+        **{'pool_' + pool.name: pool.stats() for pool in pools}
+    )
+
+
 dispatch = dict(
-    node_info=threaded_handler(node_info_task),
-    run_container=threaded_handler(run_container_task),
-    list_containers=threaded_handler(list_containers_task),
-    get_logs=threaded_handler(get_logs_task),
-    stop_container=threaded_handler(stop_container_task),
-    remove_container=threaded_handler(remove_container_task),
-    kill_container=threaded_handler(kill_container_task),
-    follow_logs=threaded_handler(follow_logs_task),
-    poll_logs=threaded_handler(poll_logs_task),
+    node_info=read_pool.wrap(node_info_task),
+    node_resync=node_resync_handler,
+    daemon_stats=read_pool.wrap(daemon_stats_task),
+    run_container=publishing(write_pool.wrap(run_container_task)),
+    run_containers=publishing(write_pool.wrap(run_containers_task)),
+    prepull=publishing(prepull_handler),
+    protect_images=read_pool.wrap(protect_images_task),
+    list_containers=read_pool.wrap(list_containers_task),
+    get_logs=get_logs_handler,
+    search_logs=stream_pool.wrap(search_logs_task),
+    stop_container=publishing(write_pool.wrap(stop_container_task)),
+    remove_container=publishing(write_pool.wrap(remove_container_task)),
+    kill_container=publishing(write_pool.wrap(kill_container_task)),
+    follow_logs=read_pool.wrap(follow_logs_task),
+    poll_logs=stream_pool.wrap(poll_logs_task),
+    stream_ack=stream_ack_handler,
+    stream_cancel=stream_cancel_handler,
     tcpconn=tcpconn_handler,
     tcpsend=tcpsend_handler,
     tcpstop=tcpstop_handler,
@@ -333,6 +669,16 @@ dispatch = dict(
 )
 
 
+INLINE_COMMANDS = {'stream_ack', 'stream_cancel', 'tcpsend', 'tcpflowpause', 'tcpflowresume'}
+
+
+def inline_command(payload: dict):
+    # follows live as long as the client does and are paced by credits, not by command slots
+    if payload.get('cmd') == 'get_logs' and payload.get('follow') and payload.get('stream') is not None:
+        return True
+    return payload.get('cmd') in INLINE_COMMANDS
+
+
 async def cleanup():
     next_cleanup = datetime.datetime.now()
     cur = next_cleanup.hour + next_cleanup.minute / 60
@@ -342,18 +688,75 @@ async def cleanup():
     await wait_any([asyncio.sleep(dt), stop_signal])
     while not stop_signal.done():
         s = time.time()
-        core.clean_up()
+        try:
+            await write_pool.run(core.clean_up)
+        except Exception:
+            logging.exception("clean up error")
         dt = 86400.0 - (time.time() - s)
         if dt >= 0:
             await wait_any([asyncio.sleep(dt), stop_signal])
 
 
+def enforce_deadline(container_id: str, stage: str):
+    container = core.inventory.find(container_id)
+    if container is None:
+        return
+    try:
+        if stage == 'warn':
+            core.warn(container.id, '[ariesdockerd] time limit reached in %d seconds, %s will be stopped' % (
+                round(core.deadlines.warning), container.name
+            ))
+        elif stage == 'stop':
+            logging.info("time limit reached, stopping %s", container.name)
+            core.stop(container.id)
+        else:
+            current = core.find(container.id)
+            if current is not None and current.status not in ('exited', 'dead'):
+                logging.warning("%s still alive %d seconds after stop, killing", container.name, core.deadlines.grace)
+                core.kill(container.id)
+    except Exception:
+        logging.exception("deadline %s failed for %s", stage, container.name)
+
+
+def kick_deadlines():
+    if deadline_kick is not None:
+        main_loop.call_soon_threadsafe(deadline_kick.set)
+
+
+async def enforce_deadlines():
+    global deadline_kick
+    deadline_kick = asyncio.Event()
+    while not stop_signal.done():
+        deadline_kick.clear()
+        for container_id, stage in core.deadlines.pop_due():
+            write_pool.submit(enforce_deadline, container_id, stage)
+        due = core.deadlines.next_due()
+        delay = 60.0 if due is None else min(max(due - time.time(), 0.0), 60.0)
+        _, pending = await wait_any([asyncio.sleep(delay), deadline_kick.wait(), stop_signal])
+        for task in pending:
+            if task is not stop_signal:
+                task.cancel()
+
+
+async def image_gc():
+    while not stop_signal.done():
+        try:
+            await write_pool.run(core.collect_images)
+        except Exception:
+            logging.exception("image gc error")
+        await wait_any([asyncio.sleep(get_config().image_gc_interval), stop_signal])
+
+
 async def bookkeep():
     while not stop_signal.done():
         try:
-            await threaded_handler(core.bookkeep)()
+            await write_pool.run(core.bookkeep)
         except Exception:
             logging.exception("book keeping error")
+        evicted = tailers.evict()
+        if evicted:
+            logging.info("evicted %d idle log followers, now %s", evicted, tailers.stats())
+        await publisher.publish()
         await wait_any([asyncio.sleep(10), stop_signal])
 
 
@@ -366,24 +769,41 @@ def run_mond():
 async def mond():
     while not stop_signal.done():
         if get_config().grafana_endpoint:
-            await threaded_handler(run_mond)()
+            await stream_pool.run(run_mond)
         await wait_any([asyncio.sleep(300), stop_signal])
 
 
+async def watch_events():
+    while not stop_signal.done():
+        try:
+            since = time.time()
+            await read_pool.run(core.inventory.reconcile)
+            async for event in engine.events(dict(type=['container']), since):
+                await read_pool.run(core.inventory.apply_event, event)
+        except Exception:
+            logging.exception("docker event stream broken")
+        await wait_any([asyncio.sleep(1), stop_signal])
+
+
 async def one_pass():
     global hostname
     hostname = socket.gethostname()
     ws = None
     try:
         ws = await websockets.connect(get_config().central_host, max_size=2**24)
-        result = await client_serial(ws, 'auth', dict(token=issue(hostname, 'daemon')))
+        result = await client_serial(ws, 'auth', dict(token=issue(hostname, 'daemon'), codecs=CODECS))
         assert result['code'] == 0, 'authentication failed: %s' % result['msg']
+        set_codec(ws, result.get('codec', 'json'))
         logging.info("Connected to Central Server")
-        await ws.send(json.dumps(dict(ticket='daemon-special', cmd='daemon')))
-        await command_handler(ws, dispatch)
+        await send(ws, dict(ticket='daemon-special', cmd='daemon'))
+        publisher.attach(ws)
+        await command_handler(ws, dispatch, limits=upstream_limits(inline_command))
     except Exception:
         logging.exception("Connection to Central is Lost")
     finally:
+        publisher.attach(None)
+        for stream in list(log_streams.values()):
+            stream.cancel()
         if ws is not None:
             await ws.close()
 
@@ -391,25 +811,46 @@ async def one_pass():
 async def main():
     import psutil
     print("I am", psutil.Process().pid)
-    global stop_signal
+    global stop_signal, main_loop
     logging.basicConfig(level=logging.INFO)
     stop_signal = asyncio.Future()
+    main_loop = asyncio.get_running_loop()
     back = 1
-    core.set_up()
+    core.deadlines.on_change = kick_deadlines
+    core.set_up(watch=engine is None)
+    asyncio.create_task(enforce_deadlines()).add_done_callback(common_task_callback('daemon-deadlines'))
+    if engine is not None:
+        asyncio.create_task(watch_events()).add_done_callback(common_task_callback('daemon-events'))
     asyncio.create_task(cleanup()).add_done_callback(common_task_callback('daemon-clean-up'))
     asyncio.create_task(bookkeep()).add_done_callback(common_task_callback('daemon-bookkeep'))
+    asyncio.create_task(image_gc()).add_done_callback(common_task_callback('daemon-image-gc'))
     asyncio.create_task(mond()).add_done_callback(common_task_callback('daemon-mond'))
-    while not stop_signal.done():
-        s = time.time()
-        await one_pass()
-        interval = time.time() - s
-        if interval > back + 5 and back > 2:
-            back = 2
-        if back > 900:
-            back = 900
-        logging.info("Reconnecting in %d", back)
-        await asyncio.sleep(back)
-        back *= 2
+    main_loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        while not stop_signal.done():
+            s = time.time()
+            await one_pass()
+            interval = time.time() - s
+            if interval > back + 5 and back > 2:
+                back = 2
+            if back > 900:
+                back = 900
+            logging.info("Reconnecting in %d", back)
+            await asyncio.sleep(back)
+            back *= 2
+    finally:
+        shutdown()
+
+
+def shutdown():
+    logging.info("Shutting down worker pools")
+    if not stop_signal.done():
+        stop_signal.set_result(None)
+    core.stopping.set()
+    for stream in list(log_streams.values()):
+        stream.cancel()
+    for pool in pools:
+        pool.shutdown()
 
 
 def sync_main():
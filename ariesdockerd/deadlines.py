@@ -0,0 +1,81 @@
+import time
+import heapq
+import threading
+from typing import *
+
+
+STAGES = ('warn', 'stop', 'kill')
+
+
+class DeadlineHeap(object):
+    def __init__(
+        self, warning: float = 0.0, grace: float = 30.0,
+        clock: Callable[[], float] = time.time, on_change: Optional[Callable[[], None]] = None
+    ) -> None:
+        self.warning = warning
+        self.grace = grace
+        self.clock = clock
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.heap: List[Tuple[float, int, str, str]] = []
+        self.expiry: Dict[str, Tuple[int, float]] = dict()
+        self.generation = 0
+        self.fired = {stage: 0 for stage in STAGES}
+
+    def set(self, key: str, expires: float):
+        with self.lock:
+            current = self.expiry.get(key)
+            if current is not None and current[1] == expires:
+                return False
+            self.generation += 1
+            self.expiry[key] = self.generation, expires
+            now = self.clock()
+            if self.warning > 0 and expires - self.warning > now:
+                heapq.heappush(self.heap, (expires - self.warning, self.generation, key, 'warn'))
+            heapq.heappush(self.heap, (expires, self.generation, key, 'stop'))
+            heapq.heappush(self.heap, (expires + self.grace, self.generation, key, 'kill'))
+            self.compact()
+        if self.on_change is not None:
+            self.on_change()
+        return True
+
+    def discard(self, key: str):
+        with self.lock:
+            return self.expiry.pop(key, None) is not None
+
+    def compact(self):
+        if len(self.heap) > 4 * len(STAGES) * (len(self.expiry) + 16):
+            self.heap = [x for x in self.heap if self.live(x)]
+            heapq.heapify(self.heap)
+
+    def live(self, item: Tuple[float, int, str, str]):
+        current = self.expiry.get(item[2])
+        return current is not None and current[0] == item[1]
+
+    def pop_due(self, now: Optional[float] = None):
+        if now is None:
+            now = self.clock()
+        due = []
+        with self.lock:
+            while len(self.heap) and self.heap[0][0] <= now:
+                item = heapq.heappop(self.heap)
+                if not self.live(item):
+                    continue
+                if item[3] == 'kill':
+                    self.expiry.pop(item[2])
+                self.fired[item[3]] += 1
+                due.append((item[2], item[3]))
+        return due
+
+    def next_due(self):
+        with self.lock:
+            while len(self.heap) and not self.live(self.heap[0]):
+                heapq.heappop(self.heap)
+            return self.heap[0][0] if len(self.heap) else None
+
+    def __contains__(self, key: str):
+        return key in self.expiry
+
+    def stats(self):
+        with self.lock:
+            return dict(tracked=len(self.expiry), heap=len(self.heap), **{'fired_' + k: v for k, v in self.fired.items()})
@@ -0,0 +1,215 @@
+import json
+import struct
+import asyncio
+import contextlib
+import urllib.parse
+from typing import *
+
+
+class EngineError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+
+class Demuxer(object):
+    def __init__(self) -> None:
+        self.buf = bytearray()
+
+    def feed(self, data: bytes):
+        self.buf += data
+        out = []
+        while len(self.buf) >= 8:
+            size = struct.unpack('>I', self.buf[4:8])[0]
+            if len(self.buf) < 8 + size:
+                break
+            out.append(bytes(self.buf[8: 8 + size]))
+            del self.buf[:8 + size]
+        return out
+
+
+class Connection(object):
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class Response(object):
+    def __init__(self, conn: Connection, method: str, status: int, headers: Dict[str, str]) -> None:
+        self.conn = conn
+        self.method = method
+        self.status = status
+        self.headers = headers
+        self.done = False
+        self.reusable = headers.get('connection', '').lower() != 'close'
+
+    async def chunks(self):
+        reader = self.conn.reader
+        if self.headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                data = await reader.readexactly(size)
+                await reader.readexactly(2)
+                yield data
+        elif 'content-length' in self.headers:
+            remaining = int(self.headers['content-length'])
+            while remaining > 0:
+                data = await reader.read(min(remaining, 2 ** 16))
+                if not len(data):
+                    raise EngineError(-1, 'engine closed the connection mid-body')
+                remaining -= len(data)
+                yield data
+        elif self.status not in (204, 304) and self.method != 'HEAD':
+            self.reusable = False
+            while True:
+                data = await reader.read(2 ** 16)
+                if not len(data):
+                    break
+                yield data
+        self.done = True
+
+    async def read(self):
+        return b''.join([chunk async for chunk in self.chunks()])
+
+
+class DockerEngine(object):
+    def __init__(self, path: str = '/var/run/docker.sock', api_version: str = 'v1.41', max_connections: int = 16) -> None:
+        self.path = path
+        self.api_version = api_version
+        self.max_connections = max_connections
+        self.idle: List[Connection] = []
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.connects = 0
+        self.requests = 0
+
+    async def connect(self):
+        reader, writer = await asyncio.open_unix_connection(self.path, limit=2 ** 20)
+        self.connects += 1
+        return Connection(reader, writer)
+
+    def url(self, path: str, params: Optional[dict] = None):
+        url = '/%s%s' % (self.api_version, path)
+        if params:
+            url += '?' + urllib.parse.urlencode({k: v for k, v in params.items() if v is not None})
+        return url
+
+    async def send(self, method: str, url: str, body: Optional[bytes]):
+        for attempt in range(2):
+            reused = len(self.idle) > 0
+            conn = self.idle.pop() if reused else await self.connect()
+            head = '%s %s HTTP/1.1\r\nHost: docker\r\n' % (method, url)
+            if body is not None:
+                head += 'Content-Type: application/json\r\nContent-Length: %d\r\n' % len(body)
+            try:
+                conn.writer.write(head.encode() + b'\r\n' + (body or b''))
+                await conn.writer.drain()
+                status_line = await conn.reader.readline()
+                if not len(status_line):
+                    raise ConnectionResetError('engine closed an idle connection')
+            except (ConnectionError, asyncio.IncompleteReadError):
+                conn.close()
+                if not reused or attempt:
+                    raise
+                continue
+            headers = dict()
+            while True:
+                line = (await conn.reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                k, _, v = line.partition(':')
+                headers[k.strip().lower()] = v.strip()
+            self.requests += 1
+            return Response(conn, method, int(status_line.split()[1]), headers)
+
+    def release(self, conn: Connection, response: Optional[Response]):
+        if response is not None and response.done and response.reusable and not conn.writer.is_closing():
+            self.idle.append(conn)
+        else:
+            conn.close()
+
+    @contextlib.asynccontextmanager
+    async def open(self, method: str, path: str, params: Optional[dict] = None, body: Optional[Any] = None):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_connections)
+        data = None if body is None else json.dumps(body).encode()
+        async with self.slots:
+            response = await self.send(method, self.url(path, params), data)
+            try:
+                if response.status >= 400:
+                    raw = await response.read()
+                    try:
+                        message = json.loads(raw)['message']
+                    except Exception:
+                        message = raw.decode(errors='replace')
+                    raise EngineError(response.status, message)
+                yield response
+            finally:
+                self.release(response.conn, response)
+
+    async def call(self, method: str, path: str, params: Optional[dict] = None, body: Optional[Any] = None):
+        async with self.open(method, path, params, body) as response:
+            raw = await response.read()
+        return json.loads(raw) if len(raw) else None
+
+    async def list_containers(self, all: bool = True, filters: Optional[dict] = None):
+        return await self.call('GET', '/containers/json', dict(
+            all=int(all), filters=None if filters is None else json.dumps(filters)
+        ))
+
+    async def inspect(self, container: str):
+        return await self.call('GET', '/containers/%s/json' % container)
+
+    async def create(self, name: str, config: dict):
+        return (await self.call('POST', '/containers/create', dict(name=name), config))['Id']
+
+    async def start(self, container: str):
+        await self.call('POST', '/containers/%s/start' % container)
+
+    async def stop(self, container: str, timeout: int = 10):
+        await self.call('POST', '/containers/%s/stop' % container, dict(t=timeout))
+
+    async def kill(self, container: str, signal: str = 'SIGKILL'):
+        await self.call('POST', '/containers/%s/kill' % container, dict(signal=signal))
+
+    async def remove(self, container: str, force: bool = False):
+        await self.call('DELETE', '/containers/%s' % container, dict(force=int(force)))
+
+    async def logs(
+        self, container: str, follow: bool = False, tail: Union[str, int] = 'all',
+        since: Optional[int] = None, until: Optional[int] = None, tty: Optional[bool] = None
+    ):
+        if tty is None and tuple(map(int, self.api_version.lstrip('v').split('.'))) < (1, 42):
+            tty = (await self.inspect(container))['Config']['Tty']
+        params = dict(stdout=1, stderr=1, follow=int(follow), tail=tail, since=since, until=until)
+        async with self.open('GET', '/containers/%s/logs' % container, params) as response:
+            multiplexed = 'multiplexed' in response.headers.get('content-type', '') or tty is False
+            demuxer = Demuxer()
+            async for chunk in response.chunks():
+                if not multiplexed:
+                    yield chunk
+                    continue
+                for payload in demuxer.feed(chunk):
+                    yield payload
+
+    async def events(self, filters: Optional[dict] = None, since: Optional[float] = None):
+        params = dict(filters=None if filters is None else json.dumps(filters), since=since)
+        async with self.open('GET', '/events', params) as response:
+            buf = b''
+            async for chunk in response.chunks():
+                lines = (buf + chunk).split(b'\n')
+                buf = lines.pop()
+                for line in lines:
+                    if len(line.strip()):
+                        yield json.loads(line)
+
+    async def close(self):
+        while len(self.idle):
+            self.idle.pop().close()
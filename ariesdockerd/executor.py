@@ -3,23 +3,23 @@ import jwt
 import time
 import docker
 import psutil
+import shutil
 import logging
+import threading
 import subprocess
 from typing import *
-from dataclasses import dataclass
 from dateutil.parser import isoparse
 from docker.types import DeviceRequest, Ulimit, Mount
 from docker.models.containers import Container
-from docker.errors import NotFound
+from docker.errors import NotFound, ImageNotFound, APIError
+from docker.utils import parse_repository_tag
 from .config import get_config
-
-
-@dataclass
-class ContainerEphemeral:
-    logs: bytes
-    name: str
-    user: str
-    entry_creation_time: float
+from .archive import LogArchive
+from .inventory import Inventory
+from .mounts import SharedMount
+from .stats import Phases
+from .imagegc import ImageGC, ImageInfo
+from .deadlines import DeadlineHeap
 
 
 class Executor(object):
@@ -27,56 +27,69 @@ class Executor(object):
     def __init__(self) -> None:
         self.client = docker.from_env()
         self.shared_devices: List[str] = []
-        self.mount_paths = get_config().mount_paths
-        self.exit_store: Dict[str, ContainerEphemeral] = dict()
+        cfg = get_config()
+        self.mount_paths = cfg.mount_paths
+        self.exit_store = LogArchive(
+            os.path.expanduser(cfg.log_archive_path), cfg.log_archive_max_bytes, cfg.log_archive_max_age
+        )
         self.mark_removed = set()
+        self.inventory = Inventory(
+            self.list_managed, self.find, self.container_events, self.decode_token, cfg.inventory_reconcile
+        )
+        self.stopping = threading.Event()
+        self.images: Set[str] = set()
+        self.image_gc = ImageGC(
+            os.path.expanduser(cfg.image_gc_path), cfg.image_gc_high, cfg.image_gc_low,
+            cfg.image_gc_min_age, cfg.image_gc_batch
+        )
+        self.docker_root = '/var/lib/docker'
+        self.deadlines = DeadlineHeap(cfg.deadline_warning, cfg.deadline_grace)
+        self.dv0 = SharedMount(
+            '/run/ariesdockerd/ariesdv0/mountp', self.start_dv0, self.stop_dv0, cfg.dv0_linger, cfg.dv0_ready_timeout
+        )
 
-    def set_up(self):
+    def set_up(self, watch: bool = True):
         if os.path.exists('/dev/infiniband'):
             self.shared_devices.append('/dev/infiniband:/dev/infiniband')
+        self.docker_root = self.client.info().get('DockerRootDir', self.docker_root)
+        self.inventory.reconcile()
+        self.sync_deadlines()
+        self.refresh_images()
+        if watch:
+            self.inventory.start(self.stopping)
+        self.dv0.sync(c.name for c, _ in self.inventory.items())
 
-    def clean_up(self):
-        logging.info("Performing clean-up...")
-        self.client.containers.prune()
-        self.client.networks.prune()
-        self.client.images.prune(filters=dict(dangling=False))
-        for k, v in list(self.exit_store.items()):
-            if time.time() > v.entry_creation_time + 86400 * 7:
-                self.exit_store.pop(k)
+    def track_deadline(self, container: Container, info: dict):
+        timeout = info.get('timeout', 2147483647)
+        created_str = container.attrs.get('Created')
+        if timeout >= 2147483647 or not created_str or container.status in ('exited', 'dead'):
+            return self.deadlines.discard(container.id)
+        return self.deadlines.set(container.id, isoparse(created_str).timestamp() + timeout)
 
-    def get_managed(self, container: str):
-        cont: Container = self.client.containers.get(container)
-        if 'ariesmanaged' not in cont.labels:
-            raise ValueError("container not managed by executor", container)
-        return cont
+    def sync_deadlines(self):
+        live = set()
+        for container, info in self.inventory.items():
+            live.add(container.id)
+            self.track_deadline(container, info)
+        for key in list(self.deadlines.expiry):
+            if key not in live:
+                self.deadlines.discard(key)
 
-    def get_any(self, container: str):
-        cont: Container = self.client.containers.get(container)
-        return cont
+    def warn(self, container: str, message: str):
+        self.get_managed(container).exec_run(['sh', '-c', 'echo "$0" > /proc/1/fd/1', message], detach=True)
 
-    def stop(self, container: str):
-        c = self.get_managed(container)
-        c.stop()
-        self.get_any(c.name + '-ariesdv0').stop()
-
-    def run(self, name: str, image: str, cmd: Union[str, List[str]], gpu_ids: List[int], user: str, env: list, timeout: int):
-        gpu_id_string = ','.join(map(str, gpu_ids))
-        if timeout <= 0:
-            timeout = 2147483647
-        bookkeep_info = dict(gpu_ids=gpu_ids, user=user, timeout=timeout)
-        token = jwt.encode(bookkeep_info, get_config().jwt_key, "HS256")
-        based = "/run/ariesdockerd/" + name + str(int(time.time()))
-        mountp = based + "/mountp"
-        os.makedirs(mountp, exist_ok=True)
-        self.client.containers.run(
+    def start_dv0(self, mountp: str):
+        based = os.path.dirname(mountp)
+        self.remove_dv0()
+        return self.client.containers.run(
             'tcnghia/fusermount:latest',
             [
                 "/usr/local/bin/weed", "-logdir=" + based, "mount",
                 "-filer=10.8.150.13:8888", "-filer.path=/ariesdv0",
                 "-dir=" + mountp
             ],
-            name=name + '-ariesdv0',
-            hostname=name + '-ariesdv0',
+            name='ariesdockerd-dv0',
+            hostname='ariesdockerd-dv0',
             detach=True,
             remove=True,
             devices=['/dev/fuse:/dev/fuse'],
@@ -93,32 +106,179 @@ class Executor(object):
                 "/usr/local/bin/weed:/usr/local/bin/weed"
             ]
         )
-        for _ in range(200):
-            time.sleep(0.1)
-            if os.path.ismount(mountp):
-                break
-        if not os.path.ismount(mountp):
-            raise ValueError("mount failed")
-        return self.client.containers.run(
-            image, cmd,
-            name=name,
-            hostname=name,
-            detach=True,
-            devices=self.shared_devices,
-            device_requests=[DeviceRequest(device_ids=[gpu_id_string], capabilities=[['gpu']])],
-            ulimits=[Ulimit(name='memlock', soft=1048576000, hard=1048576000)],
-            shm_size='%dG' % (64 * len(gpu_ids) + 32),
-            network_mode='host',
-            volumes=[mountp + ":/ariesdv0"],
-            labels={"ariesmanaged": token},
-            environment=env + (['NCCL_P2P_DISABLE=1'] if len(gpu_ids) < 8 else [])
-        ).short_id
+
+    def remove_dv0(self):
+        # the name must be free before run, a stopped auto-remove container may still hold it
+        try:
+            c = self.get_any('ariesdockerd-dv0')
+            try:
+                c.remove(force=True)
+            except APIError as exc:
+                if exc.status_code != 409:
+                    raise
+                c.wait(condition='removed')
+        except NotFound:
+            pass
+
+    def stop_dv0(self, handle: Optional[Container]):
+        try:
+            self.get_any('ariesdockerd-dv0').stop()
+        except NotFound:
+            pass
+
+    def stop_legacy_dv0(self, name: str):
+        # containers launched before the shared mount still own a per-container sidecar
+        try:
+            self.get_any(name + '-ariesdv0').stop()
+        except NotFound:
+            pass
+
+    def list_managed(self):
+        return self.client.containers.list(all=True, filters=dict(label='ariesmanaged'))
+
+    def find(self, container_id: str) -> Optional[Container]:
+        try:
+            return self.client.containers.get(container_id)
+        except NotFound:
+            return None
+
+    def container_events(self):
+        return self.client.events(decode=True, filters=dict(type='container'))
+
+    def decode_token(self, token: str):
+        try:
+            return jwt.decode(token, get_config().jwt_key, algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            logging.warning("Invalid Token Found in `ariesmanaged`: %s", token)
+            return None
+
+    def clean_up(self):
+        logging.info("Performing clean-up...")
+        self.client.containers.prune()
+        self.client.networks.prune()
+        self.exit_store.expire()
+
+    def get_managed(self, container: str):
+        cont: Container = self.client.containers.get(container)
+        if 'ariesmanaged' not in cont.labels:
+            raise ValueError("container not managed by executor", container)
+        return cont
+
+    def get_any(self, container: str):
+        cont: Container = self.client.containers.get(container)
+        return cont
+
+    def stop(self, container: str):
+        c = self.get_managed(container)
+        c.stop()
+        self.inventory.refresh(c.id)
+        self.dv0.release(c.name)
+        self.stop_legacy_dv0(c.name)
+
+    def refresh_images(self):
+        refs = set()
+        for image in self.client.images.list():
+            refs.update(image.tags)
+            refs.update(image.attrs.get('RepoDigests') or [])
+        self.images = refs
+        return refs
+
+    def ensure_image(self, image: str):
+        try:
+            found = self.client.images.get(image)
+            pulled = False
+        except ImageNotFound:
+            repository, tag = parse_repository_tag(image)
+            found = self.client.images.pull(repository, tag=tag or 'latest')
+            self.images = self.images | set(found.tags) | set(found.attrs.get('RepoDigests') or [])
+            pulled = True
+        self.image_gc.touch([found.id])
+        return pulled
+
+    def collect_images(self):
+        usage = shutil.disk_usage(self.docker_root)
+        self.image_gc.runs += 1
+        if not self.image_gc.pressured(usage.used, usage.total):
+            return []
+        in_use = {c.attrs.get('Image') for c in self.client.containers.list(all=True)}
+        self.image_gc.touch(in_use)
+        images = [
+            ImageInfo(
+                img.id, list(img.tags) + list(img.attrs.get('RepoDigests') or []),
+                img.attrs.get('Size', 0), isoparse(img.attrs['Created']).timestamp()
+            )
+            for img in self.client.images.list()
+        ]
+        removed = []
+        for image in self.image_gc.plan(images, in_use, usage.used, usage.total):
+            try:
+                self.client.images.remove(image.image_id, force=True)
+            except APIError as exc:
+                logging.warning("image gc cannot remove %s: %s", image.refs or image.image_id, exc)
+                continue
+            self.image_gc.evicted_image(image)
+            removed.append(image)
+        if len(removed):
+            logging.info(
+                "image gc removed %s, disk at %.1f%%",
+                [image.refs or image.image_id for image in removed], 100 * usage.used / usage.total
+            )
+            self.refresh_images()
+        self.image_gc.save()
+        return removed
+
+    def run(self, name: str, image: str, cmd: Union[str, List[str]], gpu_ids: List[int], user: str, env: list, timeout: int, p2p: bool = False, phases: Optional[Phases] = None):
+        if phases is None:
+            phases = Phases()
+        gpu_id_string = ','.join(map(str, gpu_ids))
+        if timeout <= 0:
+            timeout = 2147483647
+        bookkeep_info = dict(gpu_ids=gpu_ids, user=user, timeout=timeout)
+        token = jwt.encode(bookkeep_info, get_config().jwt_key, "HS256")
+        phases.mark('validate')
+        mountp = self.dv0.acquire(name)
+        phases.mark('mount')
+        try:
+            self.ensure_image(image)
+            phases.mark('pull')
+            container = self.client.containers.run(
+                image, cmd,
+                name=name,
+                hostname=name,
+                detach=True,
+                devices=self.shared_devices,
+                device_requests=[DeviceRequest(device_ids=[gpu_id_string], capabilities=[['gpu']])],
+                ulimits=[Ulimit(name='memlock', soft=1048576000, hard=1048576000)],
+                shm_size='%dG' % (64 * len(gpu_ids) + 32),
+                network_mode='host',
+                volumes=[mountp + ":/ariesdv0"],
+                labels={"ariesmanaged": token},
+                environment=env + (['NCCL_P2P_DISABLE=1'] if len(gpu_ids) < 8 and not p2p else [])
+            )
+        except Exception:
+            self.dv0.release(name)
+            raise
+        phases.mark('run')
+        self.inventory.put(container)
+        self.dv0.settle(name)
+        self.track_deadline(container, bookkeep_info)
+        return container.short_id
 
     def logs(self, container: str):
         return self.get_managed(container).logs()
 
-    def logs_follow(self, container: str) -> Generator[bytes, None, None]:
-        return self.get_managed(container).logs(stream=True)
+    def logs_follow(self, container: str, tail: Union[str, int] = 'all') -> Generator[bytes, None, None]:
+        return self.get_managed(container).logs(stream=True, tail=tail)
+
+    def logs_tail(self, container: str, tail: int) -> bytes:
+        return self.get_managed(container).logs(tail=tail)
+
+    def resolve(self, container: str) -> str:
+        return self.get_managed(container).id
+
+    def logs_stream(self, container: str, tail: Union[str, int] = 'all', since: Optional[int] = None, until: Optional[int] = None) -> Generator[bytes, None, None]:
+        window = {k: v for k, v in dict(since=since, until=until).items() if v is not None}
+        return self.get_managed(container).logs(stream=True, follow=False, tail=tail, **window)
 
     def stat(self, container: str):
         return self.get_managed(container).status
@@ -127,7 +287,7 @@ class Executor(object):
         c = self.get_managed(container)
         errors = []
         try:
-            self.get_any(c.name + '-ariesdv0').stop()
+            self.stop_legacy_dv0(c.name)
         except Exception as exc:
             errors.append(repr(exc))
         for _ in range(2):
@@ -146,8 +306,11 @@ class Executor(object):
                 except Exception as exc:
                     errors.append(repr(exc))
             time.sleep(1)
+        self.deadlines.discard(c.id)
         try:
             c.remove(force=True)
+            self.inventory.remove(c.id)
+            self.dv0.release(c.name)
         except Exception as exc:
             errors.append(repr(exc))
         self.mark_removed.add(c.short_id)
@@ -156,44 +319,35 @@ class Executor(object):
 
     def scan(self):
         valid: List[Tuple[Container, dict]] = []
-        for container in self.client.containers.list(all=True):
+        for container, info in self.inventory.items():
             container: Container
-            if 'ariesmanaged' in container.labels:
-                token = container.labels['ariesmanaged']
-                try:
-                    info = jwt.decode(token, get_config().jwt_key, algorithms=["HS256"])
-                    if container.short_id in self.mark_removed:
-                        info['removed'] = True
-                    valid.append((container, info))
-                except jwt.InvalidTokenError:
-                    logging.warning("Invalid Token Found in `ariesmanaged`: %s", token)
+            if container.short_id in self.mark_removed:
+                info = dict(info, removed=True)
+            valid.append((container, info))
         return valid
 
     def bookkeep(self):
+        if self.inventory.due():
+            self.inventory.reconcile()
+            self.sync_deadlines()
+            self.refresh_images()
+        # containers removed behind our back (docker rm, crashes) drop their hold here
+        self.dv0.sync(c.name for c, _ in self.inventory.items())
+        self.dv0.expire()
         for container, info in self.scan():
             container: Container
             if container.status == 'exited':
-                self.exit_store[container.short_id] = ContainerEphemeral(
-                    container.logs(),
+                self.exit_store.put(
+                    container.short_id,
                     container.name,
                     info['user'],
-                    time.time()
+                    container.logs(stream=True, follow=False)
                 )
                 container.remove()
+                self.inventory.remove(container.id)
+                self.deadlines.discard(container.id)
+                self.dv0.release(container.name)
                 try:
-                    self.get_any(container.name + '-ariesdv0').stop()
-                except NotFound:
-                    pass
+                    self.stop_legacy_dv0(container.name)
                 except Exception:
                     logging.exception("cannot stop volume daemon")
-            created_str = container.attrs.get("Created")
-            if created_str:
-                created = isoparse(created_str)
-                if time.time() - created.timestamp() > info.get("timeout", 2147483647):
-                    try:
-                        self.stop(container.short_id)
-                    except Exception:
-                        try:
-                            self.kill(container.short_id)
-                        except Exception:
-                            logging.exception("book keeping kill failed")
@@ -0,0 +1,49 @@
+import asyncio
+from typing import *
+from dataclasses import dataclass, field
+
+
+@dataclass
+class FanoutResult:
+    results: Dict[str, Any] = field(default_factory=dict)
+    errors: Dict[str, BaseException] = field(default_factory=dict)
+    missed: List[str] = field(default_factory=list)
+
+
+async def hedged(call: Callable[[], Awaitable], hedge: Optional[float] = None):
+    first = asyncio.ensure_future(call())
+    if not hedge or hedge <= 0:
+        return await first
+    attempts = [first]
+    try:
+        done, _ = await asyncio.wait(attempts, timeout=hedge)
+        if not done:
+            attempts.append(asyncio.ensure_future(call()))
+        pending = set(attempts)
+        while len(pending):
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+        return first.result()
+    finally:
+        for task in attempts:
+            task.cancel()
+
+
+async def fanout(calls: Dict[str, Callable[[], Awaitable]], deadline: Optional[float] = None, hedge: Optional[float] = None):
+    res = FanoutResult()
+    if not len(calls):
+        return res
+    tasks = {name: asyncio.ensure_future(hedged(call, hedge)) for name, call in calls.items()}
+    _, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+    for name, task in tasks.items():
+        if task in pending:
+            task.cancel()
+            res.missed.append(name)
+        elif task.exception() is not None:
+            res.errors[name] = task.exception()
+        else:
+            res.results[name] = task.result()
+    res.missed.sort()
+    return res
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import *
+from dataclasses import dataclass
+from .cluster import image_ref
+
+
+@dataclass
+class ImageInfo:
+    image_id: str
+    refs: List[str]
+    size: int
+    created: float
+
+
+class ImageGC(object):
+    def __init__(
+        self, path: Optional[str] = None, high: float = 0.85, low: float = 0.75,
+        min_age: float = 3600.0, batch: int = 2
+    ) -> None:
+        self.path = path
+        self.high = high
+        self.low = low
+        self.min_age = min_age
+        self.batch = batch
+        self.lock = threading.Lock()
+        self.last_used: Dict[str, float] = dict()
+        self.protected: Set[str] = set()
+        self.runs = 0
+        self.evicted = 0
+        self.freed = 0
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as fi:
+                    self.last_used = {str(k): float(v) for k, v in json.load(fi).items()}
+            except Exception:
+                logging.exception("cannot load image usage from %s, starting empty", path)
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self.lock:
+            data = dict(self.last_used)
+        with open(self.path + '.tmp', 'w') as fo:
+            json.dump(data, fo)
+        os.replace(self.path + '.tmp', self.path)
+
+    def touch(self, keys: Iterable[str], now: Optional[float] = None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            for key in keys:
+                self.last_used[key] = now
+
+    def protect(self, images: Iterable[str]):
+        with self.lock:
+            self.protected = {image_ref(image) for image in images}
+
+    def last_use(self, image: ImageInfo):
+        with self.lock:
+            return max([self.last_used.get(k, 0.0) for k in [image.image_id] + image.refs] + [image.created])
+
+    def pressured(self, used: int, total: int):
+        return total > 0 and used > self.high * total
+
+    def plan(self, images: List[ImageInfo], in_use: Set[str], used: int, total: int, now: Optional[float] = None):
+        if not self.pressured(used, total):
+            return []
+        if now is None:
+            now = time.time()
+        with self.lock:
+            protected = set(self.protected)
+        candidates = []
+        for image in images:
+            if image.image_id in in_use or protected.intersection(image.refs):
+                continue
+            last = self.last_use(image)
+            if now - last < self.min_age:
+                continue
+            candidates.append((last, image))
+        candidates.sort(key=lambda x: x[0])
+        need = used - self.low * total
+        victims = []
+        for _, image in candidates[:self.batch]:
+            if need <= 0:
+                break
+            victims.append(image)
+            need -= image.size
+        return victims
+
+    def evicted_image(self, image: ImageInfo):
+        with self.lock:
+            self.evicted += 1
+            self.freed += image.size
+            for k in [image.image_id] + image.refs:
+                self.last_used.pop(k, None)
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                runs=self.runs, evicted=self.evicted, freed_bytes=self.freed,
+                protected=len(self.protected), tracked=len(self.last_used)
+            )
@@ -0,0 +1,145 @@
+import time
+import logging
+import threading
+from typing import *
+
+
+CONTAINER_ACTIONS = {
+    'create', 'start', 'restart', 'die', 'stop', 'kill', 'oom', 'pause', 'unpause', 'rename', 'update', 'destroy'
+}
+
+
+class Inventory(object):
+    def __init__(
+        self, list_managed: Callable[[], list], get: Callable[[str], Optional[Any]],
+        events: Callable[[], Iterable[dict]], decode: Callable[[str], Optional[dict]],
+        reconcile_interval: float = 300.0
+    ) -> None:
+        self.list_managed = list_managed
+        self.get = get
+        self.events = events
+        self.decode = decode
+        self.reconcile_interval = reconcile_interval
+        self.lock = threading.Lock()
+        self.containers: Dict[str, Any] = dict()
+        self.infos: Dict[str, dict] = dict()
+        self.version = 0
+        self.applied = 0
+        self.reconciles = 0
+        self.corrections = 0
+        self.last_reconcile = 0.0
+        self.thread: Optional[threading.Thread] = None
+
+    def items(self):
+        with self.lock:
+            return [(self.containers[k], self.infos[k]) for k in self.containers]
+
+    def find(self, key: str):
+        with self.lock:
+            found = [c for k, c in self.containers.items() if k.startswith(key) or c.name == key]
+        return found[0] if len(found) == 1 else None
+
+    def ids(self):
+        with self.lock:
+            return set(self.containers)
+
+    def __contains__(self, container_id: str):
+        with self.lock:
+            return container_id in self.containers
+
+    def info_of(self, container):
+        with self.lock:
+            info = self.infos.get(container.id)
+        if info is None:
+            info = self.decode(container.labels['ariesmanaged'])
+        return info
+
+    def put(self, container):
+        info = self.info_of(container)
+        if info is None:
+            return self.remove(container.id)
+        with self.lock:
+            old = self.containers.get(container.id)
+            self.containers[container.id] = container
+            self.infos[container.id] = info
+            if old is None or old.status != container.status or old.name != container.name:
+                self.version += 1
+                return True
+        return False
+
+    def remove(self, container_id: str):
+        with self.lock:
+            if self.containers.pop(container_id, None) is None:
+                return False
+            self.infos.pop(container_id)
+            self.version += 1
+            return True
+
+    def refresh(self, container_id: str):
+        container = self.get(container_id)
+        if container is None or 'ariesmanaged' not in container.labels:
+            return self.remove(container_id)
+        return self.put(container)
+
+    def apply_event(self, event: dict):
+        if event.get('Type') != 'container':
+            return False
+        action = event.get('Action', '').split(':')[0]
+        if action not in CONTAINER_ACTIONS:
+            return False
+        container_id = event.get('id') or event.get('Actor', {}).get('ID')
+        if container_id is None:
+            return False
+        attributes = event.get('Actor', {}).get('Attributes', {})
+        if 'ariesmanaged' not in attributes and container_id not in self:
+            return False
+        self.applied += 1
+        if action == 'destroy':
+            return self.remove(container_id)
+        return self.refresh(container_id)
+
+    def reconcile(self):
+        current = {c.id: c for c in self.list_managed()}
+        changed = 0
+        for container_id in self.ids() - set(current):
+            changed += self.remove(container_id)
+        for container in current.values():
+            changed += self.put(container)
+        self.reconciles += 1
+        self.last_reconcile = time.monotonic()
+        if self.reconciles > 1 and changed:
+            self.corrections += changed
+            logging.warning("inventory reconcile corrected %d containers", changed)
+        return changed
+
+    def due(self, now: Optional[float] = None):
+        if now is None:
+            now = time.monotonic()
+        return now - self.last_reconcile >= self.reconcile_interval
+
+    def watch(self, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                stream = self.events()
+                self.reconcile()
+                for event in stream:
+                    if stop.is_set():
+                        break
+                    try:
+                        self.apply_event(event)
+                    except Exception:
+                        logging.exception("inventory event failed: %s", event)
+            except Exception:
+                logging.exception("docker event stream broken")
+            stop.wait(1)
+
+    def start(self, stop: threading.Event):
+        self.thread = threading.Thread(target=self.watch, args=(stop,), daemon=True, name='aries-inventory')
+        self.thread.start()
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                containers=len(self.containers), version=self.version, events=self.applied,
+                reconciles=self.reconciles, corrections=self.corrections
+            )
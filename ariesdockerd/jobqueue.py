@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import uuid
+import logging
+from typing import *
+from dataclasses import dataclass, asdict
+from .error import AriesError
+from .scheduling import schedule, schedule_batch, fragmentation
+
+
+@dataclass
+class PendingJob:
+    job_id: str
+    user: str
+    spec: dict
+    submitted: float
+    error: Optional[str] = None
+    failed: Optional[float] = None
+
+    @property
+    def names(self):
+        if self.spec['n_jobs'] is None:
+            return [self.spec['name']]
+        return ['%s-%d' % (self.spec['name'], i) for i in range(self.spec['n_jobs'])]
+
+
+def eligible(spec: dict, available: Dict[str, List[int]]):
+    return {
+        node: gpus for node, gpus in available.items()
+        if node not in spec['node_exclude'] and (not len(spec['node_include']) or node in spec['node_include'])
+    }
+
+
+def fits(spec: dict, capacity: Dict[str, Optional[int]]):
+    return any(cap is None or cap >= spec['n_gpus'] for cap in eligible(spec, capacity).values())
+
+
+def take(available: Dict[str, List[int]], sched: List[Tuple[str, List[int]]]):
+    for node, gpus in sched:
+        available[node] = [gpu for gpu in available[node] if gpu not in gpus]
+
+
+def reserve(available: Dict[str, List[int]], job: PendingJob):
+    pool = eligible(job.spec, available)
+    holds = []
+    for _ in range(job.spec['n_jobs'] or 1):
+        if not len(pool):
+            break
+        node = max(sorted(pool), key=lambda x: len(pool[x]))
+        held = sorted(pool[node])[:job.spec['n_gpus']]
+        take(available, [(node, held)])
+        holds.append((node, held))
+        pool[node] = available[node]
+    return holds
+
+
+class JobQueue(object):
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.jobs: List[PendingJob] = []
+        if path is not None and os.path.exists(path):
+            with open(path) as fi:
+                self.jobs = [PendingJob(**x) for x in json.load(fi)]
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + '.tmp', 'w') as fo:
+            json.dump([asdict(job) for job in self.jobs], fo)
+        os.replace(self.path + '.tmp', self.path)
+
+    def names(self):
+        return {name for job in self.jobs for name in job.names}
+
+    def submit(self, user: str, spec: dict):
+        job = PendingJob(uuid.uuid4().hex[:8], user, spec, time.time())
+        self.jobs.append(job)
+        self.save()
+        return job
+
+    def find(self, key: str):
+        for job in self.jobs:
+            if job.job_id == key or job.spec['name'] == key:
+                return job
+        raise AriesError(23, 'no such pending job: %s' % key)
+
+    def remove(self, job: PendingJob):
+        self.jobs.remove(job)
+        self.save()
+
+    def fail(self, job: PendingJob, error: str):
+        job.error = error
+        job.failed = time.time()
+        self.jobs.append(job)
+        self.save()
+
+    def expire_failed(self, ttl: float, now: Optional[float] = None):
+        if now is None:
+            now = time.time()
+        expired = [job for job in self.jobs if job.error is not None and now - (job.failed or job.submitted) > ttl]
+        if len(expired):
+            self.jobs = [job for job in self.jobs if job not in expired]
+            self.save()
+        return expired
+
+    def failed_of(self, user: str):
+        return [job for job in self.jobs if job.error is not None and job.user == user]
+
+    def plan(
+        self, available: Dict[str, List[int]], topology: Optional[Dict[str, List[List[int]]]] = None,
+        locate_image: Optional[Callable[[str], Set[str]]] = None, capacity: Optional[Dict[str, Optional[int]]] = None
+    ):
+        available = {node: list(gpus) for node, gpus in available.items()}
+        base = {node: list(gpus) for node, gpus in available.items()}
+        placements: List[Tuple[PendingJob, List[Tuple[str, List[int]]]]] = []
+        blocked = False
+        for job in self.jobs:
+            if job.error is not None:
+                continue
+            if capacity is not None and not fits(job.spec, capacity):
+                continue
+            pool = eligible(job.spec, available)
+            if not len(pool):
+                continue
+            try:
+                sched = schedule(
+                    {node: list(gpus) for node, gpus in pool.items()}, job.spec['n_jobs'], job.spec['n_gpus'], topology,
+                    job.spec.get('placement', 'greedy'),
+                    locate_image(job.spec['image']) if locate_image is not None else None
+                )
+            except AriesError as exc:
+                if exc.args[0] != 12:
+                    logging.warning("pending job %s can never be scheduled: %s", job.job_id, exc.args[1])
+                    continue
+                if not blocked:
+                    take(base, reserve(available, job))
+                    blocked = True
+                continue
+            take(available, sched)
+            placements.append((job, sched))
+        if len(placements) > 1:
+            return self.rebatch(placements, available, base, topology, locate_image)
+        return placements, available
+
+    def rebatch(
+        self, placements: List[Tuple[PendingJob, List[Tuple[str, List[int]]]]], available: Dict[str, List[int]],
+        base: Dict[str, List[int]], topology: Optional[Dict[str, List[List[int]]]] = None,
+        locate_image: Optional[Callable[[str], Set[str]]] = None
+    ):
+        # FIFO admission decides which jobs start, the batch placer decides where they go together
+        jobs = [job for job, _ in placements]
+        scopes = [
+            (set(eligible(job.spec, base)), locate_image(job.spec['image']) if locate_image is not None else None)
+            for job in jobs
+        ]
+        try:
+            scheds, score = schedule_batch(
+                base, [(job.spec['n_jobs'], job.spec['n_gpus']) for job in jobs], topology, scopes=scopes
+            )
+        except AriesError:
+            return placements, available
+        if score >= fragmentation(available):
+            return placements, available
+        return list(zip(jobs, scheds)), base
+
+    def headroom(
+        self, available: Dict[str, List[int]], topology: Optional[Dict[str, List[List[int]]]] = None,
+        capacity: Optional[Dict[str, Optional[int]]] = None
+    ):
+        return self.plan(available, topology, capacity=capacity)[1]
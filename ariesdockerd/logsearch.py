@@ -0,0 +1,74 @@
+import re
+import time
+from typing import *
+from collections import deque
+
+
+def compile_pattern(pattern: str, ignore_case: bool = False):
+    return re.compile(pattern.encode(), re.IGNORECASE if ignore_case else 0)
+
+
+MAX_LINE = 2 ** 20
+DEADLINE_CHECK = 1024
+
+
+def iter_lines(chunks: Iterable[bytes], start: int = 0, max_line: int = MAX_LINE):
+    # lines longer than max_line come out in max_line pieces
+    pos = start
+    buf = bytearray()
+    for b in chunks:
+        scan = len(buf)
+        buf += b
+        begin = 0
+        while True:
+            end = buf.find(b'\n', scan)
+            if end < 0:
+                break
+            yield pos, bytes(buf[begin:end])
+            pos += end - begin + 1
+            begin = scan = end + 1
+        del buf[:begin]
+        while len(buf) > max_line:
+            yield pos, bytes(buf[:max_line])
+            pos += max_line
+            del buf[:max_line]
+    if len(buf):
+        yield pos, bytes(buf)
+
+
+def search_lines(
+    chunks: Iterable[bytes], pattern: 're.Pattern[bytes]', context: int = 0, limit: int = 100, start: int = 0,
+    deadline: Optional[float] = None
+):
+    before: Deque[bytes] = deque(maxlen=context)
+    matches: List[dict] = []
+    waiting: List[Tuple[dict, List[bytes]]] = []
+    truncated = False
+    for i, (offset, line) in enumerate(iter_lines(chunks, start)):
+        if deadline is not None and i % DEADLINE_CHECK == 0 and time.monotonic() > deadline:
+            truncated = True
+            break
+        pending = []
+        for m, after in waiting:
+            after.append(line)
+            if len(after) < context:
+                pending.append((m, after))
+            else:
+                m['after'] = [decode(x) for x in after]
+        waiting = pending
+        if pattern.search(line) is not None:
+            if len(matches) >= limit:
+                truncated = True
+                break
+            m = dict(offset=offset, line=decode(line), before=[decode(x) for x in before], after=[])
+            matches.append(m)
+            if context > 0:
+                waiting.append((m, []))
+        before.append(line)
+    for m, after in waiting:
+        m['after'] = [decode(x) for x in after]
+    return matches, truncated
+
+
+def decode(line: bytes):
+    return line.rstrip(b'\r').decode(errors='replace')
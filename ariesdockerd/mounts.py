@@ -0,0 +1,132 @@
+import os
+import time
+import select
+import logging
+import threading
+from typing import *
+
+
+class SharedMount(object):
+    def __init__(
+        self, path: str, start: Callable[[str], Any], stop: Callable[[Any], None],
+        linger: float = 300.0, ready_timeout: float = 20.0, recheck: float = 1.0,
+        is_mount: Callable[[str], bool] = os.path.ismount, mountinfo: str = '/proc/self/mountinfo'
+    ) -> None:
+        self.path = path
+        self.start = start
+        self.stop = stop
+        self.linger = linger
+        self.ready_timeout = ready_timeout
+        self.recheck = recheck
+        self.is_mount = is_mount
+        self.mountinfo = mountinfo
+        self.lock = threading.Lock()
+        self.holders: Set[str] = set()
+        # owners that acquired but whose container is not in the inventory yet survive sync
+        self.pinned: Set[str] = set()
+        self.handle: Optional[Any] = None
+        self.starting: Optional[threading.Event] = None
+        self.idle_since: Optional[float] = None
+        self.starts = 0
+        self.stops = 0
+
+    def wait_ready(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        with open(self.mountinfo, 'rb') as fi:
+            fi.read()
+            poller = select.poll()
+            poller.register(fi.fileno(), select.POLLPRI | select.POLLERR)
+            while not self.is_mount(self.path):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                poller.poll(min(remaining, self.recheck) * 1000)
+        return True
+
+    def ensure(self):
+        # called by the single owner of self.starting, without the lock held
+        if self.handle is not None:
+            logging.warning("shared mount %s went away, restarting", self.path)
+            self.teardown()
+        os.makedirs(self.path, exist_ok=True)
+        self.handle = self.start(self.path)
+        self.starts += 1
+        if not self.wait_ready(self.ready_timeout):
+            self.teardown()
+            raise ValueError("mount failed", self.path)
+
+    def teardown(self):
+        handle, self.handle = self.handle, None
+        self.stops += 1
+        try:
+            self.stop(handle)
+        except Exception:
+            logging.exception("cannot stop shared mount %s", self.path)
+
+    def acquire(self, owner: str):
+        with self.lock:
+            self.holders.add(owner)
+            self.pinned.add(owner)
+            self.idle_since = None
+            starting = self.starting
+            if starting is None:
+                if self.is_mount(self.path):
+                    return self.path
+                self.starting = starting = threading.Event()
+                owned = True
+            else:
+                owned = False
+        if not owned:
+            starting.wait()
+            if not self.is_mount(self.path):
+                self.release(owner)
+                raise ValueError("mount failed", self.path)
+            return self.path
+        try:
+            self.ensure()
+        except Exception:
+            self.release(owner)
+            raise
+        finally:
+            with self.lock:
+                self.starting = None
+            starting.set()
+        return self.path
+
+    def settle(self, owner: str):
+        with self.lock:
+            self.pinned.discard(owner)
+
+    def release(self, owner: str):
+        with self.lock:
+            self.holders.discard(owner)
+            self.pinned.discard(owner)
+            if not len(self.holders) and self.idle_since is None:
+                self.idle_since = time.monotonic()
+
+    def sync(self, owners: Iterable[str]):
+        with self.lock:
+            self.holders = set(owners) | self.pinned
+            if len(self.holders):
+                self.idle_since = None
+            elif self.idle_since is None:
+                self.idle_since = time.monotonic()
+
+    def expire(self, now: Optional[float] = None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if self.starting is not None or len(self.holders) or self.idle_since is None or now - self.idle_since < self.linger:
+                return False
+            self.idle_since = None
+            if self.handle is None and not self.is_mount(self.path):
+                return False
+            self.teardown()
+            return True
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                holders=len(self.holders), mounted=self.is_mount(self.path),
+                starts=self.starts, stops=self.stops
+            )
@@ -0,0 +1,74 @@
+import time
+import asyncio
+import threading
+import concurrent.futures
+from typing import *
+from .stats import Histogram
+
+
+class WorkerPool(object):
+    def __init__(self, name: str, workers: int) -> None:
+        self.name = name
+        self.workers = workers
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='aries-' + name)
+        self.lock = threading.Lock()
+        self.pending: Set[concurrent.futures.Future] = set()
+        self.queued = 0
+        self.busy = 0
+        self.completed = 0
+        self.wait = Histogram()
+        self.run_time = Histogram()
+
+    def submit(self, func: Callable, *args, **kwargs) -> concurrent.futures.Future:
+        enqueued = time.monotonic()
+
+        def work():
+            started = time.monotonic()
+            with self.lock:
+                self.queued -= 1
+                self.busy += 1
+                self.wait.observe(started - enqueued)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+                    self.completed += 1
+                    self.run_time.observe(time.monotonic() - started)
+
+        with self.lock:
+            self.queued += 1
+            future = self.executor.submit(work)
+            self.pending.add(future)
+        future.add_done_callback(self.settle)
+        return future
+
+    def settle(self, future: concurrent.futures.Future):
+        with self.lock:
+            self.pending.discard(future)
+            if future.cancelled():
+                self.queued -= 1
+
+    async def run(self, func: Callable, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def wrap(self, func: Callable):
+
+        async def _cmd(*args, **kwargs):
+            return await self.run(func, *args, **kwargs)
+
+        return _cmd
+
+    def shutdown(self, wait: bool = False):
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.cancel()
+        self.executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                workers=self.workers, queued=self.queued, busy=self.busy, completed=self.completed,
+                wait=self.wait.summary(), run=self.run_time.summary()
+            )
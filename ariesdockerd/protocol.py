@@ -1,41 +1,156 @@
-import uuid
 import json
+import time
+import base64
+import weakref
 import logging
 import asyncio
+import itertools
 import websockets
 from typing import *
+from dataclasses import dataclass, field
 from .error import AriesError
+from .stats import Histogram
+from .config import get_config
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+CODECS = ['msgpack', 'json'] if msgpack is not None else ['json']
+ws_codecs: 'weakref.WeakKeyDictionary[websockets.WebSocketCommonProtocol, str]' = weakref.WeakKeyDictionary()
+tickets = itertools.count(1)
 
 
 class NoResponse(Exception):
     pass
 
 
-async def process_command(ws: websockets.WebSocketCommonProtocol, dispatch: dict, message: str):
+def never_inline(payload: dict):
+    return False
+
+
+@dataclass
+class CommandLimits:
+    # per_connection None means no per-connection cap, queue_depth 0 means an unbounded queue
+    per_connection: Optional[int] = 32
+    queue_depth: int = 128
+    global_slots: Optional[asyncio.Semaphore] = None
+    inline: Callable[[dict], bool] = field(default=never_inline)
+
+
+class CommandStats(object):
+    def __init__(self) -> None:
+        self.queued = 0
+        self.inflight = 0
+        self.processed = 0
+        self.rejected = 0
+        self.queue_wait = Histogram()
+
+    def summary(self):
+        return dict(
+            queued=self.queued, inflight=self.inflight, processed=self.processed, rejected=self.rejected,
+            queue_wait=self.queue_wait.summary()
+        )
+
+
+command_stats = CommandStats()
+
+
+def make_limits(inline: Callable[[dict], bool] = never_inline):
+    cfg = get_config()
+    return CommandLimits(
+        cfg.command_inflight_per_connection, cfg.command_queue_depth,
+        asyncio.Semaphore(cfg.command_inflight_global), inline
+    )
+
+
+def upstream_limits(inline: Callable[[dict], bool] = never_inline):
+    # a daemon's single link to central carries every user's commands for the node,
+    # so it is bounded by the daemon's worker pools rather than by command slots
+    return CommandLimits(None, 0, None, inline)
+
+
+def json_default(obj):
+    if isinstance(obj, (bytes, bytearray)):
+        return base64.b64encode(obj).decode('ascii')
+    raise TypeError("cannot encode %s" % type(obj).__name__)
+
+
+def encode(payload: dict, codec: str = 'json'):
+    if codec == 'msgpack':
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, default=json_default)
+
+
+def as_bytes(data: Union[str, bytes]):
+    # binary fields are raw under msgpack and base64 under json
+    if isinstance(data, str):
+        return base64.b64decode(data)
+    return data
+
+
+def decode(message: Union[str, bytes]):
+    if isinstance(message, bytes):
+        return msgpack.unpackb(message, raw=False)
+    return json.loads(message)
+
+
+def negotiate(offered: Optional[List[str]]):
+    for codec in offered or []:
+        if codec in CODECS:
+            return codec
+    return 'json'
+
+
+def set_codec(ws: websockets.WebSocketCommonProtocol, codec: str):
+    ws_codecs[ws] = codec
+
+
+def codec_for(ws: websockets.WebSocketCommonProtocol):
+    return ws_codecs.get(ws, 'json')
+
+
+async def send(ws: websockets.WebSocketCommonProtocol, payload: dict):
+    await ws.send(encode(payload, codec_for(ws)))
+
+
+async def relay(ws: websockets.WebSocketCommonProtocol, payload: dict, message: Union[str, bytes]):
+    if codec_for(ws) == ('msgpack' if isinstance(message, bytes) else 'json'):
+        await ws.send(message)
+    else:
+        await send(ws, payload)
+
+
+async def process_command(
+    ws: websockets.WebSocketCommonProtocol, dispatch: dict, message: Union[str, bytes], payload: Optional[dict] = None
+):
     ticket = None
+    codec = 'msgpack' if isinstance(message, bytes) else 'json'
     try:
         try:
-            payload = json.loads(message)
+            if payload is None:
+                payload = decode(message)
             ticket = payload['ticket']
             cmd = payload['cmd']
             if cmd not in dispatch:
                 raise AriesError(1, "unknown command `%s`" % cmd)
             result: dict = await dispatch[cmd](ws, payload)
             if 'code' in result:
-                await ws.send(json.dumps(dict(ticket=ticket, **result)))
+                await ws.send(encode(dict(ticket=ticket, **result), codec))
             else:
-                await ws.send(json.dumps(dict(ticket=ticket, code=0, **result)))
+                await ws.send(encode(dict(ticket=ticket, code=0, **result), codec))
         except NoResponse:
             return
         except AriesError as exc:
-            await ws.send(json.dumps(dict(ticket=ticket, code=exc.args[0], msg=exc.args[1])))
+            await ws.send(encode(dict(ticket=ticket, code=exc.args[0], msg=exc.args[1]), codec))
         except Exception as exc:
             import traceback
             if logging.getLogger().isEnabledFor(logging.DEBUG):
                 msg = traceback.format_exc()
             else:
                 msg = repr(exc)
-            await ws.send(json.dumps(dict(ticket=ticket, code=-1, msg=msg)))
+            await ws.send(encode(dict(ticket=ticket, code=-1, msg=msg), codec))
     except websockets.ConnectionClosed:
         return
 
@@ -55,45 +170,160 @@ def bypass_callback(ws, message):
     return False
 
 
-async def command_handler(ws: websockets.WebSocketCommonProtocol, dispatch: dict, callback: Callable[[str], bool] = bypass_callback):
+async def command_dispatcher(ws: websockets.WebSocketCommonProtocol, dispatch: dict, pending: asyncio.Queue, limits: CommandLimits):
+    slots = asyncio.Semaphore(limits.per_connection) if limits.per_connection is not None else None
+    while True:
+        item = await pending.get()
+        if item is None:
+            return
+        enqueued, message, payload = item
+        if slots is not None:
+            await slots.acquire()
+        if limits.global_slots is not None:
+            await limits.global_slots.acquire()
+        command_stats.queued -= 1
+        command_stats.inflight += 1
+        command_stats.queue_wait.observe(time.monotonic() - enqueued)
+
+        def release(task: asyncio.Task):
+            command_stats.inflight -= 1
+            command_stats.processed += 1
+            if slots is not None:
+                slots.release()
+            if limits.global_slots is not None:
+                limits.global_slots.release()
+
+        task = asyncio.create_task(process_command(ws, dispatch, message, payload))
+        task.add_done_callback(common_task_callback('process-command'))
+        task.add_done_callback(release)
+
+
+async def reject_command(ws: websockets.WebSocketCommonProtocol, message: Union[str, bytes], payload: Optional[dict]):
+    command_stats.rejected += 1
+    codec = 'msgpack' if isinstance(message, bytes) else 'json'
+    ticket = payload.get('ticket') if payload is not None else None
+    try:
+        await ws.send(encode(dict(ticket=ticket, code=26, msg='too many pending commands, retry later'), codec))
+    except websockets.ConnectionClosed:
+        return
+
+
+def peek(message: Union[str, bytes]):
+    try:
+        payload = decode(message)
+    except Exception:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+async def command_handler(
+    ws: websockets.WebSocketCommonProtocol, dispatch: dict,
+    callback: Callable[[str], bool] = bypass_callback, limits: Optional[CommandLimits] = None
+):
+    if limits is None:
+        limits = CommandLimits()
+    pending = asyncio.Queue(maxsize=limits.queue_depth)
+    dispatcher = asyncio.create_task(command_dispatcher(ws, dispatch, pending, limits))
+    dispatcher.add_done_callback(common_task_callback('command-dispatcher'))
     try:
         async for message in ws:
             if callback(ws, message):
                 continue
-            coro = process_command(ws, dispatch, message)
-            task = asyncio.create_task(coro)
-            task.add_done_callback(common_task_callback('process-command'))
+            payload = peek(message)
+            if payload is not None and limits.inline(payload):
+                # control messages unblock commands holding slots, so they must never wait for one
+                task = asyncio.create_task(process_command(ws, dispatch, message, payload))
+                task.add_done_callback(common_task_callback('process-command'))
+                continue
+            if pending.full():
+                # shed instead of blocking the reader, inline control frames behind it must still get through
+                task = asyncio.create_task(reject_command(ws, message, payload))
+                task.add_done_callback(common_task_callback('reject-command'))
+                continue
+            command_stats.queued += 1
+            pending.put_nowait((time.monotonic(), message, payload))
     except websockets.ConnectionClosed:
         logging.warning("Caught Outer Loop Connection Closed", exc_info=True)
+    finally:
+        command_stats.queued -= pending.qsize()
+        while not pending.empty():
+            pending.get_nowait()
+        pending.put_nowait(None)
+
+
+abandoned: Set[Union[int, str]] = set()
+
+
+async def client_recv(ws: websockets.WebSocketCommonProtocol, ticket: int, on_chunk: Optional[Callable[[dict], Awaitable]] = None):
+    while True:
+        execution = decode(await ws.recv())
+        if execution.get('cmd') == 'stream_chunk':
+            if on_chunk is None:
+                await send(ws, dict(ticket=next(tickets), cmd='stream_cancel', stream=execution['stream']))
+            else:
+                await on_chunk(execution)
+            continue
+        if execution.get('ticket') in abandoned:
+            abandoned.discard(execution['ticket'])
+            continue
+        assert execution['ticket'] == ticket, [ticket, execution['ticket']]
+        return execution
 
 
 async def client_serial(ws: websockets.WebSocketCommonProtocol, cmd: str, args: dict):
-    ticket = str(uuid.uuid4())
-    await ws.send(json.dumps(dict(ticket=ticket, cmd=cmd, **args)))
-    execution = json.loads(await ws.recv())
-    assert execution['ticket'] == ticket, [ticket, execution['ticket']]
-    return execution
+    ticket = next(tickets)
+    await send(ws, dict(ticket=ticket, cmd=cmd, **args))
+    return await client_recv(ws, ticket)
+
+
+async def client_stream(ws: websockets.WebSocketCommonProtocol, cmd: str, args: dict, on_chunk: Callable[[str], None]):
+    ticket = next(tickets)
+    streams = set()
+
+    async def chunk(execution: dict):
+        streams.add(execution['stream'])
+        on_chunk(execution['data'])
+        await send(ws, dict(ticket=next(tickets), cmd='stream_ack', stream=execution['stream'], seq=execution['seq']))
+
+    await send(ws, dict(ticket=ticket, cmd=cmd, stream=True, **args))
+    try:
+        return await client_recv(ws, ticket, chunk)
+    except (asyncio.CancelledError, websockets.ConnectionClosed):
+        abandoned.add(ticket)
+        for sid in streams:
+            if ws.open:
+                await send(ws, dict(ticket=next(tickets), cmd='stream_cancel', stream=sid))
+        raise
 
 
 class AsyncClient(object):
     def __init__(self, ws: websockets.WebSocketCommonProtocol) -> None:
         self.ws = ws
-        self.futures: Dict[str, asyncio.Future] = dict()
+        self.futures: Dict[Union[int, str], asyncio.Future] = dict()
 
     def result(self, payload):
-        ticket = payload['ticket']
-        assert ticket in self.futures, payload
-        self.futures[ticket].set_result(payload)
+        future = self.futures.get(payload['ticket'])
+        if future is None:
+            logging.debug("Dropping result for abandoned ticket %s", payload['ticket'])
+            return
+        if not future.done():
+            future.set_result(payload)
+
+    def abort(self, exc: BaseException):
+        for future in self.futures.values():
+            if not future.done():
+                future.set_exception(exc)
 
     async def listen(self):
         async for message in self.ws:
-            payload = json.loads(message)
+            payload = decode(message)
             self.result(payload)
 
     async def issue(self, cmd: str, args: dict):
-        ticket = str(uuid.uuid4())
-        self.futures[ticket] = asyncio.Future()
-        await self.ws.send(json.dumps(dict(ticket=ticket, cmd=cmd, **args)))
-        result = await self.futures[ticket]
-        self.futures.pop(ticket)
-        return result
+        ticket = next(tickets)
+        future = self.futures[ticket] = asyncio.Future()
+        try:
+            await send(self.ws, dict(ticket=ticket, cmd=cmd, **args))
+            return await future
+        finally:
+            self.futures.pop(ticket, None)
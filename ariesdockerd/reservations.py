@@ -0,0 +1,60 @@
+import time
+import uuid
+import logging
+from typing import *
+from dataclasses import dataclass
+
+
+@dataclass
+class Lease:
+    lease_id: str
+    node: str
+    gpus: List[int]
+    owner: str
+    job: str
+    created: float
+    expires: float
+
+
+class ReservationTable(object):
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self.leases: Dict[str, Lease] = dict()
+        self.by_node: Dict[str, Dict[str, Lease]] = dict()
+
+    def reserve(self, node: str, gpus: List[int], owner: str, job: str, ttl: Optional[float] = None):
+        now = time.time()
+        lease = Lease(uuid.uuid4().hex[:12], node, list(gpus), owner, job, now, now + (ttl or self.ttl))
+        self.leases[lease.lease_id] = lease
+        self.by_node.setdefault(node, dict())[lease.lease_id] = lease
+        return lease
+
+    def release(self, lease_id: str):
+        lease = self.leases.pop(lease_id, None)
+        if lease is None:
+            return False
+        node_leases = self.by_node[lease.node]
+        node_leases.pop(lease_id)
+        if not len(node_leases):
+            self.by_node.pop(lease.node)
+        return True
+
+    def expire(self, now: Optional[float] = None):
+        if now is None:
+            now = time.time()
+        expired = [lease for lease in self.leases.values() if lease.expires <= now]
+        for lease in expired:
+            logging.warning("lease %s on %s for %s (%s) expired", lease.lease_id, lease.node, lease.job, lease.owner)
+            self.release(lease.lease_id)
+        return expired
+
+    def held(self, node: str):
+        return {gpu for lease in self.by_node.get(node, {}).values() for gpu in lease.gpus}
+
+    def apply(self, available: Dict[str, List[int]]):
+        self.expire()
+        result = dict()
+        for node, gpus in available.items():
+            held = self.held(node)
+            result[node] = [gpu for gpu in gpus if gpu not in held]
+        return result
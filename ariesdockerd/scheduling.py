@@ -1,39 +1,237 @@
 import random
-from operator import itemgetter
-from itertools import groupby
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Tuple, Optional, Set
 from .error import AriesError
+from .topology import best_set, P2P_MIN_SCORE
 
 
-def schedule(available: Dict[Any, List[int]], njobs: int, ngpus: int):
+def mask_of(gpus: List[int]):
+    mask = 0
+    for gpu in gpus:
+        mask |= 1 << gpu
+    return mask
+
+
+def gpus_of(mask: int):
+    gpus = []
+    while mask:
+        low = mask & -mask
+        gpus.append(low.bit_length() - 1)
+        mask ^= low
+    return gpus
+
+
+def runs_of(mask: int):
+    start = 0
+    while mask >> start:
+        while not (mask >> start) & 1:
+            start += 1
+        length = 0
+        while (mask >> (start + length)) & 1:
+            length += 1
+        yield start, length
+        start += length
+
+
+class SegmentAllocator(object):
+    def __init__(self, available: Dict[Any, List[int]], rng: Optional[random.Random] = None, preferred: Optional[Set[Any]] = None) -> None:
+        self.rng = rng or random
+        self.preferred = preferred or set()
+        self.allowed: Optional[Set[Any]] = None
+        self.masks: Dict[Any, int] = dict()
+        self.buckets: Dict[int, List[Tuple[Any, int]]] = dict()
+        self.pos: Dict[Tuple[Any, int], int] = dict()
+        for node, gpus in available.items():
+            self.masks[node] = mask_of(gpus)
+            for start, length in runs_of(self.masks[node]):
+                self._add(node, start, length)
+
+    def _add(self, node, start: int, length: int):
+        bucket = self.buckets.setdefault(length, [])
+        self.pos[node, start] = len(bucket)
+        bucket.append((node, start))
+
+    def _remove(self, node, start: int, length: int):
+        bucket = self.buckets[length]
+        i = self.pos.pop((node, start))
+        last = bucket.pop()
+        if last != (node, start):
+            bucket[i] = last
+            self.pos[last] = i
+        if not len(bucket):
+            self.buckets.pop(length)
+
+    def usable(self, node):
+        return self.allowed is None or node in self.allowed
+
+    def segments(self, length: int):
+        bucket = self.buckets[length]
+        if self.allowed is None:
+            return bucket
+        return [fit for fit in bucket if fit[0] in self.allowed]
+
+    def best_fit(self, ngpus: int):
+        for length in sorted(length for length in self.buckets if length >= ngpus):
+            bucket = self.segments(length)
+            if not len(bucket):
+                continue
+            local = [fit for fit in bucket if fit[0] in self.preferred]
+            node, start = self.rng.choice(local or bucket)
+            return node, start, length
+        return None
+
+    def allocate(self, ngpus: int):
+        fit = self.best_fit(ngpus)
+        if fit is None:
+            return None
+        return self.carve(fit, ngpus)
+
+    def carve(self, fit: Tuple[Any, int, int], ngpus: int):
+        node, start, length = fit
+        self._remove(node, start, length)
+        if length > ngpus:
+            self._add(node, start + ngpus, length - ngpus)
+        gpus = list(range(start, start + ngpus))
+        self.masks[node] &= ~mask_of(gpus)
+        return node, gpus
+
+    def take(self, node, gpus: List[int]):
+        for start, length in runs_of(self.masks[node]):
+            self._remove(node, start, length)
+        self.masks[node] &= ~mask_of(gpus)
+        for start, length in runs_of(self.masks[node]):
+            self._add(node, start, length)
+        return node, gpus
+
+    def allocate_connected(self, ngpus: int, topology: Dict[Any, List[List[int]]]):
+        fit = self.best_fit(ngpus)
+        if fit is not None and fit[2] == ngpus:
+            return self.carve(fit, ngpus)
+        if fit is not None:
+            # connectivity only breaks ties among the best-fit segments
+            length = fit[2]
+            candidates = [(node, list(range(start, start + length))) for node, start in self.segments(length)]
+        else:
+            candidates = [(node, self.free(node)) for node in topology if node in self.masks and self.usable(node)]
+        best = None
+        for node, gpus in candidates:
+            matrix = topology.get(node)
+            if matrix is None or len(gpus) < ngpus:
+                continue
+            found = best_set(matrix, gpus, ngpus)
+            if found is None or found[0][0] < P2P_MIN_SCORE:
+                continue
+            key = (found[0], node in self.preferred, self.rng.random())
+            if best is None or key > best[0]:
+                best = key, node, found[1]
+        if best is None:
+            return None
+        return self.take(best[1], best[2])
+
+    def free(self, node):
+        return gpus_of(self.masks[node])
+
+
+FRAGMENTATION_SIZES = (2, 4, 8)
+
+
+def fragmentation(available: Dict[Any, List[int]]):
+    total = sum(len(gpus) for gpus in available.values())
+    if total == 0:
+        return 0.0
+    lengths = [length for gpus in available.values() for _, length in runs_of(mask_of(gpus))]
+    usable = [sum(length - length % size for length in lengths) for size in FRAGMENTATION_SIZES]
+    return 1.0 - sum(usable) / (total * len(FRAGMENTATION_SIZES))
+
+
+def check_ngpus(ngpus: int):
     if ngpus not in [0, 1, 2, 4, 8, 16]:
         raise AriesError(11, "NGPUs should be in [0, 1, 2, 4, 8, 16]", ngpus)
-    
+
+
+def spread(available: Dict[Any, List[int]], njobs: int, rng: Optional[random.Random] = None, preferred: Optional[Set[Any]] = None):
+    rng = rng or random
+    preferred = preferred or set()
+    nodes = sorted(available.keys(), key=lambda x: (len(available[x]), x in preferred, rng.random()), reverse=True)
+    return [(nodes[i % len(nodes)], []) for i in range(njobs)]
+
+
+def place(alloc: SegmentAllocator, njobs: int, ngpus: int, topology: Optional[Dict[Any, List[List[int]]]] = None):
     sched = []
+    for i in range(njobs):
+        placed = None
+        if topology and ngpus > 1:
+            placed = alloc.allocate_connected(ngpus, topology)
+        if placed is None:
+            placed = alloc.allocate(ngpus)
+        if placed is None:
+            raise AriesError(12, 'avail: %s unschedulable: %s gpu: %s' % (
+                {node: alloc.free(node) for node in alloc.masks}, njobs - i, ngpus
+            ))
+        sched.append(placed)
+    return sched
+
+
+def schedule_batch(
+    available: Dict[Any, List[int]], requests: List[Tuple[Optional[int], int]],
+    topology: Optional[Dict[Any, List[List[int]]]] = None, trials: int = 16, seed: int = 0,
+    preferred: Optional[Set[Any]] = None, scopes: Optional[List[Tuple[Optional[Set[Any]], Optional[Set[Any]]]]] = None
+):
+    # scopes optionally gives each request its own (allowed nodes, preferred nodes)
+    for _, ngpus in requests:
+        check_ngpus(ngpus)
+    if scopes is None:
+        scopes = [(None, preferred)] * len(requests)
+    scopes = [(allowed, local or set()) for allowed, local in scopes]
+    order = sorted(range(len(requests)), key=lambda i: requests[i][1], reverse=True)
+    best = None
+    error = None
+    for trial in range(trials):
+        rng = random.Random(seed + trial)
+        alloc = SegmentAllocator(available, rng)
+        scheds = [None] * len(requests)
+        try:
+            for i in order:
+                njobs, ngpus = requests[i]
+                alloc.allowed, alloc.preferred = scopes[i]
+                if ngpus == 0:
+                    pool = {node: gpus for node, gpus in available.items() if alloc.usable(node)}
+                    if not len(pool):
+                        raise AriesError(12, 'no eligible node for request %d' % i)
+                    scheds[i] = spread(pool, njobs or 1, rng, alloc.preferred)
+                else:
+                    scheds[i] = place(alloc, njobs or 1, ngpus, topology)
+        except AriesError as exc:
+            error = exc
+            continue
+        score = fragmentation({node: alloc.free(node) for node in available})
+        used = len({node for sched in scheds for node, gpus in sched if len(gpus)})
+        cold = sum(node not in scopes[i][1] for i, sched in enumerate(scheds) for node, _ in sched)
+        if best is None or (score, used, cold) < best[0]:
+            best = (score, used, cold), scheds, alloc
+    if best is None:
+        raise error
+    (score, _, _), scheds, alloc = best
+    for node in {node for sched in scheds for node, gpus in sched if len(gpus)}:
+        available[node][:] = alloc.free(node)
+    return scheds, score
+
+
+def schedule(
+    available: Dict[Any, List[int]], njobs: int, ngpus: int,
+    topology: Optional[Dict[Any, List[List[int]]]] = None, policy: str = 'greedy',
+    preferred: Optional[Set[Any]] = None
+):
+    check_ngpus(ngpus)
     if njobs is None:
         njobs = 1
+    if policy == 'batch':
+        return schedule_batch(available, [(njobs, ngpus)], topology, preferred=preferred)[0][0]
+    if policy != 'greedy':
+        raise AriesError(24, 'unknown placement policy: %s' % policy)
     if ngpus == 0:
-        nodes = sorted(available.keys(), key=lambda x: (len(available[x]), random.random()), reverse=True)
-        for i in range(njobs):
-            sched.append((nodes[i % len(nodes)], []))
-        return sched
-    for i in range(njobs):
-        min_seg = None
-        sel_node = None
-        avail_list = list(available.items())
-        random.shuffle(avail_list)
-        for node, avail in avail_list:
-            segs = []
-            sa = sorted(avail)
-            for _, g in groupby(enumerate(sa), lambda x: x[0] - x[1]):
-                segs.append(list(map(itemgetter(1), g)))
-            for seg in segs:
-                if len(seg) >= ngpus and (min_seg is None or len(seg) < len(min_seg)):
-                    min_seg = seg
-                    sel_node = node
-        if sel_node is None:
-            raise AriesError(12, 'avail: %s unschedulable: %s gpu: %s' % (available, njobs - i, ngpus))
-        sched.append((sel_node, min_seg[:ngpus]))
-        for gpu in min_seg[:ngpus]:
-            available[sel_node].remove(gpu)
+        return spread(available, njobs, preferred=preferred)
+    alloc = SegmentAllocator(available, preferred=preferred)
+    sched = place(alloc, njobs, ngpus, topology)
+    for node in {node for node, _ in sched}:
+        available[node][:] = alloc.free(node)
     return sched
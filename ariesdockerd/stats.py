@@ -0,0 +1,65 @@
+import time
+import bisect
+from typing import *
+
+
+DEFAULT_BOUNDS = tuple(0.001 * 2 ** i for i in range(18))
+
+
+class Histogram(object):
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BOUNDS) -> None:
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float):
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        return dict(
+            count=self.count,
+            mean=self.total / self.count if self.count else 0.0,
+            max=self.max,
+            p50=self.quantile(0.5),
+            p90=self.quantile(0.9),
+            p99=self.quantile(0.99),
+        )
+
+
+class Phases(object):
+    def __init__(self) -> None:
+        self.last = time.monotonic()
+        self.timings: Dict[str, float] = dict()
+
+    def mark(self, name: str):
+        now = time.monotonic()
+        self.timings[name] = self.timings.get(name, 0.0) + now - self.last
+        self.last = now
+
+
+class PhaseStats(object):
+    def __init__(self) -> None:
+        self.phases: Dict[str, Histogram] = dict()
+
+    def record(self, timings: Dict[str, float], prefix: str = ''):
+        for name, value in timings.items():
+            self.phases.setdefault(prefix + name, Histogram()).observe(value)
+
+    def summary(self):
+        return {name: hist.summary() for name, hist in sorted(self.phases.items())}
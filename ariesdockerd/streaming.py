@@ -0,0 +1,125 @@
+import codecs
+import threading
+from typing import *
+from collections import deque
+
+
+class StreamCancelled(Exception):
+    pass
+
+
+def slices(data: bytes, size: int):
+    view = memoryview(data)
+    for i in range(0, len(data), size):
+        yield bytes(view[i: i + size])
+
+
+def window(source: Iterable[bytes], start: int, length: Optional[int] = None):
+    pos = 0
+    end = None if length is None else start + length
+    for b in source:
+        nxt = pos + len(b)
+        if nxt > start:
+            yield b[max(start - pos, 0): None if end is None else end - pos]
+        pos = nxt
+        if end is not None and pos >= end:
+            return
+
+
+async def awindow(source: AsyncIterator[bytes], start: int, length: Optional[int] = None):
+    pos = 0
+    end = None if length is None else start + length
+    async for b in source:
+        nxt = pos + len(b)
+        if nxt > start:
+            yield b[max(start - pos, 0): None if end is None else end - pos]
+        pos = nxt
+        if end is not None and pos >= end:
+            return
+
+
+async def last_bytes(source: AsyncIterator[bytes], limit: int):
+    # keeps at least the last `limit` bytes, returns the pieces and how many bytes were dropped before them
+    pieces: Deque[bytes] = deque()
+    kept = dropped = 0
+    async for b in source:
+        pieces.append(b)
+        kept += len(b)
+        while kept - len(pieces[0]) >= limit:
+            first = pieces.popleft()
+            kept -= len(first)
+            dropped += len(first)
+    return list(pieces), dropped
+
+
+class CreditStream(object):
+    def __init__(self, sid: str, window: int, emit: Callable[[dict], None], timeout: float = 300.0) -> None:
+        self.sid = sid
+        self.window = max(1, window)
+        self.emit = emit
+        self.timeout = timeout
+        self.seq = 0
+        self.acked = -1
+        self.consumed = 0
+        self.cancelled = False
+        self.closers: List[Callable[[], None]] = []
+        self.cond = threading.Condition()
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def ack(self, seq: int):
+        with self.cond:
+            self.acked = max(self.acked, seq)
+            self.cond.notify_all()
+
+    def cancel(self):
+        with self.cond:
+            self.cancelled = True
+            self.cond.notify_all()
+        for close in self.closers:
+            try:
+                close()
+            except Exception:
+                pass
+
+    def closing(self, source):
+        close = getattr(source, 'close', None)
+        if close is not None:
+            self.closers.append(close)
+        return source
+
+    def write(self, data: str):
+        with self.cond:
+            ready = self.cond.wait_for(lambda: self.cancelled or self.seq - self.acked <= self.window, self.timeout)
+            if self.cancelled:
+                raise StreamCancelled(self.sid)
+            if not ready:
+                raise TimeoutError('stream %s stalled without credit' % self.sid)
+            seq = self.seq
+            self.seq += 1
+        self.emit(dict(cmd='stream_chunk', stream=self.sid, seq=seq, data=data))
+
+    def pump(self, source: Iterable[bytes], chunk_size: int, eager: bool = False):
+        buf = []
+        size = 0
+        try:
+            for b in source:
+                if self.cancelled:
+                    raise StreamCancelled(self.sid)
+                buf.append(b)
+                size += len(b)
+                self.consumed += len(b)
+                if eager or size >= chunk_size:
+                    text = self.decoder.decode(b''.join(buf))
+                    buf, size = [], 0
+                    if len(text):
+                        self.write(text)
+        except Exception:
+            if self.cancelled:
+                raise StreamCancelled(self.sid)
+            raise
+        if self.cancelled:
+            raise StreamCancelled(self.sid)
+        text = self.decoder.decode(b''.join(buf), final=True)
+        if len(text):
+            self.write(text)
+        return dict(chunks=self.seq, bytes=self.consumed)
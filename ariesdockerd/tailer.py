@@ -0,0 +1,181 @@
+import time
+import uuid
+import codecs
+import logging
+import threading
+from typing import *
+from collections import deque
+
+
+class Follower(object):
+    def __init__(self, registry: 'LogTailers', tailer: 'Tailer', follower_id: str, capacity: int) -> None:
+        self.registry = registry
+        self.tailer = tailer
+        self.follower_id = follower_id
+        self.capacity = capacity
+        self.chunks: Deque[bytes] = deque()
+        self.size = 0
+        self.dropped = 0
+        self.closed = False
+        self.last_active = time.monotonic()
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def push(self, data: bytes):
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size > self.capacity and len(self.chunks) > 1:
+            old = self.chunks.popleft()
+            self.size -= len(old)
+            self.dropped += len(old)
+
+    @property
+    def finished(self):
+        return self.closed or self.tailer.ended
+
+    def read(self, limit: int, timeout: float):
+        cond = self.registry.cond
+        with cond:
+            self.last_active = time.monotonic()
+            cond.wait_for(lambda: len(self.chunks) or self.finished, timeout)
+            out = []
+            n = 0
+            while len(self.chunks) and (n < limit or not len(out)):
+                b = self.chunks.popleft()
+                self.size -= len(b)
+                out.append(b)
+                n += len(b)
+            self.last_active = time.monotonic()
+            return b''.join(out)
+
+    def poll(self, limit: int, timeout: float):
+        return self.decoder.decode(self.read(limit, timeout))
+
+    def __iter__(self):
+        while True:
+            data = self.read(2 ** 20, 1.0)
+            if len(data):
+                yield data
+            elif self.finished:
+                return
+
+    def close(self):
+        self.registry.detach(self)
+
+
+class Tailer(object):
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.followers: Dict[str, Follower] = dict()
+        self.source = None
+        self.closed = False
+        self.ended = False
+
+
+class LogTailers(object):
+    def __init__(
+        self, resolve: Callable[[str], str],
+        open_follow: Callable[[str, int], Iterable[bytes]], open_tail: Callable[[str, int], bytes],
+        capacity: int = 2 ** 20, idle: float = 120.0, seed_lines: int = 1000
+    ) -> None:
+        self.resolve = resolve
+        self.open_follow = open_follow
+        self.open_tail = open_tail
+        self.capacity = capacity
+        self.idle = idle
+        self.seed_lines = seed_lines
+        self.cond = threading.Condition()
+        self.tailers: Dict[str, Tailer] = dict()
+        self.followers: Dict[str, Follower] = dict()
+
+    def follow(self, container: str):
+        key = self.resolve(container)
+        with self.cond:
+            existing = key in self.tailers
+        seed = self.open_tail(key, self.seed_lines) if existing else b''
+        with self.cond:
+            tailer = self.tailers.get(key)
+            start = tailer is None
+            if start:
+                tailer = self.tailers[key] = Tailer(key)
+                seed = b''
+            follower = Follower(self, tailer, uuid.uuid4().hex, self.capacity)
+            if len(seed):
+                follower.push(seed)
+            tailer.followers[follower.follower_id] = follower
+            self.followers[follower.follower_id] = follower
+        if start:
+            threading.Thread(target=self.read_loop, args=(tailer,), daemon=True, name='aries-tail').start()
+        return follower
+
+    def get(self, follower_id: str):
+        with self.cond:
+            follower = self.followers[follower_id]
+            follower.last_active = time.monotonic()
+            return follower
+
+    def read_loop(self, tailer: Tailer):
+        try:
+            source = self.open_follow(tailer.key, self.seed_lines)
+            with self.cond:
+                tailer.source = source
+                closed = tailer.closed
+            if closed:
+                close_source(source)
+                return
+            for b in source:
+                with self.cond:
+                    for follower in tailer.followers.values():
+                        follower.push(b)
+                    self.cond.notify_all()
+        except Exception:
+            if not tailer.closed:
+                logging.warning("log tailer for %s failed", tailer.key, exc_info=True)
+        finally:
+            with self.cond:
+                tailer.ended = True
+                if self.tailers.get(tailer.key) is tailer:
+                    self.tailers.pop(tailer.key)
+                self.cond.notify_all()
+
+    def detach(self, follower: Follower):
+        source = None
+        tailer = follower.tailer
+        with self.cond:
+            follower.closed = True
+            self.followers.pop(follower.follower_id, None)
+            tailer.followers.pop(follower.follower_id, None)
+            if not len(tailer.followers) and not tailer.closed:
+                tailer.closed = True
+                if self.tailers.get(tailer.key) is tailer:
+                    self.tailers.pop(tailer.key)
+                source = tailer.source
+            self.cond.notify_all()
+        if source is not None:
+            close_source(source)
+
+    def evict(self, now: Optional[float] = None):
+        if now is None:
+            now = time.monotonic()
+        with self.cond:
+            idle = [f for f in self.followers.values() if now - f.last_active > self.idle]
+        for follower in idle:
+            self.detach(follower)
+        return len(idle)
+
+    def stats(self):
+        with self.cond:
+            return dict(
+                tailers=len(self.tailers),
+                followers=len(self.followers),
+                buffered_bytes=sum(f.size for f in self.followers.values()),
+                dropped_bytes=sum(f.dropped for f in self.followers.values()),
+            )
+
+
+def close_source(source):
+    close = getattr(source, 'close', None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
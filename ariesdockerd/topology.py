@@ -0,0 +1,64 @@
+import re
+from typing import *
+
+
+LINK_SCORES = dict(SYS=1, NODE=2, PHB=3, PXB=4, PIX=5)
+NVLINK_BASE = 10
+P2P_MIN_SCORE = LINK_SCORES['PXB']
+
+
+def link_score(token: str):
+    if token.startswith('NV') and token[2:].isnumeric():
+        return NVLINK_BASE + int(token[2:])
+    return LINK_SCORES.get(token, 0)
+
+
+def parse_topo_matrix(text: str):
+    header = None
+    rows = dict()
+    for line in text.splitlines():
+        tokens = line.split()
+        if not len(tokens):
+            continue
+        if header is None:
+            if re.fullmatch(r'GPU\d+', tokens[0]):
+                header = [t for t in tokens if re.fullmatch(r'GPU\d+', t)]
+            continue
+        if tokens[0] in header:
+            rows[tokens[0]] = [link_score(t) for t in tokens[1:len(header) + 1]]
+    if header is None or len(rows) != len(header):
+        return None
+    return [rows[gpu] for gpu in header]
+
+
+def set_score(matrix: List[List[int]], gpus: List[int]):
+    if len(gpus) < 2:
+        return 0, 0
+    links = [matrix[a][b] for i, a in enumerate(gpus) for b in gpus[i + 1:]]
+    return min(links), sum(links)
+
+
+def p2p_capable(matrix: Optional[List[List[int]]], gpus: List[int]):
+    if matrix is None or len(gpus) < 2:
+        return False
+    return set_score(matrix, gpus)[0] >= P2P_MIN_SCORE
+
+
+def best_set(matrix: List[List[int]], free: List[int], ngpus: int):
+    free = [gpu for gpu in free if gpu < len(matrix)]
+    if len(free) < ngpus:
+        return None
+    best = None
+    for seed in free:
+        chosen = [seed]
+        while len(chosen) < ngpus:
+            nxt = max(
+                (gpu for gpu in free if gpu not in chosen),
+                key=lambda g: (min(matrix[g][c] for c in chosen), sum(matrix[g][c] for c in chosen), -g)
+            )
+            chosen.append(nxt)
+        chosen.sort()
+        score = set_score(matrix, chosen)
+        if best is None or score > best[0]:
+            best = score, chosen
+    return best
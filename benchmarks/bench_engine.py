@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+import concurrent.futures
+from ariesdockerd.engine import DockerEngine
+from tests.test_engine import FakeEngine
+
+
+def serve(path: str, ready: threading.Event):
+    loop = asyncio.new_event_loop()
+    fake = FakeEngine(path)
+    loop.run_until_complete(fake.start())
+    ready.set()
+    loop.run_forever()
+
+
+def bench_engine(path: str, cid: str, n: int, connections: int):
+
+    async def run():
+        engine = DockerEngine(path, max_connections=connections)
+        start = time.perf_counter()
+        await asyncio.gather(*[engine.inspect(cid) for _ in range(n)])
+        elapsed = time.perf_counter() - start
+        await engine.close()
+        return elapsed, engine.connects
+
+    elapsed, connects = asyncio.run(run())
+    print('%-24s %8.1f us/call  %4d connections' % ('engine/asyncio', elapsed / n * 1e6, connects))
+
+
+def bench_logs(path: str, cid: str, n: int, tty):
+
+    async def run():
+        engine = DockerEngine(path, api_version='v1.41', max_connections=16)
+        start = time.perf_counter()
+        for _ in range(n):
+            [b async for b in engine.logs(cid, tty=tty)]
+        elapsed = time.perf_counter() - start
+        await engine.close()
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    label = 'logs/1.41 tty=%s' % ('inspect' if tty is None else tty)
+    print('%-24s %8.1f us/call' % (label, elapsed / n * 1e6))
+
+
+def bench_docker_py(path: str, cid: str, n: int, workers: int):
+    try:
+        import docker
+    except ImportError:
+        print('%-24s skipped, docker-py not installed' % 'docker-py/threads')
+        return
+    client = docker.APIClient(base_url='unix://' + path, version='1.41')
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        start = time.perf_counter()
+        list(pool.map(client.inspect_container, [cid] * n))
+        elapsed = time.perf_counter() - start
+    print('%-24s %8.1f us/call  %4d threads' % ('docker-py/threads', elapsed / n * 1e6, workers))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'docker.sock')
+        ready = threading.Event()
+        threading.Thread(target=serve, args=(path, ready), daemon=True).start()
+        ready.wait()
+
+        async def setup():
+            engine = DockerEngine(path)
+            cid = await engine.create('bench', dict(Image='busybox', Tty=False))
+            await engine.close()
+            return cid
+
+        cid = asyncio.run(setup())
+        print('python', sys.version.split()[0], 'inspect x', n)
+        bench_engine(path, cid, n, 16)
+        bench_docker_py(path, cid, n, 16)
+        bench_logs(path, cid, n // 5, None)
+        bench_logs(path, cid, n // 5, False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import base64
+import uuid
+import json
+import itertools
+from ariesdockerd.protocol import encode, decode, CODECS
+
+
+def list_containers_payload(n: int):
+    return dict(code=0, containers={
+        uuid.uuid4().hex[:10]: dict(
+            gpu_ids=[i % 8], name='job-%d' % i, user='user%d' % (i % 7),
+            status='running', node='node%02d' % (i % 40)
+        )
+        for i in range(n)
+    })
+
+
+def logs_payload(size: int):
+    line = 'step 1234 | loss 0.123456 | lr 3.0e-4 | "grad_norm": 1.25\tok\n'
+    return dict(code=0, logs=(line * (size // len(line) + 1))[:size])
+
+
+def tcprecv_payload(size: int, b64: bool):
+    data = os.urandom(size)
+    return dict(cmd='tcprecv', client=uuid.uuid4().hex, d=base64.b64encode(data).decode('ascii') if b64 else data, p=0)
+
+
+def bench(name: str, payload: dict, codec: str, legacy_ticket: bool, rounds: int):
+    counter = itertools.count(1)
+    start = time.process_time()
+    for _ in range(rounds):
+        ticket = str(uuid.uuid4()) if legacy_ticket else next(counter)
+        message = encode(dict(ticket=ticket, **payload), codec)
+        for _ in range(3):
+            message = encode(decode(message), codec)
+    per_message = (time.process_time() - start) / rounds / 4
+    label = codec + ('/uuid' if legacy_ticket else '/int')
+    print('%-16s %-13s %12.1f us  %10d bytes' % (name, label, per_message * 1e6, len(message)))
+
+
+def main():
+    cases = [
+        ('small', dict(cmd='node_info', include_finalized=True), 20000),
+        ('ps-2000', list_containers_payload(2000), 50),
+        ('logs-8M', logs_payload(2 ** 23), 5),
+        ('tcp-16K-b64', tcprecv_payload(16384, True), 5000),
+        ('tcp-16K', tcprecv_payload(16384, False), 5000),
+    ]
+    print('python', sys.version.split()[0], 'codecs', CODECS)
+    print('%-16s %-13s %15s  %16s' % ('payload', 'codec/ticket', 'cpu/msg', 'size'))
+    for name, payload, rounds in cases:
+        bench(name, payload, 'json', True, rounds)
+        for codec in CODECS:
+            bench(name, payload, codec, False, rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -39,6 +39,9 @@ setuptools.setup(
         'aiocmd==0.1.5',
         'typing_extensions'
     ],
+    extras_require=dict(
+        msgpack=['msgpack']
+    ),
     entry_points=dict(
         console_scripts=[
             "aries=ariesdockerd.client:sync_main",
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from ariesdockerd import archive
+from ariesdockerd.archive import LogArchive
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.block_size = archive.BLOCK_SIZE
+        archive.BLOCK_SIZE = 1000
+
+    def tearDown(self):
+        archive.BLOCK_SIZE = self.block_size
+        self.tmp.cleanup()
+
+    def test_roundtrip(self):
+        store = LogArchive(self.tmp.name, 2 ** 30, 3600, cache_bytes=1500)
+        data = b''.join(b'line %d\n' % i for i in range(2000))
+        store.put('abc123', 'job-0', 'alice', [data[i: i + 777] for i in range(0, len(data), 777)])
+        entry = dict(store.items())['abc123']
+        self.assertEqual((entry.name, entry.user, entry.size), ('job-0', 'alice', len(data)))
+        self.assertEqual(len(entry.blocks), (len(data) + 999) // 1000)
+        self.assertLess(entry.stored, len(data))
+        self.assertEqual(store.read('abc123'), data)
+        self.assertLessEqual(store.cached, 1500)
+        self.assertEqual(store.read_tail('abc123', 1500), data[-1500:])
+        reopened = LogArchive(self.tmp.name, 2 ** 30, 3600)
+        self.assertEqual(reopened.read('abc123'), data)
+        reopened.pop('abc123')
+        self.assertEqual(len(LogArchive(self.tmp.name, 2 ** 30, 3600)), 0)
+        self.assertFalse(os.path.exists(store.file_of('abc123')))
+
+    def test_retention(self):
+        store = LogArchive(self.tmp.name, 2 ** 30, 3600)
+        for i in range(4):
+            store.put('c%d' % i, 'n%d' % i, 'u', [os.urandom(500)])
+        for i in range(4):
+            store.entries['c%d' % i].entry_creation_time = 1000.0 + i
+        self.assertListEqual(store.expire(now=4601.5), ['c0', 'c1'])
+        store.max_bytes = store.entries['c3'].stored
+        self.assertListEqual(store.expire(now=0), ['c2'])
+        self.assertListEqual([k for k, _ in store.items()], ['c3'])
+
+    def test_ranges(self):
+        store = LogArchive(self.tmp.name, 2 ** 30, 3600)
+        data = b''.join(b'line %d\n' % i for i in range(2000))
+        store.put('abc123', 'job-0', 'alice', [data])
+        self.assertEqual(b''.join(store.span('abc123', 1234, 5678)), data[1234:5678])
+        self.assertEqual(b''.join(store.span('abc123', 5000, 10 ** 9)), data[5000:])
+        for n in [0, 1, 3, 200, 1999, 2000, 5000]:
+            tail = data[store.tail_offset('abc123', n):]
+            self.assertEqual(tail, b''.join(data.splitlines(keepends=True)[-n:]) if n else b'')
+        store.put('part', 'job-1', 'alice', [b'a\nb\nc'])
+        self.assertEqual(store.tail_offset('part', 1), 4)
+        self.assertEqual(store.tail_offset('part', 2), 2)
@@ -0,0 +1,67 @@
+import unittest
+from ariesdockerd.cluster import ClusterView, make_update, image_ref
+
+
+def snap(free, names, finalized_names=()):
+    return dict(
+        free_gpu_ids=free, names=names, ids=['i' + x for x in names],
+        finalized_names=list(finalized_names), finalized_ids=['i' + x for x in finalized_names]
+    )
+
+
+class TestClusterView(unittest.TestCase):
+
+    def test_incremental(self):
+        view = ClusterView()
+        s0 = snap([0, 1, 2, 3], [])
+        s1 = snap([2, 3], ['a'])
+        s2 = snap([2, 3], ['b'], ['a'])
+        self.assertTrue(view.apply('A', make_update(None, s0, 1)))
+        self.assertIsNone(make_update(s0, s0, 2))
+        self.assertTrue(view.apply('A', make_update(s0, s1, 2)))
+        self.assertDictEqual(view.snapshot(False), {'A': dict(free_gpu_ids=[2, 3], names=['a'], ids=['ia'])})
+        self.assertTrue(view.apply('A', make_update(s1, s2, 3)))
+        self.assertDictEqual(view.snapshot(True), {'A': dict(free_gpu_ids=[2, 3], names=['a', 'b'], ids=['ia', 'ib'])})
+        self.assertEqual(view.version, 3)
+
+    def test_gap(self):
+        view = ClusterView()
+        s0 = snap([0, 1], [])
+        s1 = snap([1], ['a'])
+        self.assertFalse(view.apply('A', make_update(s0, s1, 2)))
+        view.apply('A', make_update(None, s0, 1))
+        self.assertFalse(view.apply('A', make_update(s0, s1, 3)))
+        self.assertTrue(view.apply('A', make_update(None, s1, 3)))
+        view.drop('A')
+        self.assertDictEqual(view.snapshot(True), {})
+
+    def test_locate(self):
+        view = ClusterView()
+        view.apply('A', make_update(None, snap([0], ['job-0', 'job-1', 'x']), 1))
+        view.apply('B', make_update(None, snap([0], ['job-2'], ['y']), 1))
+        self.assertEqual(view.locate('x'), 'A')
+        self.assertEqual(view.locate('y'), 'B')
+        self.assertEqual(view.locate('iy'), 'B')
+        self.assertEqual(view.locate('ijob-2'), 'B')
+        self.assertIsNone(view.locate('ij'))
+        self.assertIsNone(view.locate('z'))
+        self.assertSetEqual(view.job_nodes('job'), {'A', 'B'})
+        view.apply('B', make_update(snap([0], ['job-2'], ['y']), snap([0], [], ['y']), 2))
+        self.assertSetEqual(view.job_nodes('job'), {'A'})
+        view.drop('A')
+        self.assertIsNone(view.locate('x'))
+        self.assertSetEqual(view.job_nodes('job'), set())
+
+    def test_images(self):
+        view = ClusterView()
+        s0 = dict(snap([0], []), images=['busybox:latest'])
+        s1 = dict(snap([0], []), images=['busybox:latest', 'repo/train:v2'])
+        view.apply('A', make_update(None, s0, 1))
+        view.apply('B', make_update(None, snap([0], []), 1))
+        self.assertSetEqual(view.image_nodes('busybox'), {'A'})
+        self.assertSetEqual(view.image_nodes('repo/train:v2'), set())
+        self.assertTrue(view.apply('A', make_update(s0, s1, 2)))
+        self.assertSetEqual(view.image_nodes('repo/train:v2'), {'A'})
+        self.assertIsNone(view.locate('busybox:latest'))
+        self.assertEqual(image_ref('localhost:5000/x'), 'localhost:5000/x:latest')
+        self.assertEqual(image_ref('x@sha256:00'), 'x@sha256:00')
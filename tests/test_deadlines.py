@@ -0,0 +1,46 @@
+import unittest
+from ariesdockerd.deadlines import DeadlineHeap
+
+
+class FakeClock(object):
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDeadlines(unittest.TestCase):
+
+    def test_escalation(self):
+        clock = FakeClock()
+        kicks = []
+        heap = DeadlineHeap(warning=60, grace=30, clock=clock, on_change=lambda: kicks.append(1))
+        heap.set('a', 1100)
+        heap.set('b', 1030)
+        self.assertFalse(heap.set('a', 1100))
+        self.assertEqual(len(kicks), 2)
+        self.assertEqual(heap.next_due(), 1030)
+        self.assertListEqual(heap.pop_due(1039), [('b', 'stop')])
+        self.assertListEqual(heap.pop_due(1059), [('a', 'warn')])
+        self.assertListEqual(heap.pop_due(1060), [('b', 'kill')])
+        self.assertNotIn('b', heap)
+        self.assertListEqual(heap.pop_due(1200), [('a', 'stop'), ('a', 'kill')])
+        self.assertIsNone(heap.next_due())
+        self.assertEqual(heap.stats()['fired_kill'], 2)
+
+    def test_reschedule_and_discard(self):
+        clock = FakeClock()
+        heap = DeadlineHeap(warning=0, grace=10, clock=clock)
+        heap.set('a', 1010)
+        heap.set('a', 1500)
+        heap.set('b', 1020)
+        heap.discard('b')
+        self.assertListEqual(heap.pop_due(1100), [])
+        self.assertEqual(heap.next_due(), 1500)
+        clock.now = 1600
+        self.assertListEqual(heap.pop_due(), [('a', 'stop'), ('a', 'kill')])
+        for i in range(1000):
+            heap.set('c', 2000 + i)
+        self.assertLess(len(heap.heap), 200)
+        self.assertListEqual(heap.pop_due(4000), [('c', 'stop'), ('c', 'kill')])
@@ -0,0 +1,131 @@
+import os
+import json
+import struct
+import asyncio
+import tempfile
+import unittest
+import urllib.parse
+from ariesdockerd.engine import DockerEngine, Demuxer, EngineError
+
+
+def frame(stream, data):
+    return struct.pack('>BxxxI', stream, len(data)) + data
+
+
+class FakeEngine(object):
+    def __init__(self, path) -> None:
+        self.path = path
+        self.containers = dict()
+        self.accepted = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self.serve, self.path)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def serve(self, reader, writer):
+        self.accepted += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                method, target, _ = line.decode().split()
+                headers = dict()
+                while True:
+                    h = (await reader.readline()).decode().strip()
+                    if not h:
+                        break
+                    k, _, v = h.partition(':')
+                    headers[k.lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                url = urllib.parse.urlparse(target)
+                await self.route(writer, method, url.path.split('/')[2:], urllib.parse.parse_qs(url.query), body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def reply(self, writer, status, payload=None):
+        body = b'' if payload is None else json.dumps(payload).encode()
+        writer.write(b'HTTP/1.1 %d X\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n' % (status, len(body)) + body)
+
+    def chunked(self, writer, ctype, pieces):
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: %s\r\nTransfer-Encoding: chunked\r\n\r\n' % ctype)
+        for piece in pieces:
+            writer.write(b'%x\r\n%s\r\n' % (len(piece), piece))
+        writer.write(b'0\r\n\r\n')
+
+    async def route(self, writer, method, parts, query, body):
+        if parts == ['containers', 'json']:
+            return self.reply(writer, 200, [dict(Id=k, Names=['/' + v['Name']]) for k, v in self.containers.items()])
+        if parts == ['containers', 'create']:
+            cid = '%064x' % (len(self.containers) + 1)
+            self.containers[cid] = dict(Id=cid, Name=query['name'][0], Config=json.loads(body), State=dict(Status='created'))
+            return self.reply(writer, 201, dict(Id=cid))
+        if parts == ['events']:
+            lines = [json.dumps(dict(Type='container', Action='start', id=k)).encode() + b'\n' for k in self.containers]
+            data = b''.join(lines)
+            return self.chunked(writer, b'application/json', [data[i: i + 7] for i in range(0, len(data), 7)])
+        cid = parts[1]
+        if cid not in self.containers:
+            return self.reply(writer, 404, dict(message='No such container: %s' % cid))
+        c = self.containers[cid]
+        if method == 'GET' and parts[2:] == ['json']:
+            return self.reply(writer, 200, c)
+        if method == 'GET' and parts[2:] == ['logs']:
+            data = frame(1, b'hello\n') + frame(2, b'oops\n') + frame(1, b'x' * 300)
+            return self.chunked(writer, b'application/vnd.docker.multiplexed-stream', [data[i: i + 5] for i in range(0, len(data), 5)])
+        if method == 'POST' and parts[2:] in (['start'], ['stop'], ['kill']):
+            c['State']['Status'] = dict(start='running', stop='exited', kill='exited')[parts[2]]
+            return self.reply(writer, 204)
+        if method == 'DELETE':
+            self.containers.pop(cid)
+            return self.reply(writer, 204)
+        return self.reply(writer, 404, dict(message='not found'))
+
+
+class TestEngine(unittest.TestCase):
+
+    def test_demuxer(self):
+        data = frame(1, b'abc') + frame(2, b'') + frame(1, b'de')
+        demux = Demuxer()
+        out = []
+        for i in range(len(data)):
+            out.extend(demux.feed(data[i: i + 1]))
+        self.assertListEqual(out, [b'abc', b'', b'de'])
+
+    def test_engine(self):
+
+        async def scenario(path):
+            fake = FakeEngine(path)
+            await fake.start()
+            engine = DockerEngine(path, api_version='v1.43', max_connections=2)
+            try:
+                cid = await engine.create('job-0', dict(Image='busybox'))
+                await engine.start(cid)
+                self.assertEqual((await engine.inspect(cid))['State']['Status'], 'running')
+                self.assertEqual(len(await engine.list_containers(filters=dict(label=['ariesmanaged']))), 1)
+                logs = b''.join([b async for b in engine.logs(cid)])
+                self.assertEqual(logs, b'hello\noops\n' + b'x' * 300)
+                events = [e async for e in engine.events()]
+                self.assertListEqual([e['id'] for e in events], [cid])
+                inspects = await asyncio.gather(*[engine.inspect(cid) for _ in range(20)])
+                self.assertEqual(len(inspects), 20)
+                await engine.kill(cid)
+                await engine.remove(cid, force=True)
+                with self.assertRaises(EngineError) as ctx:
+                    await engine.inspect(cid)
+                self.assertEqual(ctx.exception.status, 404)
+                self.assertLessEqual(fake.accepted, 2)
+                self.assertEqual(engine.connects, fake.accepted)
+            finally:
+                await engine.close()
+                await fake.stop()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(scenario(os.path.join(tmp, 'docker.sock')))
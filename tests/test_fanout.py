@@ -0,0 +1,38 @@
+import asyncio
+import unittest
+from ariesdockerd.fanout import fanout
+
+
+def responder(delays, value):
+    calls = []
+
+    async def call():
+        delay = delays[min(len(calls), len(delays) - 1)]
+        calls.append(delay)
+        await asyncio.sleep(delay)
+        if isinstance(value, BaseException):
+            raise value
+        return value
+
+    return call, calls
+
+
+class TestFanout(unittest.TestCase):
+
+    def test_deadline(self):
+        fast, _ = responder([0.0], 'a')
+        slow, _ = responder([10.0], 'b')
+        bad, _ = responder([0.0], ValueError('x'))
+        res = asyncio.run(fanout(dict(A=fast, B=slow, C=bad), deadline=0.1))
+        self.assertDictEqual(res.results, dict(A='a'))
+        self.assertListEqual(res.missed, ['B'])
+        self.assertListEqual(list(res.errors), ['C'])
+
+    def test_hedge(self):
+        stuck, calls = responder([10.0, 0.0], 'a')
+        res = asyncio.run(fanout(dict(A=stuck), deadline=1.0, hedge=0.05))
+        self.assertDictEqual(res.results, dict(A='a'))
+        self.assertEqual(len(calls), 2)
+        quick, calls = responder([0.0], 'a')
+        asyncio.run(fanout(dict(A=quick), deadline=1.0, hedge=0.05))
+        self.assertEqual(len(calls), 1)
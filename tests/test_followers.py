@@ -0,0 +1,43 @@
+import asyncio
+import unittest
+from unittest import mock
+from ariesdockerd import central
+from ariesdockerd.error import AriesError
+
+
+class FakeDaemon(object):
+    def __init__(self) -> None:
+        self.live = set()
+
+    async def issue(self, cmd, args):
+        if cmd == 'follow_logs':
+            self.live.add('f%d' % len(self.live))
+            return dict(ticket=1, code=0, follower='f%d' % (len(self.live) - 1))
+        if args['follower'] in self.live:
+            return dict(ticket=1, code=0, log='')
+        return dict(ticket=1, code=25, msg='log follower `%s` not found or evicted' % args['follower'])
+
+
+class TestFollowers(unittest.TestCase):
+
+    def test_routes_expire(self):
+        daemon = FakeDaemon()
+        with mock.patch.dict(central.daemon_nodes, dict(A=daemon), clear=True), \
+                mock.patch.dict(central.followers, clear=True), \
+                mock.patch.object(central, 'check_auth'), \
+                mock.patch.object(central.cluster, 'locate', return_value='A'), \
+                mock.patch.object(central, 'get_config', return_value=mock.Mock(log_follow_idle=120.0)):
+
+            async def scenario():
+                first = await central.follow_logs_handler(None, dict(container='c'))
+                second = await central.follow_logs_handler(None, dict(container='c'))
+                await central.poll_logs_handler(None, dict(follower=first['follower']))
+                daemon.live.discard(first['follower'])
+                with self.assertRaises(AriesError):
+                    await central.poll_logs_handler(None, dict(follower=first['follower']))
+                return second['follower']
+
+            second = asyncio.run(scenario())
+            self.assertListEqual(list(central.followers), [second])
+            central.expire_followers(central.followers[second][1] + 121)
+            self.assertDictEqual(central.followers, dict())
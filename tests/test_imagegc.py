@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+from ariesdockerd.imagegc import ImageGC, ImageInfo
+
+
+GB = 2 ** 30
+
+
+def images():
+    return [
+        ImageInfo('sha256:a', ['train:v1'], 10 * GB, 1000.0),
+        ImageInfo('sha256:b', ['train:v2'], 10 * GB, 2000.0),
+        ImageInfo('sha256:c', ['busybox:latest'], 1 * GB, 500.0),
+        ImageInfo('sha256:d', [], 5 * GB, 100.0),
+    ]
+
+
+class TestImageGC(unittest.TestCase):
+
+    def test_watermarks(self):
+        gc = ImageGC(high=0.8, low=0.7, min_age=100, batch=10)
+        self.assertListEqual(gc.plan(images(), set(), 79 * GB, 100 * GB, now=10000), [])
+        victims = gc.plan(images(), set(), 85 * GB, 100 * GB, now=10000)
+        self.assertListEqual([v.image_id for v in victims], ['sha256:d', 'sha256:c', 'sha256:a'])
+
+    def test_lru_and_protection(self):
+        gc = ImageGC(high=0.8, low=0.5, min_age=100, batch=2)
+        gc.touch(['sha256:d'], now=9950)
+        gc.touch(['sha256:c'], now=3000)
+        gc.protect(['train:v1'])
+        victims = gc.plan(images(), {'sha256:b'}, 90 * GB, 100 * GB, now=10000)
+        self.assertListEqual([v.image_id for v in victims], ['sha256:c'])
+        gc.protect(['busybox', 'train:v1'])
+        self.assertListEqual(gc.plan(images(), {'sha256:b'}, 90 * GB, 100 * GB, now=10000), [])
+        gc.protect([])
+        victims = gc.plan(images(), set(), 90 * GB, 100 * GB, now=10000)
+        self.assertListEqual([v.image_id for v in victims], ['sha256:a', 'sha256:b'])
+        gc.evicted_image(victims[0])
+        self.assertEqual(gc.stats()['freed_bytes'], 10 * GB)
+
+    def test_persist(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'images.json')
+            gc = ImageGC(path)
+            gc.touch(['sha256:a'], now=123.0)
+            gc.save()
+            self.assertEqual(ImageGC(path).last_use(images()[0]), 1000.0)
+            gc.touch(['sha256:a'], now=5000.0)
+            gc.save()
+            self.assertEqual(ImageGC(path).last_use(images()[0]), 5000.0)
+
+    def test_corrupt(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'images.json')
+            with open(path, 'w') as fo:
+                fo.write('{"sha256:a": 12')
+            with self.assertLogs(level='ERROR'):
+                gc = ImageGC(path)
+            self.assertEqual(gc.stats()['tracked'], 0)
+            gc.touch(['sha256:a'], now=5000.0)
+            gc.save()
+            self.assertEqual(ImageGC(path).last_use(images()[0]), 5000.0)
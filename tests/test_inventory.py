@@ -0,0 +1,98 @@
+import time
+import queue
+import threading
+import unittest
+from ariesdockerd.inventory import Inventory
+
+
+class FakeContainer(object):
+    def __init__(self, cid, name, status='running', managed=True) -> None:
+        self.id = cid
+        self.short_id = cid[:10]
+        self.name = name
+        self.status = status
+        self.labels = dict(ariesmanaged='token-' + name) if managed else dict()
+
+
+class FakeDocker(object):
+    def __init__(self) -> None:
+        self.containers = dict()
+        self.gets = 0
+        self.decodes = 0
+        self.q = queue.Queue()
+
+    def list_managed(self):
+        return [self.copy(c) for c in self.containers.values() if 'ariesmanaged' in c.labels]
+
+    def get(self, cid):
+        self.gets += 1
+        c = self.containers.get(cid)
+        return None if c is None else self.copy(c)
+
+    def copy(self, c):
+        return FakeContainer(c.id, c.name, c.status, 'ariesmanaged' in c.labels)
+
+    def events(self):
+        while True:
+            event = self.q.get()
+            if event is None:
+                return
+            yield event
+
+    def decode(self, token):
+        self.decodes += 1
+        return dict(user=token, gpu_ids=[0])
+
+    def event(self, action, c):
+        attributes = dict(name=c.name)
+        attributes.update(c.labels)
+        return dict(Type='container', Action=action, id=c.id, Actor=dict(ID=c.id, Attributes=attributes))
+
+
+def make():
+    docker = FakeDocker()
+    return docker, Inventory(docker.list_managed, docker.get, docker.events, docker.decode, reconcile_interval=60)
+
+
+class TestInventory(unittest.TestCase):
+
+    def test_events(self):
+        docker, inv = make()
+        a = docker.containers['a' * 64] = FakeContainer('a' * 64, 'job-0')
+        docker.containers['s' * 64] = FakeContainer('s' * 64, 'job-0-ariesdv0', managed=False)
+        inv.reconcile()
+        self.assertListEqual([c.name for c, _ in inv.items()], ['job-0'])
+        version = inv.version
+        a.status = 'exited'
+        self.assertTrue(inv.apply_event(docker.event('die', a)))
+        self.assertEqual(dict((c.name, c.status) for c, _ in inv.items()), {'job-0': 'exited'})
+        self.assertGreater(inv.version, version)
+        gets = docker.gets
+        self.assertFalse(inv.apply_event(docker.event('start', docker.containers['s' * 64])))
+        self.assertFalse(inv.apply_event(dict(Type='container', Action='exec_start: sh', id=a.id)))
+        self.assertEqual(docker.gets, gets)
+        self.assertTrue(inv.apply_event(docker.event('destroy', a)))
+        self.assertListEqual(inv.items(), [])
+        self.assertEqual(docker.decodes, 1)
+
+    def test_reconcile_and_watch(self):
+        docker, inv = make()
+        b = docker.containers['b' * 64] = FakeContainer('b' * 64, 'job-1')
+        stop = threading.Event()
+        inv.start(stop)
+        c = docker.containers['c' * 64] = FakeContainer('c' * 64, 'job-2')
+        docker.q.put(docker.event('create', c))
+        for _ in range(100):
+            if inv.stats()['events']:
+                break
+            time.sleep(0.01)
+        stop.set()
+        docker.q.put(None)
+        inv.thread.join(5)
+        self.assertEqual(sorted(x.name for x, _ in inv.items()), ['job-1', 'job-2'])
+        docker.containers.pop(b.id)
+        self.assertEqual(inv.reconcile(), 1)
+        self.assertEqual(inv.stats()['corrections'], 1)
+        self.assertEqual(docker.decodes, 2)
+        self.assertFalse(inv.due(inv.last_reconcile + 30))
+        self.assertTrue(inv.due(inv.last_reconcile + 60))
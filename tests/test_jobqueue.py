@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+from ariesdockerd.jobqueue import JobQueue, fits
+
+
+def spec(name, n_gpus, n_jobs=None, exclude=()):
+    return dict(
+        name=name, image='img', exec=['true'], env=[], timeout=0,
+        n_jobs=n_jobs, n_gpus=n_gpus, node_exclude=list(exclude), node_include=[]
+    )
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def test_backfill(self):
+        q = JobQueue()
+        big = q.submit('u', spec('big', 8))
+        small = q.submit('u', spec('small', 1, 2))
+        placements, left = q.plan({'A': [0, 1, 2, 3, 4, 5], 'B': [0, 1]})
+        self.assertListEqual([(job.job_id, sorted(sched)) for job, sched in placements], [(small.job_id, [('B', [0]), ('B', [1])])])
+        self.assertDictEqual(left, {'A': [], 'B': []})
+        placements, _ = q.plan({'A': list(range(8)), 'B': [0, 1]})
+        self.assertListEqual([job.job_id for job, _ in placements], [big.job_id, small.job_id])
+
+    def test_batched(self):
+        q = JobQueue()
+        one = q.submit('u', spec('one', 1))
+        two = q.submit('u', spec('two', 2))
+        placements, left = q.plan({'A': [0, 1, 2], 'B': [0, 1]})
+        self.assertListEqual([job.job_id for job, _ in placements], [one.job_id, two.job_id])
+        self.assertListEqual(placements[1][1], [('B', [0, 1])])
+        self.assertEqual(placements[0][1][0][0], 'A')
+        self.assertListEqual(left['B'], [])
+        self.assertEqual(len(left['A']), 2)
+
+    def test_filters(self):
+        q = JobQueue()
+        q.submit('u', spec('x', 1, exclude=['A']))
+        placements, _ = q.plan({'A': [0]})
+        self.assertListEqual(placements, [])
+        self.assertDictEqual(q.headroom({'A': [0], 'B': [3]}), {'A': [0], 'B': []})
+
+    def test_capacity(self):
+        q = JobQueue()
+        huge = q.submit('u', spec('huge', 16))
+        small = q.submit('u', spec('small', 2))
+        capacity = {'A': 8, 'B': 8}
+        self.assertFalse(fits(huge.spec, capacity))
+        self.assertTrue(fits(huge.spec, {'A': 8, 'B': None}))
+        self.assertFalse(fits(spec('x', 4, exclude=['A']), {'A': 8, 'B': 2}))
+        placements, left = q.plan({'A': [0, 1, 2, 3], 'B': [0, 1]}, capacity=capacity)
+        self.assertListEqual([job.job_id for job, _ in placements], [small.job_id])
+        self.assertDictEqual(q.headroom({'A': list(range(8))}, capacity=capacity), {'A': list(range(2, 8))})
+
+    def test_failed(self):
+        q = JobQueue()
+        job = q.submit('u', spec('x', 1))
+        q.remove(job)
+        q.fail(job, 'pull failed')
+        self.assertListEqual(q.plan({'A': [0]})[0], [])
+        self.assertEqual(q.find('x').error, 'pull failed')
+        self.assertSetEqual(q.names(), {'x'})
+        self.assertListEqual([j.job_id for j in q.failed_of('u')], [job.job_id])
+        self.assertListEqual(q.expire_failed(60, now=job.failed + 30), [])
+        self.assertListEqual(q.expire_failed(60, now=job.failed + 61), [job])
+        self.assertListEqual(q.jobs, [])
+
+    def test_persist(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'q', 'queue.json')
+            q = JobQueue(path)
+            job = q.submit('u', spec('arr', 2, 4))
+            q2 = JobQueue(path)
+            self.assertEqual(q2.find('arr').job_id, job.job_id)
+            self.assertListEqual(q2.find(job.job_id).names, ['arr-0', 'arr-1', 'arr-2', 'arr-3'])
+            q2.remove(q2.jobs[0])
+            self.assertListEqual(JobQueue(path).jobs, [])
@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+from unittest import mock
+from ariesdockerd import central
+
+
+class FakeDaemon(object):
+    def __init__(self, fail=(), batched=True) -> None:
+        self.fail = set(fail)
+        self.batched = batched
+        self.calls = []
+
+    def run(self, spec):
+        if spec['name'] in self.fail:
+            return dict(code=-1, msg='boom', timings=dict(pull=1.0))
+        return dict(code=0, short_id=spec['name'].replace('-', ''), timings=dict(run=0.1))
+
+    async def issue(self, cmd, args):
+        self.calls.append((cmd, args.get('container')))
+        if cmd == 'run_containers':
+            if not self.batched:
+                return dict(code=1, msg='unknown command `run_containers`')
+            return dict(code=0, results={spec['name']: self.run(spec) for spec in args['containers']})
+        if cmd == 'run_container':
+            return self.run(args)
+        return dict(code=0)
+
+    def killed(self):
+        return [name for cmd, name in self.calls if cmd == 'kill_container']
+
+
+def spec(n_jobs, rollback=False):
+    return dict(name='job', image='img', exec=['true'], env=[], timeout=0, n_jobs=n_jobs, n_gpus=1, rollback=rollback)
+
+
+SCHED = [('A', [0]), ('A', [1]), ('B', [0])]
+
+
+class TestLaunch(unittest.TestCase):
+
+    def launch(self, daemons, sched=SCHED, rollback=False):
+        with mock.patch.dict(central.daemon_nodes, daemons, clear=True), \
+                mock.patch.object(central, 'launch_stats', central.PhaseStats()) as stats:
+            return asyncio.run(central.launch('u', spec(len(sched), rollback), sched, dict())), stats.summary()
+
+    def test_batched(self):
+        a, b = FakeDaemon(), FakeDaemon(batched=False)
+        res, stats = self.launch(dict(A=a, B=b))
+        self.assertNotIn('code', res)
+        self.assertDictEqual(res['containers'], {'job-0': 'job0', 'job-1': 'job1', 'job-2': 'job2'})
+        self.assertListEqual([cmd for cmd, _ in a.calls], ['run_containers'])
+        self.assertListEqual([cmd for cmd, _ in b.calls], ['run_containers', 'run_container'])
+        self.assertEqual(stats['node.run']['count'], 3)
+
+    def test_partial_failure(self):
+        a, b = FakeDaemon(), FakeDaemon(fail={'job-2'})
+        res, stats = self.launch(dict(A=a, B=b))
+        self.assertEqual(res['code'], 10)
+        self.assertDictEqual(res['containers'], {'job-0': 'job0', 'job-1': 'job1'})
+        self.assertListEqual(list(res['errors']), ['job-2'])
+        self.assertListEqual(a.killed() + b.killed(), [])
+        self.assertEqual(stats['failed.node.pull']['count'], 1)
+        self.assertIn('failed.dispatch', stats)
+
+    def test_rollback(self):
+        a, b = FakeDaemon(), FakeDaemon(fail={'job-2'})
+        res, _ = self.launch(dict(A=a, B=b), rollback=True)
+        self.assertEqual(res['code'], 10)
+        self.assertIn('rolled back', res['msg'])
+        self.assertDictEqual(res['containers'], dict())
+        self.assertListEqual(sorted(a.killed()), ['job-0', 'job-1'])
+        self.assertListEqual(b.killed(), [])
+
+    def test_lost_node(self):
+        a = FakeDaemon()
+        res, _ = self.launch(dict(A=a))
+        self.assertDictEqual(res['containers'], {'job-0': 'job0', 'job-1': 'job1'})
+        self.assertIn('disconnected', res['errors']['job-2'])
+        with self.assertLogs(level='WARNING'):
+            res, _ = self.launch(dict(A=a), rollback=True)
+        self.assertListEqual(sorted(a.killed()), ['job-0', 'job-1'])
@@ -0,0 +1,41 @@
+import time
+import unittest
+from ariesdockerd.logsearch import compile_pattern, search_lines, iter_lines
+
+
+LOG = b'step 1 loss 2.3\nstep 2 loss nan\nstep 3 loss 2.1\nCUDA out of memory\nstep 4 loss NaN\n'
+
+
+def pieces(data, n):
+    return [data[i: i + n] for i in range(0, len(data), n)]
+
+
+class TestLogSearch(unittest.TestCase):
+
+    def test_offsets_across_chunks(self):
+        matches, truncated = search_lines(pieces(LOG, 5), compile_pattern('nan', True), start=100)
+        self.assertFalse(truncated)
+        self.assertListEqual([m['line'] for m in matches], ['step 2 loss nan', 'step 4 loss NaN'])
+        for m in matches:
+            self.assertTrue(LOG[m['offset'] - 100:].startswith(m['line'].encode()))
+
+    def test_context_and_limit(self):
+        matches, truncated = search_lines([LOG], compile_pattern('nan|memory'), context=1)
+        self.assertListEqual([m['line'] for m in matches], ['step 2 loss nan', 'CUDA out of memory'])
+        self.assertListEqual(matches[0]['before'], ['step 1 loss 2.3'])
+        self.assertListEqual(matches[0]['after'], ['step 3 loss 2.1'])
+        self.assertListEqual(matches[1]['after'], ['step 4 loss NaN'])
+        matches, truncated = search_lines([LOG], compile_pattern('step'), limit=2)
+        self.assertEqual(len(matches), 2)
+        self.assertTrue(truncated)
+
+    def test_long_lines(self):
+        data = b'a' * 10 + b'\nbb\n' + b'c' * 7
+        lines = list(iter_lines(pieces(data, 3), 5, max_line=4))
+        self.assertListEqual(lines, [(5, b'aaaa'), (9, b'aaaa'), (13, b'aa'), (16, b'bb'), (19, b'cccc'), (23, b'ccc')])
+        self.assertListEqual(list(iter_lines([b'x\n', b'', b'y'])), [(0, b'x'), (2, b'y')])
+
+    def test_deadline(self):
+        matches, truncated = search_lines(pieces(LOG, 5), compile_pattern('nan'), deadline=time.monotonic() - 1)
+        self.assertListEqual(matches, [])
+        self.assertTrue(truncated)
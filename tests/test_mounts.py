@@ -0,0 +1,93 @@
+import time
+import tempfile
+import threading
+import unittest
+from ariesdockerd.mounts import SharedMount
+
+
+class FakeFuse(object):
+    def __init__(self, delay) -> None:
+        self.delay = delay
+        self.mounted = False
+        self.started = 0
+        self.stopped = 0
+
+    def start(self, path):
+        self.started += 1
+        threading.Timer(self.delay, setattr, (self, 'mounted', True)).start()
+        return self.started
+
+    def stop(self, handle):
+        self.stopped += 1
+        self.mounted = False
+
+    def is_mount(self, path):
+        return self.mounted
+
+
+class TestSharedMount(unittest.TestCase):
+
+    def make(self, tmp, fuse, **kwargs):
+        return SharedMount(tmp, fuse.start, fuse.stop, linger=10, recheck=0.02, is_mount=fuse.is_mount, **kwargs)
+
+    def test_refcount_and_linger(self):
+        fuse = FakeFuse(0.05)
+        with tempfile.TemporaryDirectory() as tmp:
+            mount = self.make(tmp, fuse)
+            self.assertEqual(mount.acquire('a'), tmp)
+            mount.acquire('b')
+            self.assertEqual(fuse.started, 1)
+            mount.release('a')
+            mount.release('b')
+            self.assertFalse(mount.expire(time.monotonic() + 5))
+            mount.acquire('c')
+            mount.release('c')
+            self.assertEqual(fuse.started, 1)
+            self.assertTrue(mount.expire(time.monotonic() + 11))
+            self.assertEqual(fuse.stopped, 1)
+            mount.acquire('d')
+            self.assertEqual(fuse.started, 2)
+            mount.sync([])
+            self.assertFalse(mount.expire())
+
+    def test_not_ready(self):
+        fuse = FakeFuse(1)
+        with tempfile.TemporaryDirectory() as tmp:
+            mount = self.make(tmp, fuse, ready_timeout=0.1)
+            with self.assertRaises(ValueError):
+                mount.acquire('a')
+            self.assertEqual(fuse.stopped, 1)
+            self.assertEqual(mount.stats()['holders'], 0)
+
+    def test_start_outside_lock(self):
+        fuse = FakeFuse(0.2)
+        with tempfile.TemporaryDirectory() as tmp:
+            mount = self.make(tmp, fuse)
+            waiter = threading.Thread(target=mount.acquire, args=('a',))
+            waiter.start()
+            time.sleep(0.05)
+            begin = time.monotonic()
+            self.assertEqual(mount.stats()['holders'], 1)
+            self.assertLess(time.monotonic() - begin, 0.1)
+            self.assertFalse(mount.expire(time.monotonic() + 11))
+            self.assertEqual(mount.acquire('b'), tmp)
+            waiter.join()
+            self.assertEqual(fuse.started, 1)
+            self.assertEqual(mount.stats()['holders'], 2)
+
+    def test_external_removal(self):
+        fuse = FakeFuse(0.02)
+        with tempfile.TemporaryDirectory() as tmp:
+            mount = self.make(tmp, fuse)
+            mount.acquire('a')
+            mount.acquire('b')
+            mount.settle('a')
+            mount.settle('b')
+            mount.acquire('launching')
+            mount.sync(['a'])
+            self.assertEqual(mount.stats()['holders'], 2)
+            mount.release('launching')
+            mount.sync([])
+            self.assertEqual(mount.stats()['holders'], 0)
+            self.assertTrue(mount.expire(time.monotonic() + 11))
+            self.assertEqual(fuse.stopped, 1)
@@ -0,0 +1,34 @@
+import time
+import asyncio
+import threading
+import unittest
+from ariesdockerd.pools import WorkerPool
+
+
+class TestPools(unittest.TestCase):
+
+    def test_metrics(self):
+        pool = WorkerPool('test', 2)
+        gate = threading.Event()
+        futures = [pool.submit(gate.wait, 5) for _ in range(5)]
+        time.sleep(0.1)
+        stats = pool.stats()
+        self.assertEqual((stats['busy'], stats['queued']), (2, 3))
+        gate.set()
+        for future in futures:
+            future.result()
+        stats = pool.stats()
+        self.assertEqual((stats['busy'], stats['queued'], stats['completed']), (0, 0, 5))
+        self.assertEqual(stats['wait']['count'], 5)
+        pool.shutdown(wait=True)
+
+    def test_run_and_shutdown(self):
+        pool = WorkerPool('test', 1)
+        self.assertEqual(asyncio.run(pool.run(sum, [1, 2, 3])), 6)
+        gate = threading.Event()
+        pool.submit(gate.wait, 5)
+        queued = pool.submit(sum, [1])
+        pool.shutdown()
+        self.assertTrue(queued.cancelled())
+        self.assertEqual(pool.stats()['queued'], 0)
+        gate.set()
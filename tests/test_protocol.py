@@ -0,0 +1,131 @@
+import asyncio
+import unittest
+from ariesdockerd.protocol import command_handler, CommandLimits, NoResponse, encode, decode, as_bytes, upstream_limits
+
+
+class FakeSocket(object):
+    def __init__(self) -> None:
+        self.incoming = asyncio.Queue()
+        self.sent = []
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.incoming.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def send(self, data):
+        self.sent.append(decode(data))
+
+    def push(self, ticket, cmd):
+        self.incoming.put_nowait(encode(dict(ticket=ticket, cmd=cmd)))
+
+
+class Commands(object):
+    def __init__(self) -> None:
+        self.gate = asyncio.Event()
+        self.running = 0
+        self.peak = 0
+
+    async def slow(self, ws, payload):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await self.gate.wait()
+        finally:
+            self.running -= 1
+        return dict()
+
+    async def ack(self, ws, payload):
+        self.gate.set()
+        raise NoResponse
+
+    def dispatch(self):
+        return dict(slow=self.slow, ack=self.ack)
+
+
+async def settle(ws, handler, commands):
+    commands.gate.set()
+    await asyncio.sleep(0.1)
+    ws.incoming.put_nowait(None)
+    await asyncio.wait_for(handler, 2)
+
+
+class TestCommandLimits(unittest.TestCase):
+
+    def test_inline_control(self):
+
+        async def scenario(inline):
+            ws, commands = FakeSocket(), Commands()
+            limits = CommandLimits(2, 4, None, inline)
+            handler = asyncio.create_task(command_handler(ws, commands.dispatch(), limits=limits))
+            for i in range(3):
+                ws.push(i, 'slow')
+            ws.push(3, 'ack')
+            await asyncio.sleep(0.2)
+            replied = len(ws.sent)
+            await settle(ws, handler, commands)
+            return replied
+
+        self.assertEqual(asyncio.run(scenario(lambda payload: payload['cmd'] == 'ack')), 3)
+        self.assertEqual(asyncio.run(scenario(lambda payload: False)), 0)
+
+    def test_slots(self):
+
+        async def scenario(global_slots):
+            ws, commands = FakeSocket(), Commands()
+            limits = CommandLimits(2, 16, global_slots)
+            handler = asyncio.create_task(command_handler(ws, commands.dispatch(), limits=limits))
+            for i in range(6):
+                ws.push(i, 'slow')
+            await asyncio.sleep(0.1)
+            await settle(ws, handler, commands)
+            return commands.peak, len(ws.sent)
+
+        self.assertEqual(asyncio.run(scenario(None)), (2, 6))
+        self.assertEqual(asyncio.run(scenario(asyncio.Semaphore(1))), (1, 6))
+
+    def test_backpressure(self):
+
+        async def scenario():
+            ws, commands = FakeSocket(), Commands()
+            limits = CommandLimits(1, 1, None, lambda payload: payload['cmd'] == 'ack')
+            handler = asyncio.create_task(command_handler(ws, commands.dispatch(), limits=limits))
+            for i in range(5):
+                ws.push(i, 'slow')
+            await asyncio.sleep(0.1)
+            shed = [m['ticket'] for m in ws.sent if m['code'] == 26]
+            ws.push(5, 'ack')
+            await asyncio.sleep(0.1)
+            unblocked = commands.gate.is_set()
+            await settle(ws, handler, commands)
+            return shed, unblocked, sorted(m['ticket'] for m in ws.sent if m['code'] == 0)
+
+        # the burst is read before the dispatcher runs: one queued, the rest shed while the reader keeps reading
+        self.assertEqual(asyncio.run(scenario()), ([1, 2, 3, 4], True, [0]))
+
+    def test_upstream(self):
+
+        async def scenario():
+            ws, commands = FakeSocket(), Commands()
+            handler = asyncio.create_task(command_handler(ws, commands.dispatch(), limits=upstream_limits()))
+            for i in range(200):
+                ws.push(i, 'slow')
+            await asyncio.sleep(0.2)
+            peak = commands.peak
+            await settle(ws, handler, commands)
+            return peak, len(ws.sent)
+
+        self.assertEqual(asyncio.run(scenario()), (200, 200))
+
+class TestCodec(unittest.TestCase):
+
+    def test_binary(self):
+        data = bytes(range(256))
+        for codec in ['json', 'msgpack']:
+            payload = decode(encode(dict(cmd='tcprecv', d=data, p=0), codec))
+            self.assertEqual(as_bytes(payload['d']), data)
+        self.assertIsInstance(decode(encode(dict(d=data), 'msgpack'))['d'], bytes)
@@ -0,0 +1,34 @@
+import asyncio
+import unittest
+from unittest import mock
+from ariesdockerd import central
+from ariesdockerd.protocol import NoResponse
+
+
+class TestReconnect(unittest.TestCase):
+
+    def connect(self, ws):
+        central.state_store[ws] = central.CentralState()
+        with self.assertRaises(NoResponse):
+            asyncio.run(central.daemon_handler(ws, dict()))
+        return central.daemon_nodes['A']
+
+    def test_stale_cleanup(self):
+        old_ws, new_ws = object(), object()
+        with mock.patch.dict(central.state_store, clear=True), \
+                mock.patch.dict(central.daemon_nodes, clear=True), \
+                mock.patch.dict(central.followers, dict(f1=('A', 0.0)), clear=True), \
+                mock.patch.object(central, 'daemons', set()), \
+                mock.patch.object(central, 'check_auth', return_value='A'), \
+                mock.patch.object(central, 'resync_node'), \
+                mock.patch.object(central, 'cluster') as cluster:
+            self.connect(old_ws)
+            fresh = self.connect(new_ws)
+            central.state_store[old_ws].cleanup()
+            self.assertIs(central.daemon_nodes['A'], fresh)
+            self.assertIn('f1', central.followers)
+            cluster.drop.assert_not_called()
+            central.state_store[new_ws].cleanup()
+            self.assertNotIn('A', central.daemon_nodes)
+            self.assertNotIn('f1', central.followers)
+            cluster.drop.assert_called_once_with('A')
@@ -0,0 +1,21 @@
+import time
+import unittest
+from ariesdockerd.reservations import ReservationTable
+
+
+class TestReservations(unittest.TestCase):
+
+    def test_leases(self):
+        table = ReservationTable(60)
+        a = table.reserve('A', [0, 1], 'u', 'job-0')
+        b = table.reserve('A', [4], 'u', 'job-1')
+        table.reserve('B', [2], 'v', 'other', ttl=-1)
+        self.assertSetEqual(table.held('A'), {0, 1, 4})
+        self.assertDictEqual(table.apply({'A': [0, 1, 2, 3, 4], 'B': [2, 3]}), {'A': [2, 3], 'B': [2, 3]})
+        self.assertNotIn('B', table.by_node)
+        self.assertTrue(table.release(a.lease_id))
+        self.assertFalse(table.release(a.lease_id))
+        self.assertSetEqual(table.held('A'), {4})
+        self.assertListEqual(table.expire(time.time() + 120), [b])
+        self.assertDictEqual(table.leases, {})
+        self.assertDictEqual(table.by_node, {})
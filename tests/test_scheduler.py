@@ -1,6 +1,21 @@
 import unittest
 from ariesdockerd.error import AriesError
-from ariesdockerd.scheduling import schedule
+from ariesdockerd.scheduling import schedule, schedule_batch, fragmentation, SegmentAllocator
+from ariesdockerd.topology import parse_topo_matrix, p2p_capable, best_set
+
+
+TOPO = '''
+        GPU0    GPU1    GPU2    GPU3    NIC0    CPU Affinity    NUMA Affinity
+GPU0     X      SYS     NV12    PIX     SYS     0-23    0
+GPU1    SYS      X      PIX     NV12    SYS     0-23    0
+GPU2    NV12    PIX      X      SYS     SYS     0-23    0
+GPU3    PIX     NV12    SYS      X      SYS     0-23    0
+NIC0    SYS     SYS     SYS     SYS      X
+
+Legend:
+
+  X    = Self
+'''
 
 
 class TestScheduler(unittest.TestCase):
@@ -23,3 +38,74 @@ class TestScheduler(unittest.TestCase):
             (schedule({'A': [0, 1, 2], 'B': [5, 6]}, 3, 0)),
             ([('A', []), ('B', []), ('A', [])])
         )
+
+    def test_image_locality(self):
+        available = {'A': [0, 1, 2, 3], 'B': [0, 1, 2, 3], 'C': [0, 1]}
+        for _ in range(10):
+            self.assertListEqual(schedule({k: list(v) for k, v in available.items()}, 1, 4, preferred={'B'}), [('B', [0, 1, 2, 3])])
+            self.assertListEqual(schedule({k: list(v) for k, v in available.items()}, 1, 2, preferred={'B'}), [('C', [0, 1])])
+            self.assertListEqual(schedule({'A': [0], 'B': [0]}, 1, 0, preferred={'A'}), [('A', [])])
+        sched = schedule({k: list(v) for k, v in available.items()}, 1, 4, policy='batch', preferred={'A'})
+        self.assertListEqual(sched, [('A', [0, 1, 2, 3])])
+
+    def test_allocator(self):
+        alloc = SegmentAllocator({'A': [0, 1, 2, 4, 5, 6, 7], 'B': [1, 2]})
+        self.assertEqual(alloc.allocate(2), ('B', [1, 2]))
+        self.assertEqual(alloc.allocate(2), ('A', [0, 1]))
+        self.assertEqual(alloc.allocate(4), ('A', [4, 5, 6, 7]))
+        self.assertIsNone(alloc.allocate(2))
+        self.assertEqual(alloc.allocate(1), ('A', [2]))
+        self.assertListEqual(alloc.free('A'), [])
+
+    def test_large_array(self):
+        available = {'N%d' % i: list(range(16 if i % 2 else 8)) for i in range(64)}
+        sched = schedule(available, 768, 1)
+        self.assertEqual(len(sched), 768)
+        self.assertEqual(len(set((node, gpus[0]) for node, gpus in sched)), 768)
+        self.assertTrue(all(len(gpus) == 0 for gpus in available.values()))
+        self.assertRaises(AriesError, schedule, available, 1, 1)
+
+    def test_topology(self):
+        matrix = parse_topo_matrix(TOPO)
+        self.assertListEqual(matrix[0], [0, 1, 22, 5])
+        self.assertListEqual(best_set(matrix, [0, 1, 2, 3], 2)[1], [0, 2])
+        self.assertListEqual(best_set(matrix, [0, 1, 3], 2)[1], [1, 3])
+        self.assertTrue(p2p_capable(matrix, [0, 3]))
+        self.assertFalse(p2p_capable(matrix, [0, 1]))
+        self.assertFalse(p2p_capable(None, [0, 2]))
+        self.assertListEqual(
+            sorted(schedule({'A': [0, 1, 2, 3]}, 2, 2, {'A': matrix})),
+            [('A', [0, 2]), ('A', [1, 3])]
+        )
+        self.assertListEqual(schedule({'A': [0, 1, 2, 3], 'B': [0, 1]}, 1, 2, {'A': matrix}), [('B', [0, 1])])
+        self.assertListEqual(
+            schedule({'A': [0, 1, 2, 3], 'B': list(range(8))}, 1, 2, {'A': matrix, 'B': [[0] * 8] * 8}),
+            [('A', [0, 2])]
+        )
+        self.assertListEqual(schedule({'A': [0, 1, 3], 'B': [4, 5, 6, 7]}, 1, 2, {'A': matrix}), [('A', [0, 1])])
+        self.assertListEqual(schedule({'A': [0, 2, 3]}, 1, 2, {'A': matrix}), [('A', [2, 3])])
+        sys_only = [[0, 1], [1, 0]]
+        self.assertListEqual(schedule({'A': [0, 1]}, 1, 2, {'A': sys_only}), [('A', [0, 1])])
+
+    def test_batch(self):
+        self.assertEqual(fragmentation({'A': list(range(8))}), 0.0)
+        self.assertEqual(fragmentation({'A': [0], 'B': [3]}), 1.0)
+        self.assertAlmostEqual(fragmentation({'A': [0, 1, 2, 3, 5, 6]}), 1 - 10 / 18)
+        available = {'A': list(range(8)), 'B': [0, 1, 2, 5, 6, 7], 'C': [2, 3]}
+        scheds, score = schedule_batch(dict((k, list(v)) for k, v in available.items()), [(3, 1), (2, 2), (1, 4)], seed=7)
+        again, score2 = schedule_batch(dict((k, list(v)) for k, v in available.items()), [(3, 1), (2, 2), (1, 4)], seed=7)
+        self.assertListEqual(scheds, again)
+        self.assertEqual(score, score2)
+        self.assertListEqual([len(s) for s in scheds], [3, 2, 1])
+        self.assertListEqual([len(g) for _, g in scheds[2]], [4])
+        greedy = dict((k, list(v)) for k, v in available.items())
+        schedule(greedy, 2, 2)
+        schedule(greedy, 3, 1)
+        schedule(greedy, None, 4)
+        self.assertLessEqual(score, fragmentation(greedy))
+        scoped, _ = schedule_batch(
+            dict((k, list(v)) for k, v in available.items()), [(1, 2), (2, 1)], scopes=[({'C'}, None), ({'B'}, {'B'})]
+        )
+        self.assertListEqual(scoped[0], [('C', [2, 3])])
+        self.assertTrue(all(node == 'B' for node, _ in scoped[1]))
+        self.assertEqual(len(schedule(dict(A=[0, 1, 2, 3]), 2, 2, policy='batch')), 2)
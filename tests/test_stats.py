@@ -0,0 +1,30 @@
+import time
+import unittest
+from ariesdockerd.stats import Histogram, Phases, PhaseStats
+
+
+class TestStats(unittest.TestCase):
+
+    def test_histogram(self):
+        hist = Histogram()
+        for v in [0.001, 0.002, 0.003, 1.0]:
+            hist.observe(v)
+        summary = hist.summary()
+        self.assertEqual(summary['count'], 4)
+        self.assertEqual(summary['max'], 1.0)
+        self.assertLessEqual(summary['p50'], 0.004)
+
+    def test_phases(self):
+        phases = Phases()
+        time.sleep(0.01)
+        phases.mark('pull')
+        phases.mark('run')
+        phases.mark('pull')
+        self.assertListEqual(list(phases.timings), ['pull', 'run'])
+        self.assertGreaterEqual(phases.timings['pull'], 0.01)
+        stats = PhaseStats()
+        stats.record(phases.timings, 'node.')
+        stats.record(dict(dispatch=0.5))
+        summary = stats.summary()
+        self.assertListEqual(list(summary), ['dispatch', 'node.pull', 'node.run'])
+        self.assertEqual(summary['dispatch']['count'], 1)
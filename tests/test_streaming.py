@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import unittest
+from ariesdockerd.streaming import CreditStream, StreamCancelled, slices, window, awindow, last_bytes
+
+
+class TestStreaming(unittest.TestCase):
+
+    def test_chunks(self):
+        sent = []
+        stream = CreditStream('s', 100, sent.append)
+        data = 'héllo wörld\n'.encode() * 50
+        res = stream.pump(slices(data, 7), 64)
+        self.assertEqual(''.join(x['data'] for x in sent), data.decode())
+        self.assertListEqual([x['seq'] for x in sent], list(range(len(sent))))
+        self.assertEqual(res['chunks'], len(sent))
+        self.assertTrue(all(len(x['data'].encode()) <= 64 + 7 for x in sent))
+
+    def test_window(self):
+        sent = []
+        stream = CreditStream('s', 2, sent.append, timeout=0.2)
+        with self.assertRaises(TimeoutError):
+            stream.pump(slices(b'x' * 100, 10), 10)
+        self.assertEqual(len(sent), 2)
+
+    def test_ack_and_cancel(self):
+        stream = CreditStream('s', 1, lambda chunk: stream.ack(chunk['seq']), timeout=5)
+        stream.pump(slices(b'x' * 100, 10), 10)
+        self.assertEqual(stream.seq, 10)
+        blocked = CreditStream('t', 1, lambda chunk: None, timeout=5)
+        threading.Timer(0.1, blocked.cancel).start()
+        with self.assertRaises(StreamCancelled):
+            blocked.pump(slices(b'x' * 100, 10), 10)
+
+    def test_cancel_closes_source(self):
+        release = threading.Event()
+
+        class Follow(object):
+            closed = False
+
+            def __iter__(self):
+                yield b'first\n'
+                release.wait(5)
+                if self.closed:
+                    raise ConnectionError('closed')
+                yield b'late\n'
+
+            def close(self):
+                self.closed = True
+                release.set()
+
+        sent = []
+        stream = CreditStream('f', 8, sent.append)
+        source = Follow()
+        threading.Timer(0.1, stream.cancel).start()
+        with self.assertRaises(StreamCancelled):
+            stream.pump(stream.closing(source), 1024, eager=True)
+        self.assertTrue(source.closed)
+        self.assertListEqual([x['data'] for x in sent], ['first\n'])
+
+    def test_byte_window(self):
+        source = [b'abc', b'defg', b'hi']
+        self.assertEqual(b''.join(window(source, 2, 5)), b'cdefg')
+        self.assertEqual(b''.join(window(source, 4)), b'efghi')
+        self.assertEqual(b''.join(window(source, 20)), b'')
+
+    def test_async_window(self):
+        pulled = []
+
+        async def source():
+            for b in [b'abc', b'defg', b'hi', b'jk']:
+                pulled.append(b)
+                yield b
+
+        async def collect(start, length):
+            return b''.join([b async for b in awindow(source(), start, length)])
+
+        self.assertEqual(asyncio.run(collect(2, 5)), b'cdefg')
+        self.assertListEqual(pulled, [b'abc', b'defg'])
+        pieces, dropped = asyncio.run(last_bytes(source(), 4))
+        self.assertEqual((b''.join(pieces), dropped), (b'hijk', 7))
+        pieces, dropped = asyncio.run(last_bytes(source(), 5))
+        self.assertEqual((b''.join(pieces), dropped), (b'defghijk', 3))
@@ -0,0 +1,90 @@
+import time
+import queue
+import unittest
+from ariesdockerd.tailer import LogTailers
+
+
+class FakeStream(object):
+    def __init__(self) -> None:
+        self.q = queue.Queue()
+        self.closed = False
+
+    def __iter__(self):
+        while True:
+            b = self.q.get()
+            if b is None:
+                return
+            yield b
+
+    def close(self):
+        self.closed = True
+        self.q.put(None)
+
+
+class FakeLogs(object):
+    def __init__(self) -> None:
+        self.streams = []
+
+    def follow(self, key, tail):
+        stream = FakeStream()
+        self.streams.append(stream)
+        return stream
+
+    def tail(self, key, n):
+        return b'seed\n'
+
+
+def make(capacity=1024, idle=60.0):
+    logs = FakeLogs()
+    return logs, LogTailers(lambda c: c, logs.follow, logs.tail, capacity, idle)
+
+
+def wait_streams(logs, n):
+    for _ in range(100):
+        if len(logs.streams) >= n:
+            return
+        time.sleep(0.01)
+
+
+class TestTailer(unittest.TestCase):
+
+    def test_fanout(self):
+        logs, tailers = make()
+        a = tailers.follow('c')
+        wait_streams(logs, 1)
+        b = tailers.follow('c')
+        self.assertEqual(len(logs.streams), 1)
+        logs.streams[0].q.put(b'hello\n')
+        self.assertEqual(a.poll(1024, 1.0), 'hello\n')
+        self.assertEqual(b.poll(1024, 1.0), 'seed\nhello\n')
+        self.assertDictEqual(tailers.stats(), dict(tailers=1, followers=2, buffered_bytes=0, dropped_bytes=0))
+        a.close()
+        self.assertFalse(logs.streams[0].closed)
+        b.close()
+        self.assertTrue(logs.streams[0].closed)
+        self.assertEqual(tailers.stats()['tailers'], 0)
+
+    def test_ring_and_evict(self):
+        logs, tailers = make(capacity=12, idle=5.0)
+        a = tailers.follow('c')
+        wait_streams(logs, 1)
+        for i in range(5):
+            logs.streams[0].q.put(b'line%d\n' % i)
+        for _ in range(100):
+            if tailers.stats()['dropped_bytes'] == 18:
+                break
+            time.sleep(0.01)
+        self.assertEqual(a.poll(1024, 1.0), 'line3\nline4\n')
+        self.assertEqual(tailers.evict(time.monotonic() + 1), 0)
+        self.assertEqual(tailers.evict(time.monotonic() + 10), 1)
+        self.assertTrue(logs.streams[0].closed)
+        with self.assertRaises(KeyError):
+            tailers.get(a.follower_id)
+
+    def test_source_end(self):
+        logs, tailers = make()
+        a = tailers.follow('c')
+        wait_streams(logs, 1)
+        logs.streams[0].q.put(b'bye\n')
+        logs.streams[0].q.put(None)
+        self.assertListEqual(list(a), [b'bye\n'])